@@ -36,7 +36,8 @@ s.start()
 
 print("Nodes started at:", datetime.now().strftime("%H:%M:%S"))
 
-cs = CassandraStress(env['loadgenerator_public_ips'], props, scylla_tools=False)
+cs = CassandraStress(env['loadgenerator_public_ips'], props, scylla_tools=False,
+                     schema_check=s.wait_for_schema_agreement)
 cs.install()
 cs.prepare()
 
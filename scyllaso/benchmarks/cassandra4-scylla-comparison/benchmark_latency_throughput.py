@@ -9,7 +9,9 @@ from scyllaso.cs import CassandraStress
 from scyllaso.common import Iteration
 from scyllaso.scylla import Scylla
 from scyllaso.hdr import parse_profile_summary_file
+from scyllaso.slo import SloGuard, LatencySlo
 from scyllaso.cassandra import Cassandra
+from scyllaso.ssh import PSSH
 from datetime import datetime
 
 print("Test started at:", datetime.now().strftime("%H:%M:%S"))
@@ -46,6 +48,8 @@ RATE_INCREMENT = props['rate_increment'] #10000
 DURATION_MINUTES = props['duration_minutes']
 
 MAX_90_PERCENTILE_LATENCY = 1000.0
+# A step is aborted once the p90 is above the max for this many consecutive seconds.
+SLO_CONSECUTIVE_INTERVALS = 60
 
 WRITE_COUNT = props['write_count']
 READ_COUNT = props['read_count']
@@ -64,32 +68,48 @@ else:
 
 print("Nodes started at:", datetime.now().strftime("%H:%M:%S"))
 
-cs = CassandraStress(env['loadgenerator_public_ips'], props)
+cs = CassandraStress(env['loadgenerator_public_ips'], props, schema_check=cluster.wait_for_schema_agreement)
 cs.install()
 cs.prepare()
 
-print("Loading started at:", datetime.now().strftime("%H:%M:%S"))
+# A dataset saved by an earlier run on the same cluster skips the load; it needs to be
+# named after everything that shapes the data, e.g. '1tb_lcs'.
+DATASET_NAME = props.get('dataset_name')
 
-THROTTLE = (100000 // loadgenerator_count) if props['cluster_type'] == 'scylla' else (56000 // loadgenerator_count)
+if DATASET_NAME is not None and cluster.has_dataset(DATASET_NAME):
+    print("Restoring dataset started at:", datetime.now().strftime("%H:%M:%S"))
+    cluster.restore_dataset(DATASET_NAME)
+else:
+    print("Loading started at:", datetime.now().strftime("%H:%M:%S"))
+
+    THROTTLE = (100000 // loadgenerator_count) if props['cluster_type'] == 'scylla' else (56000 // loadgenerator_count)
+
+    cs.stress_seq_range(ROW_COUNT, 'write cl=QUORUM', f'-schema "replication(strategy=SimpleStrategy,replication_factor={REPLICATION_FACTOR})" "compaction(strategy={COMPACTION_STRATEGY})" -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 -rate "threads=700 throttle={THROTTLE}/s" -node {cluster_string}')
 
-cs.stress_seq_range(ROW_COUNT, 'write cl=QUORUM', f'-schema "replication(strategy=SimpleStrategy,replication_factor={REPLICATION_FACTOR})" "compaction(strategy={COMPACTION_STRATEGY})" -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 -rate "threads=700 throttle={THROTTLE}/s" -node {cluster_string}')
+    cluster.nodetool("flush")
 
-cluster.nodetool("flush")
+    cluster.wait_for_compactions()
 
-confirm = input("Has compaction finished? Input 'yes':")
-while confirm != 'yes':
-    confirm = input("Has compaction finished? Input 'yes':")    
+    if DATASET_NAME is not None:
+        cluster.save_dataset(DATASET_NAME)
 
 print("Run started at:", datetime.now().strftime("%H:%M:%S"))
 
+# Preflight: the clock offsets of all hosts, so the timelines of the hdr logs, Prometheus and
+# any perf recordings can be lined up.
+clock_offsets = PSSH(cluster_public_ips, props['cluster_user'], props['ssh_options']).measure_clock_offsets()
+clock_offsets.update(PSSH(loadgenerator_public_ips, props['loadgenerator_user'], props['ssh_options']).measure_clock_offsets())
+
 rate = START_RATE
 
 while True:
     print("Run iteration started at:", datetime.now().strftime("%H:%M:%S"))
 
-    iteration = Iteration(f'{profile_name}/cassandra-stress-{rate}', ignore_git=True)
+    iteration = Iteration(f'{profile_name}/cassandra-stress-{rate}', ignore_git=True, properties=props, environment=env)
+    iteration.record_clock_offsets(clock_offsets)
 
-    cs.stress(f'mixed ratio\\(write={WRITE_COUNT},read={READ_COUNT}\\) duration={DURATION_MINUTES}m cl=QUORUM -pop dist=UNIFORM\\(1..{ROW_COUNT}\\) -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 -rate "threads=500 fixed={rate // loadgenerator_count}/s" -node {cluster_string}')
+    slo = SloGuard(LatencySlo(90.0, MAX_90_PERCENTILE_LATENCY, consecutive_intervals=SLO_CONSECUTIVE_INTERVALS))
+    cs.stress(f'mixed ratio\\(write={WRITE_COUNT},read={READ_COUNT}\\) duration={DURATION_MINUTES}m cl=QUORUM -pop dist=UNIFORM\\(1..{ROW_COUNT}\\) -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 -rate "threads=500 fixed={rate // loadgenerator_count}/s" -node {cluster_string}', slo=slo)
 
     cs.collect_results(iteration.dir)
 
@@ -106,7 +126,11 @@ while True:
             writer.write(f'WRITE_PROFILE: {write_profile_summary}\n')
         if READ_COUNT > 0:
             writer.write(f'READ_PROFILE: {read_profile_summary}\n')
+        if slo.failed:
+            writer.write(f'SLO_VIOLATION: {slo.violation}\n')
 
+    if slo.failed:
+        break
     if WRITE_COUNT > 0 and write_profile_summary.p90_latency_ms > MAX_90_PERCENTILE_LATENCY:
         break
     if READ_COUNT > 0 and read_profile_summary.p90_latency_ms > MAX_90_PERCENTILE_LATENCY:
@@ -59,7 +59,7 @@ else:
 
 print("Nodes started at:", datetime.now().strftime("%H:%M:%S"))
 
-cs = CassandraStress(env['loadgenerator_public_ips'], props)
+cs = CassandraStress(env['loadgenerator_public_ips'], props, schema_check=cluster.wait_for_schema_agreement)
 cs.install()
 cs.prepare()
 
@@ -71,9 +71,7 @@ cs.stress_seq_range(ROW_COUNT, 'write cl=QUORUM', f'-schema "replication(strateg
 
 cluster.nodetool("flush")
 
-confirm = input("Has compaction finished? Input 'yes':")
-while confirm != 'yes':
-    confirm = input("Has compaction finished? Input 'yes':")    
+cluster.wait_for_compactions()
 
 print("Run started at:", datetime.now().strftime("%H:%M:%S"))
 
@@ -82,7 +80,7 @@ rate = START_RATE
 while True:
     print("Run iteration started at:", datetime.now().strftime("%H:%M:%S"))
 
-    iteration = Iteration(f'{profile_name}/cassandra-stress-{rate}', ignore_git=True)
+    iteration = Iteration(f'{profile_name}/cassandra-stress-{rate}', ignore_git=True, properties=props, environment=env)
 
     cs.stress(f'mixed ratio\\(write={WRITE_COUNT},read={READ_COUNT}\\) duration={DURATION_MINUTES}m cl=QUORUM -pop dist=UNIFORM\\(1..{ROW_COUNT}\\) -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 maxPending=1024 -rate "threads=500 fixed={rate // loadgenerator_count}/s" -node {cluster_string}')
 
@@ -62,7 +62,7 @@ else:
 
 print("Nodes started at:", datetime.now().strftime("%H:%M:%S"))
 
-cs = CassandraStress(env['loadgenerator_public_ips'], props)
+cs = CassandraStress(env['loadgenerator_public_ips'], props, schema_check=cluster.wait_for_schema_agreement)
 cs.install()
 cs.prepare()
 
@@ -89,7 +89,7 @@ rate = START_RATE
 while True:
     print("Run iteration started at:", datetime.now().strftime("%H:%M:%S"))
 
-    iteration = Iteration(f'{profile_name}/cassandra-stress-{rate}', ignore_git=True)
+    iteration = Iteration(f'{profile_name}/cassandra-stress-{rate}', ignore_git=True, properties=props, environment=env)
 
     cs.stress(f'mixed ratio\\(write={WRITE_COUNT},read={READ_COUNT}\\) duration={DURATION_MINUTES}m cl=QUORUM -pop dist=GAUSSIAN\\(1..{ROW_COUNT},{GAUSS_CENTER},{GAUSS_SIGMA}\\) -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 -rate "threads=500 fixed={rate // loadgenerator_count}/s" -node {cluster_string}')
 
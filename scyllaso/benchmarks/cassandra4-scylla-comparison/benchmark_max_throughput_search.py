@@ -0,0 +1,107 @@
+#!/bin/python3
+
+import sys
+
+from scyllaso import common
+from scyllaso.cs import CassandraStress
+from scyllaso.scylla import Scylla
+from scyllaso.throughput_search import MaxThroughputSearch
+from scyllaso.cassandra import Cassandra
+from datetime import datetime
+
+print("Test started at:", datetime.now().strftime("%H:%M:%S"))
+
+if len(sys.argv) < 2:
+    raise Exception("Usage: ./benchmark_max_throughput_search.py [PROFILE_NAME]")
+
+# Load properties
+profile_name = sys.argv[1]
+props = common.load_yaml(f'{profile_name}.yml')
+env = common.load_yaml(f'environment_{profile_name}.yml')
+cluster_private_ips = env['cluster_private_ips']
+cluster_string = ",".join(cluster_private_ips)
+cluster_public_ips = env['cluster_public_ips']
+loadgenerator_public_ips = env['loadgenerator_public_ips']
+loadgenerator_count = len(loadgenerator_public_ips)
+
+# Run parameters
+
+# Row size of default cassandra-stress workload.
+# Measured experimentally.
+ROW_SIZE_BYTES = 210 * 1024 * 1024 * 1024 / 720_000_000
+
+# 1TB per node
+#TARGET_DATASET_SIZE = len(cluster_private_ips) * 1024 * 1024 * 1024 * 1024
+TARGET_DATASET_SIZE = props['target_dataset_size_gb'] * 1024 * 1024 * 1024
+
+REPLICATION_FACTOR = 3
+COMPACTION_STRATEGY = props['compaction_strategy']
+ROW_COUNT = int(TARGET_DATASET_SIZE / ROW_SIZE_BYTES / REPLICATION_FACTOR)
+
+START_RATE     = props['start_rate'] #10000
+# The precision of the found rate; the bisection stops once the passing and failing rates are this close.
+RATE_RESOLUTION = props['rate_increment'] #10000
+DURATION_MINUTES = props['duration_minutes']
+PROBE_DURATION_MINUTES = props.get('probe_duration_minutes', 5)
+
+MAX_90_PERCENTILE_LATENCY = 1000.0
+
+WRITE_COUNT = props['write_count']
+READ_COUNT = props['read_count']
+
+# Start Scylla/Cassandra nodes
+if props['cluster_type'] == 'scylla':
+    cluster = Scylla(env['cluster_public_ips'], env['cluster_private_ips'], env['cluster_private_ips'][0], props)
+    cluster.install()
+    cluster.start()
+else:
+    cluster = Cassandra(env['cluster_public_ips'], env['cluster_private_ips'], env['cluster_private_ips'][0], props)
+    cluster.install()
+    if "cassandra_extra_env_opts" in props:
+        cluster.append_env_configuration(props["cassandra_extra_env_opts"])
+    cluster.start()
+
+print("Nodes started at:", datetime.now().strftime("%H:%M:%S"))
+
+cs = CassandraStress(env['loadgenerator_public_ips'], props, schema_check=cluster.wait_for_schema_agreement)
+cs.install()
+cs.prepare()
+
+print("Loading started at:", datetime.now().strftime("%H:%M:%S"))
+
+THROTTLE = (100000 // loadgenerator_count) if props['cluster_type'] == 'scylla' else (56000 // loadgenerator_count)
+
+cs.stress_seq_range(ROW_COUNT, 'write cl=QUORUM', f'-schema "replication(strategy=SimpleStrategy,replication_factor={REPLICATION_FACTOR})" "compaction(strategy={COMPACTION_STRATEGY})" -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 -rate "threads=700 throttle={THROTTLE}/s" -node {cluster_string}')
+
+cluster.nodetool("flush")
+
+cluster.wait_for_compactions()
+
+print("Run started at:", datetime.now().strftime("%H:%M:%S"))
+
+operations = []
+if WRITE_COUNT > 0:
+    operations.append('WRITE')
+if READ_COUNT > 0:
+    operations.append('READ')
+
+
+def command(rate, duration_minutes):
+    return f'mixed ratio\\(write={WRITE_COUNT},read={READ_COUNT}\\) duration={duration_minutes}m cl=QUORUM -pop dist=UNIFORM\\(1..{ROW_COUNT}\\) -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 -rate "threads=500 fixed={rate // loadgenerator_count}/s" -node {cluster_string}'
+
+
+search = MaxThroughputSearch(cs, profile_name, command, operations, MAX_90_PERCENTILE_LATENCY,
+                             start_rate=START_RATE,
+                             resolution=RATE_RESOLUTION,
+                             probe_duration_minutes=PROBE_DURATION_MINUTES,
+                             full_duration_minutes=DURATION_MINUTES,
+                             properties=props,
+                             environment=env)
+result = search.run()
+
+for point in result.points:
+    print(point.phase, point.rate, 'passed' if point.passed else 'failed',
+          {operation: summary.p90_latency_ms for operation, summary in point.summaries.items()})
+print("Max throughput:", result.knee_rate)
+
+print("Run ended at:", datetime.now().strftime("%H:%M:%S"))
@@ -51,21 +51,24 @@ else:
 
 print("Nodes started at:", datetime.now().strftime("%H:%M:%S"))
 
-cs = CassandraStress(env['loadgenerator_public_ips'], props)
+cs = CassandraStress(env['loadgenerator_public_ips'], props, schema_check=cluster.wait_for_schema_agreement)
 cs.install()
 cs.prepare()
 
+# 'load_mode: bulk' loads the data as sstables instead of through the CQL write path.
+load_seq_range = cs.bulk_load_seq_range if props.get('load_mode') == 'bulk' else cs.stress_seq_range
+
 print("Loading started at:", datetime.now().strftime("%H:%M:%S"))
 
-cs.stress_seq_range(ROW_COUNT, 'write cl=QUORUM',
-                    f'-schema "replication(strategy=SimpleStrategy,replication_factor={REPLICATION_FACTOR})" "compaction(strategy={COMPACTION_STRATEGY})" -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 -rate "threads=700 throttle=33000/s" -node {cluster_string}')
+load_seq_range(ROW_COUNT, 'write cl=QUORUM',
+               f'-schema "replication(strategy=SimpleStrategy,replication_factor={REPLICATION_FACTOR})" "compaction(strategy={COMPACTION_STRATEGY})" -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 -rate "threads=700 throttle=33000/s" -node {cluster_string}')
 
 print("Sleeping 2h")
 time.sleep(60 * 60 * 2)
 
 print("Run started at:", datetime.now().strftime("%H:%M:%S"))
 
-iteration = Iteration(f'{profile_name}/repair_no_errors', ignore_git=True)
+iteration = Iteration(f'{profile_name}/repair_no_errors', ignore_git=True, properties=props, environment=env)
 
 repair_start = datetime.now()
 
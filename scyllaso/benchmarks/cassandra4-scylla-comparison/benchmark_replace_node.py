@@ -67,28 +67,31 @@ else:
 print("Nodes started at:", datetime.now().strftime("%H:%M:%S"))
 
 # Setup cassandra stress
-cs = CassandraStress(env['loadgenerator_public_ips'], props)
+cs = CassandraStress(env['loadgenerator_public_ips'], props, schema_check=cluster.wait_for_schema_agreement)
 cs.install()
 cs.prepare()
 
+# 'load_mode: bulk' loads the data as sstables instead of through the CQL write path.
+load_seq_range = cs.bulk_load_seq_range if props.get('load_mode') == 'bulk' else cs.stress_seq_range
+
 print("Loading started at:", datetime.now().strftime("%H:%M:%S"))
 
 THROTTLE = (100000 // loadgenerator_count) if props['cluster_type'] == 'scylla' else (56000 // loadgenerator_count)
 
-cs.stress_seq_range(ROW_COUNT, 'write cl=QUORUM', f'-schema "replication(strategy=SimpleStrategy,replication_factor={REPLICATION_FACTOR})" "compaction(strategy={COMPACTION_STRATEGY})" -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 -rate "threads=700 throttle={THROTTLE}/s" -node {cluster_string}')
+load_seq_range(ROW_COUNT, 'write cl=QUORUM', f'-schema "replication(strategy=SimpleStrategy,replication_factor={REPLICATION_FACTOR})" "compaction(strategy={COMPACTION_STRATEGY})" -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 -rate "threads=700 throttle={THROTTLE}/s" -node {cluster_string}')
 
 cluster.nodetool("flush")
 
-confirm = input("Has compaction finished? Input 'yes':")
-while confirm != 'yes':
-    confirm = input("Has compaction finished? Input 'yes':")  
+cluster.wait_for_compactions()
 
 print("Run started at:", datetime.now().strftime("%H:%M:%S"))
 
-# Background load
-background_load = cs.loop_stress(f'mixed ratio\\(write=1,read=1\\) duration=5m cl=QUORUM -pop dist=UNIFORM\\(1..{ROW_COUNT}\\) -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 -rate "threads=700 throttle={BACKGROUND_LOAD_OPS // loadgenerator_count}/s" -node {cluster_string}')
+iteration = Iteration(f'{profile_name}/replace-node', ignore_git=True, properties=props, environment=env)
 
-iteration = Iteration(f'{profile_name}/replace-node', ignore_git=True)
+# Background load; the reports of the load phase are not part of the iteration.
+cs.clear_results()
+background_load = cs.background_stress(lambda rate: f'mixed ratio\\(write=1,read=1\\) duration=5m cl=QUORUM -pop dist=UNIFORM\\(1..{ROW_COUNT}\\) -log hdrfile=profile.hdr -graph file=report.html title=benchmark revision=benchmark-0 -mode native cql3 -rate "threads=700 throttle={rate}/s" -node {cluster_string}',
+    BACKGROUND_LOAD_OPS)
 
 # Turn off node to be replaced.
 cluster.stop(load_index=(start_count - 1), erase_data=True)
@@ -113,6 +116,7 @@ print("Replacing node took:", (replace_node_end - replace_node_start).total_seco
 with open(f'{iteration.dir}/result.txt', 'a') as writer:
     writer.write(f'Replacing node took (s): {(replace_node_end - replace_node_start).total_seconds()}\n')
 
-background_load.request_stop()
-background_load.join()
+background_load.stop()
 print("Background load ended:", datetime.now().strftime("%H:%M:%S"))
+
+cs.collect_results(iteration.dir)
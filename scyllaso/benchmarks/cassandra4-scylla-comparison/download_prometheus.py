@@ -17,6 +17,6 @@ profile_name = sys.argv[1]
 props = common.load_yaml(f'{profile_name}.yml')
 env = common.load_yaml(f'environment_{profile_name}.yml')
 
-iteration = Iteration(f'{profile_name}/prometheus-dump', ignore_git=True)
+iteration = Iteration(f'{profile_name}/prometheus-dump', ignore_git=True, properties=props, environment=env)
 
 prometheus.download(env, props, iteration)
@@ -12,9 +12,11 @@ env = common.load_yaml('environment.yml')
 cluster_private_ips = env['cluster_private_ips']
 cluster_string = ",".join(cluster_private_ips)
 
-iteration = Iteration("dummy-benchmark")
+iteration = Iteration("dummy-benchmark", properties=props, environment=env)
 
-bench = ScyllaBench(env['loadgenerator_public_ips'], props)
+bench = ScyllaBench(env['loadgenerator_public_ips'], props,
+                    schema_check=lambda: scylla.cluster_schema_agreement(
+                        env['cluster_public_ips'], props['cluster_user'], props['ssh_options']))
 bench.install()
 bench.prepare()
 
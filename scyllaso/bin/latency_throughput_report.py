@@ -0,0 +1,23 @@
+import argparse
+from scyllaso.results import ResultsIndex
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Builds the throughput-vs-latency curves of the rate steps in the "
+                                                 "trials directory and compares trials side by side.")
+    parser.add_argument("trials", help="The trials to compare, e.g. a Scylla and a Cassandra profile", nargs='*')
+    parser.add_argument("--trials-dir", help="The trials directory", default="trials")
+    parser.add_argument("--operation", help="The operations to report", action='append')
+    parser.add_argument("--field", help="The ProfileSummaryResult field to compare", default="p90_latency_ms")
+
+    args = parser.parse_args()
+
+    operations = args.operation if args.operation else ['WRITE', 'READ']
+    index = ResultsIndex(args.trials_dir, operations).update()
+    index.write_curves()
+
+    trials = args.trials if args.trials else index.trials()
+    for operation in operations:
+        print(f"{operation}:")
+        print(index.compare(trials, operation, args.field))
+        print()
@@ -0,0 +1,43 @@
+import argparse
+import json
+from scyllaso.catalog import ResultsCatalog, METRIC_FIELDS
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Queries the results catalog of the iterations.")
+    parser.add_argument("--catalog", help="The catalog file; defaults to trials/catalog.db")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Backfill the catalog from a trials directory")
+    import_parser.add_argument("trials_dir", nargs='?', default="trials")
+
+    query_parser = subparsers.add_parser("query", help="Query the iterations and their metrics")
+    query_parser.add_argument("--trial", help="A substring of the trial name")
+    query_parser.add_argument("--property", help="A required property value, e.g. compaction_strategy=LeveledCompactionStrategy",
+                              action='append', default=[])
+    query_parser.add_argument("--operation", help="The operation, e.g. WRITE")
+    query_parser.add_argument("--metric", help="A metric filter, e.g. 'p99_latency_ms<10'", action='append', default=[])
+    query_parser.add_argument("--limit", type=int)
+    query_parser.add_argument("--csv", help="Export the rows to this csv file instead of printing them")
+    query_parser.add_argument("--json", help="Print the rows as json", action='store_true')
+
+    args = parser.parse_args()
+
+    with ResultsCatalog(args.catalog) as catalog:
+        if args.command == "import":
+            catalog.import_trials(args.trials_dir)
+            return
+
+        properties = dict(p.split('=', 1) for p in args.property)
+        rows = catalog.query(trial=args.trial, properties=properties, operation=args.operation,
+                             metric_filters=args.metric, limit=args.limit)
+        if args.csv:
+            catalog.export_csv(rows, args.csv)
+            print(f"Exported {len(rows)} rows to [{args.csv}]")
+        elif args.json:
+            print(json.dumps(rows, indent=2))
+        else:
+            for row in rows:
+                metrics = ' '.join(f'{field}={row[field]}' for field in METRIC_FIELDS if row[field] is not None)
+                print(f"{row['trial_name']} {row['name']} {row['operation'] or '-'} {metrics}")
+            print(f"{len(rows)} rows")
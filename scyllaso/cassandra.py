@@ -1,8 +1,11 @@
 from datetime import datetime
 from scyllaso.ssh import PSSH, SSH
 from scyllaso.util import run_parallel, find_java, log, log_important, log_machine
-from scyllaso.network_wait import wait_for_cql_start
+from scyllaso.cql import wait_for_cql_start
 from scyllaso.raid import RAID
+from scyllaso.compaction import wait_for_compactions
+from scyllaso.schema import wait_for_schema_agreement
+from scyllaso.dataset import save_dataset_script, restore_dataset_script, has_dataset_command
 
 
 class Cassandra:
@@ -31,15 +34,40 @@ class Cassandra:
     def __new_ssh(self, ip):
         return SSH(ip, self.ssh_user, self.properties['ssh_options'])
 
-    def __install(self, ip):
+    def __tarball(self):
+        return f"apache-cassandra-{self.cassandra_version}-bin.tar.gz"
+
+    def __install_packages(self, ip):
         ssh = self.__new_ssh(ip)
         ssh.update()
-        log_machine(ip, "Installing Cassandra: started")
         ssh.install_one('openjdk-16-jdk', 'java-16-openjdk')
         ssh.install('wget')
+
+    # The Cassandra tarball and the exporter are downloaded only by the first node;
+    # the nodes relay them to each other over the private network.
+    def __download(self):
+        log_important("Installing Cassandra: downloading")
+        download_tarball = f"wget -q -N https://archive.apache.org/dist/cassandra/{self.cassandra_version}/{self.__tarball()}"
+        download_exporter = "wget -q -N https://github.com/criteo/cassandra_exporter/releases/download/2.3.5/cassandra_exporter-2.3.5.jar"
+        self.__new_ssh(self.cluster_public_ips[0]).exec(f"""
+            set -e
+            {download_tarball}
+            {download_exporter}
+        """)
+        # a node the relay fails for downloads the file itself.
+        pssh = PSSH(self.cluster_public_ips, self.ssh_user, self.properties['ssh_options'])
+        pssh.relay(self.__tarball(), private_ips=self.cluster_private_ips, fallback_command=download_tarball)
+        pssh.relay("cassandra_exporter-2.3.5.jar", private_ips=self.cluster_private_ips,
+                   fallback_command=download_exporter)
+        log_important("Installing Cassandra: downloading done")
+
+    def __install(self, ip):
+        ssh = self.__new_ssh(ip)
+        log_machine(ip, "Installing Cassandra: started")
         private_ip = self.__find_private_ip(ip)
         path_prefix = 'cassandra-raid/' if self.setup_raid else './'
-        ssh.exec(f"""
+        batch = ssh.batch()
+        batch.add(f"""
             set -e
             
             if [ -d '{path_prefix}apache-cassandra-{self.cassandra_version}' ]; then
@@ -47,20 +75,18 @@ class Cassandra:
                 exit 0
             fi
             
-            wget -q -N https://archive.apache.org/dist/cassandra/{self.cassandra_version}/apache-cassandra-{self.cassandra_version}-bin.tar.gz
-            tar -xzf apache-cassandra-{self.cassandra_version}-bin.tar.gz -C {path_prefix}
-            
-            wget -q https://github.com/criteo/cassandra_exporter/releases/download/2.3.5/cassandra_exporter-2.3.5.jar
-        """)
-        ssh.scp_to_remote("jvm11-server.options",
-                          f"{path_prefix}apache-cassandra-{self.cassandra_version}/conf/jvm11-server.options")
-        ssh.scp_to_remote("cassandra.yaml",
-                          f"{path_prefix}apache-cassandra-{self.cassandra_version}/conf/cassandra.yaml")
-        ssh.scp_to_remote("cassandra-exporter.yml", f"config.yml")
+            tar -xzf {self.__tarball()} -C {path_prefix}
+        """, name="extract cassandra")
         # FIXME - heap in MB * 2
-        ssh.exec("""
+        batch.add("""
             sudo sh -c "echo 262144 > /proc/sys/vm/max_map_count"
         """)
+        batch.exec()
+        ssh.upload("jvm11-server.options",
+                   f"{path_prefix}apache-cassandra-{self.cassandra_version}/conf/jvm11-server.options")
+        ssh.upload("cassandra.yaml",
+                   f"{path_prefix}apache-cassandra-{self.cassandra_version}/conf/cassandra.yaml")
+        ssh.upload("cassandra-exporter.yml", f"config.yml")
         ssh.exec(f"""
             cd {path_prefix}apache-cassandra-{self.cassandra_version}
             sudo sed -i \"s/seeds:.*/seeds: {self.seed_private_ip} /g\" conf/cassandra.yaml
@@ -81,6 +107,84 @@ class Cassandra:
             ssh = self.__new_ssh(self.cluster_public_ips[load_index])
             ssh.exec(f"{path_prefix}apache-cassandra-{self.cassandra_version}/bin/nodetool {command}")
 
+    def __compaction_stats(self, ip):
+        path_prefix = 'cassandra-raid/' if self.setup_raid else './'
+        return self.__new_ssh(ip).exec_capture(
+            f"{path_prefix}apache-cassandra-{self.cassandra_version}/bin/nodetool compactionstats")
+
+    def wait_for_compactions(self, stable_seconds=300, timeout_seconds=12 * 3600, poll_interval_seconds=30):
+        """
+        Polls 'nodetool compactionstats' on all nodes in parallel and returns once there are no
+        pending or active compactions for stable_seconds. Raises on timeout.
+        """
+        return wait_for_compactions(self.cluster_public_ips, self.__compaction_stats, stable_seconds,
+                                    timeout_seconds, poll_interval_seconds)
+
+    def wait_for_schema_agreement(self, timeout_seconds=300):
+        """
+        Waits till all nodes agree on the schema according to 'nodetool describecluster'.
+        """
+        path_prefix = 'cassandra-raid/' if self.setup_raid else './'
+        ssh = self.__new_ssh(self.cluster_public_ips[0])
+        return wait_for_schema_agreement(lambda: ssh.exec_capture(
+            f"{path_prefix}apache-cassandra-{self.cassandra_version}/bin/nodetool describecluster"), timeout_seconds)
+
+    # The dataset scripts change directory, so the paths need to be absolute.
+    def __home(self):
+        path_prefix = 'cassandra-raid/' if self.setup_raid else './'
+        return f"$HOME/{path_prefix}apache-cassandra-{self.cassandra_version}"
+
+    def __saved_datasets_dir(self):
+        # On the RAID next to the Cassandra installation, so the hardlinks work.
+        path_prefix = 'cassandra-raid/' if self.setup_raid else './'
+        return f"$HOME/{path_prefix}saved-datasets"
+
+    def __save_dataset(self, ip, name):
+        log_machine(ip, f"Saving dataset [{name}]")
+        self.__new_ssh(ip).exec(save_dataset_script(name, f"{self.__home()}/bin/nodetool", f"{self.__home()}/data/data",
+                                                    self.__saved_datasets_dir(), self.__find_private_ip(ip)))
+
+    def save_dataset(self, name):
+        """
+        Saves the current data of all nodes as a named dataset, e.g. after the load and compaction
+        finished. The dataset is a hardlinked snapshot, so it takes seconds and no extra space until
+        the sstables get compacted away.
+        """
+        log_important(f"Saving dataset [{name}]: started")
+        run_parallel(self.__save_dataset, [(ip, name) for ip in self.cluster_public_ips])
+        log_important(f"Saving dataset [{name}]: done")
+
+    def __has_dataset(self, ip, name):
+        output = self.__new_ssh(ip).exec_capture(
+            has_dataset_command(name, self.__saved_datasets_dir(), self.__find_private_ip(ip)))
+        return output.strip() == 'yes'
+
+    def has_dataset(self, name):
+        return all(self.__has_dataset(ip, name) for ip in self.cluster_public_ips)
+
+    def __restore_dataset(self, ip, name, reflink):
+        log_machine(ip, f"Restoring dataset [{name}]")
+        self.__new_ssh(ip).exec(restore_dataset_script(name, f"{self.__home()}/data/data",
+                                                       f"{self.__home()}/data/commitlog", self.__saved_datasets_dir(),
+                                                       self.__find_private_ip(ip), reflink=reflink))
+
+    def restore_dataset(self, name, reflink=False):
+        """
+        Replaces the data of all nodes by a dataset saved with save_dataset and restarts the cluster.
+        The dataset can only be restored on the cluster it was saved on.
+
+        Parameters
+        ----------
+        reflink: bool
+            Restore using reflinks (cp --reflink=always, e.g. XFS) instead of hardlinks. With hardlinks
+            the restored sstables share the inodes with the dataset.
+        """
+        log_important(f"Restoring dataset [{name}]: started")
+        self.stop()
+        run_parallel(self.__restore_dataset, [(ip, name, reflink) for ip in self.cluster_public_ips])
+        self.start()
+        log_important(f"Restoring dataset [{name}]: done")
+
     def install(self):
         log_important("Installing Cassandra: started")
         if self.setup_raid:
@@ -88,6 +192,8 @@ class Cassandra:
             raid = RAID(self.cluster_public_ips, self.ssh_user, '/dev/nvme*n1', 'cassandra-raid', 0, self.properties)
             raid.install()
             log_important("Installing Cassandra: finished setting up RAID")
+        run_parallel(self.__install_packages, [(ip,) for ip in self.cluster_public_ips])
+        self.__download()
         run_parallel(self.__install, [(ip,) for ip in self.cluster_public_ips])
         log_important("Installing Cassandra: done")
 
@@ -129,9 +235,10 @@ class Cassandra:
 
     def start(self):
         log_important(f"Starting Cassandra nodes {self.cluster_public_ips}")
+        # Nodes are started one by one since joining nodes must bootstrap one at a time.
         for public_ip in self.cluster_public_ips:
             self.__start(public_ip)
-            wait_for_cql_start(public_ip)
+            wait_for_cql_start(public_ip, timeout=900)
             log_machine(public_ip, f"""Node finished bootstrapping at {datetime.now().strftime("%H:%M:%S")}""")
             self.__start_exporter(public_ip)
         log_important(f"Starting Cassandra nodes {self.cluster_public_ips}: done")
@@ -0,0 +1,236 @@
+import os
+import csv
+import json
+import re
+import sqlite3
+from datetime import datetime
+from scyllaso.hdr import ProfileSummaryResult, parse_profile_summary_file, profile_summary_operations
+from scyllaso.results import iteration_time
+from scyllaso.util import log, LogLevel
+
+CATALOG_FILE_NAME = 'catalog.db'
+
+METRIC_FIELDS = list(ProfileSummaryResult._fields)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS iterations (
+    id INTEGER PRIMARY KEY,
+    dir TEXT NOT NULL UNIQUE,
+    trial_name TEXT,
+    name TEXT,
+    created TEXT,
+    experimental INTEGER DEFAULT 0,
+    git_head TEXT,
+    description TEXT,
+    properties TEXT,
+    environment TEXT
+);
+CREATE INDEX IF NOT EXISTS iterations_trial_name ON iterations (trial_name);
+CREATE INDEX IF NOT EXISTS iterations_created ON iterations (created);
+
+CREATE TABLE IF NOT EXISTS properties (
+    iteration_id INTEGER NOT NULL REFERENCES iterations (id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (iteration_id, key)
+);
+CREATE INDEX IF NOT EXISTS properties_key_value ON properties (key, value);
+
+CREATE TABLE IF NOT EXISTS metrics (
+    iteration_id INTEGER NOT NULL REFERENCES iterations (id) ON DELETE CASCADE,
+    operation TEXT NOT NULL,
+    {', '.join(f"{field} {'INTEGER' if field == 'ops_count' else 'REAL'}" for field in METRIC_FIELDS)},
+    PRIMARY KEY (iteration_id, operation)
+);
+CREATE INDEX IF NOT EXISTS metrics_operation_p90 ON metrics (operation, p90_latency_ms);
+CREATE INDEX IF NOT EXISTS metrics_operation_p99 ON metrics (operation, p99_latency_ms);
+CREATE INDEX IF NOT EXISTS metrics_operation_throughput ON metrics (operation, throughput_per_second);
+"""
+
+METRIC_FILTER_PATTERN = re.compile(r'^(\w+)\s*(<=|>=|<|>|=)\s*([-+0-9.eE]+)$')
+
+
+def default_catalog_path():
+    # Same location as the trials directory of common.Iteration.
+    return os.path.join(os.getcwd(), 'trials', CATALOG_FILE_NAME)
+
+
+class ResultsCatalog:
+    """
+    A SQLite catalog of the iterations: trial name, git HEAD, description, the profile properties
+    and environment, and the summary metrics per operation. The properties are also stored as
+    indexed key/value rows, so queries like 'compaction_strategy=LeveledCompactionStrategy and
+    WRITE p99 < 10ms' don't need to walk the trials directory.
+    """
+
+    def __init__(self, path=None):
+        self.path = default_catalog_path() if path is None else path
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=60)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iteration_id(self, dir):
+        dir = os.path.realpath(dir)
+        row = self.connection.execute("SELECT id FROM iterations WHERE dir = ?", (dir,)).fetchone()
+        if row is not None:
+            return row[0]
+        cursor = self.connection.execute("INSERT INTO iterations (dir, name) VALUES (?, ?)",
+                                         (dir, os.path.basename(dir)))
+        return cursor.lastrowid
+
+    def record_iteration(self, dir, trial_name=None, name=None, created=None, experimental=None, git_head=None,
+                         description=None, properties=None, environment=None):
+        """
+        Records an iteration; only the fields that are passed are updated, so a backfill with
+        import_trials keeps what the Iteration recorded while the benchmark ran.
+        """
+        with self.connection:
+            iteration_id = self.__iteration_id(dir)
+            self.connection.execute(
+                """UPDATE iterations SET trial_name = COALESCE(?, trial_name), name = COALESCE(?, name),
+                   created = COALESCE(?, created, ?), experimental = COALESCE(?, experimental),
+                   git_head = COALESCE(?, git_head), description = COALESCE(?, description),
+                   properties = COALESCE(?, properties), environment = COALESCE(?, environment) WHERE id = ?""",
+                (trial_name, name, created.isoformat(timespec='seconds') if created is not None else None,
+                 datetime.now().isoformat(timespec='seconds'), int(experimental) if experimental is not None else None,
+                 git_head, description, json.dumps(properties, default=str) if properties is not None else None,
+                 json.dumps(environment, default=str) if environment is not None else None, iteration_id))
+            if properties is None:
+                return iteration_id
+            self.connection.execute("DELETE FROM properties WHERE iteration_id = ?", (iteration_id,))
+            for key, value in properties.items():
+                if isinstance(value, (dict, list)):
+                    continue
+                self.connection.execute("INSERT INTO properties (iteration_id, key, value) VALUES (?, ?, ?)",
+                                        (iteration_id, key, str(value)))
+        return iteration_id
+
+    def record_metrics(self, dir, summaries):
+        """
+        Records the summaries of an iteration; summaries maps the operation to its ProfileSummaryResult.
+        """
+        with self.connection:
+            iteration_id = self.__iteration_id(dir)
+            for operation, summary in summaries.items():
+                self.connection.execute(
+                    f"""INSERT OR REPLACE INTO metrics (iteration_id, operation, {', '.join(METRIC_FIELDS)})
+                        VALUES (?, ?, {', '.join('?' for _ in METRIC_FIELDS)})""",
+                    (iteration_id, operation, *summary))
+
+    def record_summary_file(self, dir, summary_file=None):
+        """
+        Records the metrics of every operation in the profile-summary.txt of the iteration.
+        """
+        summary_file = os.path.join(dir, 'profile-summary.txt') if summary_file is None else summary_file
+        if not os.path.exists(summary_file):
+            return
+        self.record_metrics(dir, {operation: parse_profile_summary_file(summary_file, operation)
+                                  for operation in sorted(profile_summary_operations(summary_file))})
+
+    def query(self, trial=None, properties=None, operation=None, metric_filters=None, limit=None):
+        """
+        Returns a row (dict) per matching iteration and operation.
+
+        Parameters
+        ----------
+        trial: str
+            A substring of the trial name, e.g. '50w_50r_lcs'.
+        properties: dict
+            Property values the iteration needs to have, e.g. {'compaction_strategy': 'LeveledCompactionStrategy'}.
+        operation: str
+            The operation, e.g. 'WRITE'.
+        metric_filters: list
+            Filters like 'p99_latency_ms<10' on the metric fields.
+        """
+        conditions = []
+        args = []
+        if trial is not None:
+            conditions.append("i.trial_name LIKE ?")
+            args.append(f'%{trial}%')
+        for key, value in (properties or {}).items():
+            conditions.append("EXISTS (SELECT 1 FROM properties p WHERE p.iteration_id = i.id AND p.key = ? AND p.value = ?)")
+            args.extend([key, str(value)])
+        if operation is not None:
+            conditions.append("m.operation = ?")
+            args.append(operation)
+        for metric_filter in metric_filters or []:
+            match = METRIC_FILTER_PATTERN.match(metric_filter.strip())
+            if match is None or match.group(1) not in METRIC_FIELDS:
+                raise ValueError(f"Invalid metric filter [{metric_filter}]; expected e.g. 'p99_latency_ms<10'")
+            conditions.append(f"m.{match.group(1)} {match.group(2)} ?")
+            args.append(float(match.group(3)))
+
+        sql = f"""SELECT i.trial_name, i.name, i.created, i.git_head, i.dir, m.operation,
+                         {', '.join(f'm.{field}' for field in METRIC_FIELDS)}
+                  FROM iterations i LEFT JOIN metrics m ON m.iteration_id = i.id"""
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY i.created, i.trial_name, m.operation"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+
+        cursor = self.connection.execute(sql, args)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def export_csv(self, rows, path):
+        if not rows:
+            return
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def import_trials(self, trials_dir):
+        """
+        Backfills the catalog from an existing trials directory.
+        """
+        count = 0
+        for root, dirs, files in os.walk(trials_dir):
+            dirs[:] = [d for d in dirs if d != 'latest']
+            if 'profile-summary.txt' not in files and 'description.txt' not in files:
+                continue
+            description = None
+            if 'description.txt' in files:
+                with open(os.path.join(root, 'description.txt')) as f:
+                    description = f.read().strip()
+            git_head = None
+            if 'HEAD' in files:
+                with open(os.path.join(root, 'HEAD')) as f:
+                    git_head = f.read().strip()
+            name = os.path.basename(root)
+            created = iteration_time(name)
+            self.record_iteration(root, trial_name=os.path.relpath(os.path.dirname(root), trials_dir), name=name,
+                                  created=None if created == datetime.min else created, experimental=name.endswith('_experimental'),
+                                  git_head=git_head, description=description)
+            self.record_summary_file(root)
+            count += 1
+        log(f"Imported {count} iterations from [{trials_dir}]")
+        return count
+
+
+# The hooks for Iteration and collect_results; a broken catalog should never fail a benchmark.
+def catalog_iteration(dir, **kwargs):
+    try:
+        with ResultsCatalog() as catalog:
+            catalog.record_iteration(dir, **kwargs)
+    except Exception as e:
+        log(f"Failed to record iteration [{dir}] in the results catalog: {e}", LogLevel.warning)
+
+
+def catalog_results(dir):
+    try:
+        with ResultsCatalog() as catalog:
+            catalog.record_summary_file(dir)
+    except Exception as e:
+        log(f"Failed to record the results of [{dir}] in the results catalog: {e}", LogLevel.warning)
@@ -0,0 +1,97 @@
+import os
+import time
+from collections import namedtuple
+from scyllaso.util import run_parallel, log_machine
+
+CLOCK_OFFSETS_FILE_NAME = 'clock_offsets.txt'
+
+# offset_seconds is the remote clock minus the local clock; the measurement error is at most rtt_seconds / 2.
+ClockOffset = namedtuple('ClockOffset', ['offset_seconds', 'rtt_seconds'])
+
+
+def measure_clock_offset(ssh, samples=5):
+    """
+    Measures the offset of the clock of a remote host relative to the local clock. The remote time
+    is assumed to be taken halfway the round trip; of all samples the one with the lowest round trip
+    is used since it has the smallest error.
+    """
+    best = None
+    for _ in range(samples):
+        before = time.time()
+        remote = float(ssh.exec_capture("date +%s.%N").strip())
+        after = time.time()
+        rtt = after - before
+        if best is None or rtt < best.rtt_seconds:
+            best = ClockOffset(remote - (before + after) / 2, rtt)
+    return best
+
+
+def measure_clock_offsets(ips, new_ssh, samples=5):
+    """
+    Measures the clock offset of all hosts in parallel; returns a dict from ip to ClockOffset.
+    """
+    offsets = {}
+
+    def measure(ip):
+        offsets[ip] = measure_clock_offset(new_ssh(ip), samples)
+        log_machine(ip, f"Clock offset {offsets[ip].offset_seconds * 1000:.3f}ms "
+                        f"(rtt {offsets[ip].rtt_seconds * 1000:.3f}ms)")
+
+    run_parallel(measure, [(ip,) for ip in ips])
+    return offsets
+
+
+def synchronized_start_command(command, start_time, offset_seconds):
+    """
+    Wraps the command so it starts at start_time (local epoch seconds) according to the remote
+    clock with the given offset. A host that is armed too late starts right away and reports it.
+    """
+    start_ns = int((start_time + offset_seconds) * 1_000_000_000)
+    return f"""
+        delay_ms=$(( ({start_ns} - $(date +%s%N)) / 1000000 ))
+        if [ $delay_ms -gt 0 ]; then
+            sleep $((delay_ms / 1000)).$(printf %03d $((delay_ms % 1000)))
+        else
+            echo "Synchronized start: armed $((-delay_ms))ms too late"
+        fi
+        {command}
+    """
+
+
+def read_clock_offsets(path):
+    """
+    Reads a file written by write_clock_offsets; returns the dict from ip to ClockOffset and the
+    start time (None if not recorded).
+    """
+    offsets = {}
+    start_time = None
+    if not os.path.exists(path):
+        return offsets, start_time
+    values = {}
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.strip().partition('=')
+            if key == 'start_time':
+                start_time = float(value)
+            elif key.endswith('.offset_ms') or key.endswith('.rtt_ms'):
+                ip, _, field = key.rpartition('.')
+                values.setdefault(ip, {})[field] = float(value) / 1000
+    for ip, fields in values.items():
+        offsets[ip] = ClockOffset(fields.get('offset_ms', 0.0), fields.get('rtt_ms', 0.0))
+    return offsets, start_time
+
+
+def write_clock_offsets(path, offsets, start_time=None):
+    """
+    Records the clock offsets in path; the offsets of hosts already in the file are kept unless
+    they are measured again, so the cluster and the load generators can be recorded separately.
+    """
+    existing, existing_start_time = read_clock_offsets(path)
+    existing.update(offsets)
+    start_time = existing_start_time if start_time is None else start_time
+    with open(path, 'w') as f:
+        if start_time is not None:
+            f.write(f"start_time={start_time:.6f}\n")
+        for ip, offset in sorted(existing.items()):
+            f.write(f"{ip}.offset_ms={offset.offset_seconds * 1000:.3f}\n")
+            f.write(f"{ip}.rtt_ms={offset.rtt_seconds * 1000:.3f}\n")
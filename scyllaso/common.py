@@ -3,6 +3,8 @@ import yaml
 import subprocess
 import time
 from datetime import datetime
+from scyllaso.catalog import catalog_iteration
+from scyllaso.clock import write_clock_offsets, CLOCK_OFFSETS_FILE_NAME
 from scyllaso.ssh import SSH
 from scyllaso.util import run_parallel
 
@@ -17,7 +19,10 @@ class Iteration:
     # The purpose of the experimental flag is to modify the name of the trial directory to easily
     # weed out the experimental runs from non experimental ones. Otherwise it is easy to run in a 
     # messed up history where it isn't clear what is experimental and what isn't.
-    def __init__(self, trial_name, description=None, experimental=False, ignore_git=True):
+    #
+    # The properties and environment are optional; they are only recorded in the results catalog.
+    def __init__(self, trial_name, description=None, experimental=False, ignore_git=True, properties=None,
+                 environment=None):
         self.trials_dir_name = "trials"
         self.trials_dir = os.path.join(os.getcwd(), self.trials_dir_name)
         self.trial_name = trial_name
@@ -47,6 +52,7 @@ class Iteration:
                 os.remove(latest_dir)
             os.symlink(self.dir, latest_dir, target_is_directory=True)
 
+        self.git_head = None
         if not ignore_git:
             exitcode = subprocess.call("git status", shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             if exitcode == 0:
@@ -58,12 +64,25 @@ class Iteration:
                         exit(1)
 
                     output = subprocess.check_output("git log --pretty=format:'%h' -n 1", shell=True).decode()
+                    self.git_head = output.strip()
                     git_file = os.path.join(self.dir, "HEAD")
                     with open(git_file, "w") as git_file:
                         print(output, file=git_file)
 
+        catalog_iteration(self.dir, trial_name=trial_name, name=self.name, experimental=experimental,
+                          git_head=self.git_head, description=description, properties=properties,
+                          environment=environment)
+
         print(f'Using iteration directory [{self.dir}]')
 
+    def record_clock_offsets(self, offsets):
+        """
+        Records the clock offsets measured by PSSH.measure_clock_offsets. The hdr logs of the load
+        generators are aligned on them when the results are processed, and they can be used to line
+        up the timelines of the other hosts, e.g. Prometheus data or perf recordings.
+        """
+        write_clock_offsets(os.path.join(self.dir, CLOCK_OFFSETS_FILE_NAME), offsets)
+
 
 def __collect_ec2_metadata(ip, ssh_user, ssh_options, dir):
     dest_dir = os.path.join(dir, ip)
@@ -0,0 +1,66 @@
+import time
+from scyllaso.util import log, log_important, log_machine, run_parallel
+
+
+# Returns (pending tasks, active compactions) from the output of 'nodetool compactionstats'. The
+# active compactions are the rows below the 'id  compaction type ...' header.
+def parse_compaction_stats(output):
+    pending = None
+    active = 0
+    in_table = False
+    for line in output.splitlines():
+        stripped = line.strip()
+        if stripped.lower().startswith('pending tasks:'):
+            pending = int(stripped.split(':', 1)[1].split()[0])
+        elif 'compaction type' in stripped.lower():
+            in_table = True
+        elif in_table and stripped and not stripped.lower().startswith('active compaction remaining time'):
+            active += 1
+    if pending is None:
+        raise ValueError(f"No 'pending tasks' in compactionstats output: {output}")
+    return pending, active
+
+
+def wait_for_compactions(ips, compaction_stats, stable_seconds=300, timeout_seconds=12 * 3600,
+                         poll_interval_seconds=30):
+    """
+    Waits till there are no pending or active compactions on any node for stable_seconds.
+
+    Parameters
+    ----------
+    ips: list
+        The public ips of the nodes.
+    compaction_stats: function
+        Called with an ip; returns the 'nodetool compactionstats' output of that node.
+
+    Returns once the cluster is quiescent and raises on timeout: a benchmark shouldn't measure a
+    cluster that is still compacting.
+    """
+    log_important("Waiting for compactions to finish: started")
+    start_seconds = time.time()
+    quiet_since = None
+    while True:
+        stats = {}
+
+        def poll(ip):
+            stats[ip] = parse_compaction_stats(compaction_stats(ip))
+
+        run_parallel(poll, [(ip,) for ip in ips])
+
+        busy = {ip: s for ip, s in stats.items() if s != (0, 0)}
+        now = time.time()
+        if busy:
+            quiet_since = None
+            for ip, (pending, active) in busy.items():
+                log_machine(ip, f"Compactions: pending={pending} active={active}")
+        elif quiet_since is None:
+            quiet_since = now
+            log(f"No pending compactions; waiting {stable_seconds}s to make sure it stays that way")
+        elif now - quiet_since >= stable_seconds:
+            log_important(f"Waiting for compactions to finish: done after {now - start_seconds:.0f}s")
+            return True
+
+        if now - start_seconds >= timeout_seconds:
+            log_important("Waiting for compactions to finish: timeout")
+            raise Exception(f"Compactions didn't finish within {timeout_seconds}s, still busy: {busy}")
+        time.sleep(poll_interval_seconds)
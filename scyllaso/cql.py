@@ -1,32 +1,128 @@
-from time import sleep
-from datetime import datetime, timedelta
-import socket
-from scyllaso.util import log_machine
+import asyncio
+import struct
+import time
+from scyllaso.util import log_machine, run_async_parallel, Backoff
 
+# A minimal client side of the CQL binary protocol (v4); just enough to check if a node serves
+# requests. An open port isn't sufficient: the port can accept connections before the node
+# completed its bootstrap and is able to respond to requests.
+CQL_PROTOCOL_VERSION = 0x04
+OPCODE_ERROR = 0x00
+OPCODE_STARTUP = 0x01
+OPCODE_READY = 0x02
+OPCODE_AUTHENTICATE = 0x03
+OPCODE_OPTIONS = 0x05
+OPCODE_SUPPORTED = 0x06
 
-def wait_for_cql_start(node_ip, timeout=7200, connect_timeout=10, max_tries_per_second=2):
-    log_machine(node_ip, 'Waiting for CQL port to start (meaning node bootstrap finished). This could take a while.')
 
-    backoff_interval = 1.0 / max_tries_per_second
-    timeout_point = datetime.now() + timedelta(seconds=timeout)
+def __frame(opcode, body=b"", stream=0):
+    return struct.pack(">BBhBI", CQL_PROTOCOL_VERSION, 0, stream, opcode, len(body)) + body
+
+
+def __string(value):
+    encoded = value.encode()
+    return struct.pack(">H", len(encoded)) + encoded
+
+
+def __string_map(values):
+    body = struct.pack(">H", len(values))
+    for key, value in values.items():
+        body += __string(key) + __string(value)
+    return body
+
+
+def __read_string(body, offset):
+    length = struct.unpack_from(">H", body, offset)[0]
+    offset += 2
+    return body[offset:offset + length].decode(), offset + length
+
+
+def __parse_string_multimap(body):
+    result = {}
+    count = struct.unpack_from(">H", body, 0)[0]
+    offset = 2
+    for _ in range(count):
+        key, offset = __read_string(body, offset)
+        value_count = struct.unpack_from(">H", body, offset)[0]
+        offset += 2
+        values = []
+        for _ in range(value_count):
+            value, offset = __read_string(body, offset)
+            values.append(value)
+        result[key] = values
+    return result
+
+
+async def __read_frame(reader):
+    header = await reader.readexactly(9)
+    _, _, _, opcode, length = struct.unpack(">BBhBI", header)
+    body = await reader.readexactly(length)
+    return opcode, body
+
+
+async def __handshake(reader, writer):
+    writer.write(__frame(OPCODE_OPTIONS))
+    await writer.drain()
+    opcode, body = await __read_frame(reader)
+    if opcode != OPCODE_SUPPORTED:
+        return False
+
+    cql_versions = __parse_string_multimap(body).get("CQL_VERSION") or ["3.0.0"]
+    writer.write(__frame(OPCODE_STARTUP, __string_map({"CQL_VERSION": cql_versions[0]}), stream=1))
+    await writer.drain()
+    opcode, _ = await __read_frame(reader)
+    # AUTHENTICATE also means the node is serving; we just don't have credentials.
+    return opcode == OPCODE_READY or opcode == OPCODE_AUTHENTICATE
+
+
+# Returns True if the node completes the OPTIONS->SUPPORTED and STARTUP->READY/AUTHENTICATE exchange.
+async def cql_probe_async(node_ip, port=9042, timeout=10):
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(node_ip, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+    try:
+        return await asyncio.wait_for(__handshake(reader, writer), timeout)
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, struct.error):
+        return False
+    finally:
+        writer.close()
+
+
+def cql_probe(node_ip, port=9042, timeout=10):
+    return asyncio.run(cql_probe_async(node_ip, port=port, timeout=timeout))
+
+
+async def __wait_for_cql_start(node_ip, port, timeout, connect_timeout, max_tries_per_second):
+    log_machine(node_ip, 'Waiting for CQL to start serving (meaning node bootstrap finished). This could take a while.')
+
+    backoff = Backoff(initial_seconds=1.0 / max_tries_per_second)
+    timeout_point = time.time() + timeout
 
     feedback_interval = 20
-    print_feedback_point = datetime.now() + timedelta(seconds=feedback_interval)
-
-    while datetime.now() < timeout_point:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.settimeout(connect_timeout)
-            try:
-                sock.connect((node_ip, 9042))
-            except:
-                # There was a problem connecting to CQL port.
-                sleep(backoff_interval)
-                if datetime.now() > print_feedback_point:
-                    print_feedback_point = datetime.now() + timedelta(seconds=feedback_interval)
-                    log_machine(node_ip, 'Still waiting for CQL port to start...')
-
-            else:
-                log_machine(node_ip, 'Successfully connected to CQL port.')
-                return
+    print_feedback_point = time.time() + feedback_interval
+
+    while time.time() < timeout_point:
+        if await cql_probe_async(node_ip, port=port, timeout=connect_timeout):
+            log_machine(node_ip, 'CQL handshake succeeded.')
+            return
+
+        if time.time() > print_feedback_point:
+            print_feedback_point = time.time() + feedback_interval
+            log_machine(node_ip, 'Still waiting for CQL to start serving...')
+        await asyncio.sleep(backoff.next())
 
     raise Exception(f'Waiting for CQL to start timed out after {timeout} seconds for node: {node_ip}.')
+
+
+# Waits till all nodes serve CQL requests. The nodes are tracked concurrently, so the wait ends
+# when the slowest node is ready instead of after the sum of all waits.
+def wait_for_cql_start_all(node_ips, port=9042, timeout=7200, connect_timeout=10, max_tries_per_second=2):
+    run_async_parallel(__wait_for_cql_start,
+                       [(node_ip, port, timeout, connect_timeout, max_tries_per_second) for node_ip in node_ips])
+
+
+def wait_for_cql_start(node_ip, port=9042, timeout=7200, connect_timeout=10, max_tries_per_second=2):
+    wait_for_cql_start_all([node_ip], port=port, timeout=timeout, connect_timeout=connect_timeout,
+                           max_tries_per_second=max_tries_per_second)
@@ -1,15 +1,98 @@
 import os
+import re
 import time
 
 from datetime import datetime
-from scyllaso.hdr import HdrLogProcessor
-from scyllaso.ssh import SSH
+from scyllaso.catalog import catalog_results
+from scyllaso.clock import measure_clock_offsets, synchronized_start_command, write_clock_offsets, \
+    CLOCK_OFFSETS_FILE_NAME
+from scyllaso.hdr import HdrLogProcessor, LiveHdrTail, LiveHdrView
+from scyllaso.load_phase import LoadPhaseJournal, ChunkScheduler, remaining_chunks, default_journal_path
+from scyllaso.partition import weighted_ranges
+from scyllaso.ssh import SSH, PSSH
 from scyllaso.util import run_parallel, WorkerThread, log_important, log_machine, log, WorkerThreadLoop
 
+# e.g. 'Total partitions          : 1,000,000 [WRITE: 1,000,000]' in the cassandra-stress summary.
+TOTALS_PATTERN = re.compile(r'^Total (partitions|errors)\s*:\s*([\d,]+)')
+# e.g. 'Op rate                   :   51,203 op/s  [WRITE: 51,203 op/s]'
+OP_RATE_PATTERN = re.compile(r'^Op rate\s*:\s*([\d,]+) op/s')
+
+# The hdr file of a background load generation, see BackgroundStress.
+HDR_FILE_PATTERN = re.compile(r'hdrfile=(\S+?)\.hdr')
+
+
+class BackgroundStress:
+    """
+    A continuous background load, see CassandraStress.background_stress. Every generation is a single
+    long lived cassandra-stress per load generator with its own hdr log, <name>.g<generation>.hdr,
+    which are processed as a single <name>.hdr by collect_results.
+
+    A rate change starts the next generation before stopping the current one: the current one is only
+    stopped once the new one logged its first interval, so the load has no gap. During that overlap,
+    typically a few seconds, both generations run.
+    """
+
+    def __init__(self, start_generation, wait_for_generation, stop_generation, rate):
+        self.__start_generation = start_generation
+        self.__wait_for_generation = wait_for_generation
+        self.__stop_generation = stop_generation
+        self.rate = rate
+        self.generation = 0
+        self.__thread = None
+
+    def start(self):
+        self.__thread = self.__start_generation(self.generation, self.rate)
+        return self
+
+    def set_rate(self, rate):
+        """
+        Changes the total rate in ops/s over all load generators.
+        """
+        log_important(f"Background load: rate {self.rate} -> {rate}")
+        thread = self.__start_generation(self.generation + 1, rate)
+        self.__wait_for_generation(self.generation + 1)
+        self.__stop()
+        self.generation += 1
+        self.rate = rate
+        self.__thread = thread
+
+    def __stop(self):
+        if not self.__thread.is_alive():
+            log(f"Background load generation {self.generation} ended before it was stopped: {self.__thread.exception}")
+        self.__stop_generation(self.generation)
+        self.__thread.join()
+
+    def stop(self):
+        """
+        Stops the load right away; cassandra-stress is terminated, not killed, so it flushes its hdr log.
+        """
+        log_important("Background load: stopping")
+        self.__stop()
+        log_important("Background load: stopped")
+
+    # Compatible with the WorkerThreadLoop returned by loop_stress.
+    def request_stop(self):
+        if self.__thread.is_alive():
+            self.stop()
+
+    def join(self):
+        self.__thread.join()
+
+
+# The time between measuring the clock offsets and the synchronized start; enough to arm all load generators.
+SYNCHRONIZED_START_DELAY_SECONDS = 5
+
 
 class CassandraStress:
 
-    def __init__(self, load_ips, properties, scylla_tools=True, performance_governor=True):
+    def __init__(self, load_ips, properties, scylla_tools=True, performance_governor=True, schema_check=None):
+        """
+        Parameters
+        ----------
+        schema_check: function
+            Called after the schema has been created and before the load generators are started,
+            e.g. cluster.wait_for_schema_agreement. Returning False fails the run.
+        """
         self.properties = properties
         self.load_ips = load_ips
         self.ssh_user = properties.get('loadgenerator_user')
@@ -20,6 +103,9 @@ class CassandraStress:
 
         self.scylla_tools = scylla_tools
         self.performance_governor = performance_governor
+        self.schema_check = schema_check
+        # (start_time, clock offsets per load generator) of the last synchronized start.
+        self.last_start = None
 
     def __new_ssh(self, ip):
         return SSH(ip, self.ssh_user, self.properties['ssh_options'])
@@ -68,9 +154,12 @@ class CassandraStress:
         run_parallel(self.__install, [(ip,) for ip in self.load_ips])
         log_important("Installing Cassandra-Stress: done")
 
-    def __stress(self, ip, startup_delay, cmd):
-        time.sleep(startup_delay)
+    # Every cassandra-stress guarded by an SLO runs in an ssh session that is marked with the SLO, so
+    # an abort only stops those runs and not e.g. a background load or the bulk load node.
+    def __slo_marker(self, slo):
+        return f'scyllaso-slo-{id(slo):x}'
 
+    def __full_command(self, cmd, slo=None):
         if self.scylla_tools:
             full_cmd = f'cassandra-stress {cmd}'
         else:
@@ -80,77 +169,569 @@ class CassandraStress:
 
         dt = datetime.now().strftime("%d-%m-%Y_%H-%M-%S")
         full_cmd = full_cmd + f" 2>&1 | tee -a cassandra-stress-{dt}.log"
+        if slo is not None:
+            full_cmd = f': {self.__slo_marker(slo)}; {full_cmd}'
+        return full_cmd
+
+    def __stress(self, ip, cmd, slo=None, start_time=None, offset_seconds=0.0):
+        if slo is not None and slo.failed:
+            log_machine(ip, 'Not starting cassandra-stress; the SLO was already violated')
+            return
+
+        full_cmd = self.__full_command(cmd, slo)
         log(full_cmd)
-        self.__new_ssh(ip).exec(full_cmd)
+        if start_time is not None:
+            full_cmd = synchronized_start_command(full_cmd, start_time, offset_seconds)
+        stdout_handler = None
+        if slo is not None:
+            def stdout_handler(line):
+                log_machine(ip, line)
+                slo.check_output(ip, line)
+        self.__new_ssh(ip).exec(full_cmd, stdout_handler=stdout_handler)
+
+    # Stops the java processes in the ssh sessions marked with the SLO; no -9, so cassandra-stress gets
+    # the chance to flush its hdr log. The brackets keep the pattern from matching the shell that runs this.
+    def __abort(self, ip, slo):
+        marker = self.__slo_marker(slo)
+        self.__new_ssh(ip).exec(f"""
+            for pid in $(pgrep -f '{marker[:-1]}[{marker[-1]}]'); do
+                sid=$(ps -o sid= -p $pid | tr -d ' ')
+                if [ -n "$sid" ]; then
+                    pkill -s $sid java
+                fi
+            done
+            true
+            """, ignore_errors=True)
+
+    # Stops the stress on all the given load generators; it is called from the thread that detected
+    # the SLO violation, so the actual stopping is done on a separate thread.
+    def __abort_all(self, ips, slo):
+        log_important("Cassandra-Stress: aborting")
+        WorkerThread(run_parallel, (self.__abort, [(ip, slo) for ip in ips], True)).start()
+
+    # Starts tailing the hdr log of the command on the given load generators; returns the tails
+    # and the view they feed.
+    def __start_live_tails(self, ips, command, live_view, slo):
+        if slo is not None:
+            if live_view is None:
+                live_view = LiveHdrView()
+            live_view.track_percentiles(*slo.percentiles())
+            live_view.add_listener(slo.check_interval)
+            slo.arm(lambda: self.__abort_all(ips, slo))
+        if live_view is None:
+            return [], None
+        match = re.search(r'hdrfile=(\S+)', command)
+        if match is None:
+            log("No '-log hdrfile=' in the command; live hdr view disabled")
+            return [], live_view
+        tails = [LiveHdrTail(self.__new_ssh(ip), match.group(1), live_view) for ip in ips]
+        for tail in tails:
+            tail.start()
+        return tails, live_view
+
+    def __stop_live_tails(self, tails, live_view, slo):
+        for tail in tails:
+            tail.stop()
+        if live_view is not None:
+            if tails:
+                live_view.flush()
+            if slo is not None:
+                live_view.remove_listener(slo.check_interval)
+
+    # The command without the hdr log and the graph, so a run doesn't end up in the results.
+    def __without_reporting(self, command):
+        command = re.sub(r'-log\s+hdrfile=\S+', '', command)
+        return re.sub(r'-graph(\s+(file|title|revision)=\S+)*', '', command)
+
+    # Creates the schema by running the command for a single operation.
+    def __create_schema(self, ip, command):
+        op, _, options = command.strip().partition(' ')
+        options = re.sub(r'(^|\s)(n|duration)=\S+', ' ', options)
+        if 'no-warmup' not in options:
+            options = 'no-warmup ' + options
+        log_machine(ip, 'Creating schema')
+        self.__stress(ip, f'{op} n=1 {self.__without_reporting(options)}')
+        if self.schema_check is not None and not self.schema_check():
+            raise Exception("The cluster didn't reach schema agreement")
+
+    # Runs a command per load generator in two phases. First the schema is created once, so the load
+    # generators don't race on it. Then the clock offsets are measured and every load generator is
+    # armed to start at the same moment, so their hdr intervals cover the same time window.
+    def __synchronized_stress(self, ips, commands, slo=None, create_schema=True):
+        if len(ips) == 1:
+            self.__stress(ips[0], commands[0], slo)
+            return
+
+        if create_schema:
+            self.__create_schema(ips[0], commands[0])
+        offsets = measure_clock_offsets(ips, self.__new_ssh)
+        start_time = time.time() + SYNCHRONIZED_START_DELAY_SECONDS
+        self.last_start = (start_time, offsets)
+        log(f"Synchronized start at {datetime.fromtimestamp(start_time).strftime('%H:%M:%S.%f')}")
+        run_parallel(self.__stress, [(ip, command, slo, start_time, offsets[ip].offset_seconds)
+                                     for ip, command in zip(ips, commands)])
+
+    def stress(self, command, load_index=None, live_view=None, slo=None):
+        """
+        Parameters
+        ----------
+        command: str
+            The cassandra-stress arguments.
+        load_index: int
+            The index of the load generator to run on. If not set, all load generators are used.
+        live_view: LiveHdrView
+            If set, the hdr log of the command (-log hdrfile=...) is tailed on the load generators
+            while the stress is running and the intervals are merged into this view.
+        slo: SloGuard
+            If set, the SLO policies are evaluated against the live data of the run. On the first
+            violation the stress is stopped on all load generators and slo.failed is set.
+        """
+        ips = self.load_ips if load_index is None else [self.load_ips[load_index]]
+        tails, live_view = self.__start_live_tails(ips, command, live_view, slo)
+        try:
+            if load_index is None:
+                log_important("Cassandra-Stress: started")
+                self.__synchronized_stress(self.load_ips, [command] * len(self.load_ips), slo)
+                log_important("Cassandra-Stress: done")
+            else:
+                log("using load_index " + str(load_index))
+                self.__stress(self.load_ips[load_index], command, slo)
+        finally:
+            self.__stop_live_tails(tails, live_view, slo)
+
+    # The inclusive sequence range of rows 1..row_count per load generator, proportional to the weights.
+    def __seq_ranges(self, row_count, weights=None):
+        return weighted_ranges(1, row_count, [1] * len(self.load_ips) if weights is None else weights)
+
+    def __nproc(self, ip):
+        return int(self.__new_ssh(ip).exec_capture('nproc').strip())
+
+    def __op_rate(self, ip, cmd):
+        op_rate = [0]
+
+        def stdout_handler(line):
+            log_machine(ip, line)
+            match = OP_RATE_PATTERN.match(line.strip())
+            if match is not None:
+                op_rate[0] = int(match.group(1).replace(',', ''))
+
+        self.__new_ssh(ip).exec(self.__full_command(cmd), stdout_handler=stdout_handler)
+        return op_rate[0]
+
+    def capacity(self, calibration_command=None):
+        """
+        Returns the relative capacity of every load generator, to be used as the weights of
+        stress_seq_range and insert. Without calibration_command this is the number of cores. With
+        it, the command (e.g. a 1 minute unthrottled write) is run on all load generators at the
+        same time and the capacity is the achieved op rate; this also catches a slow generator
+        like one with a noisy neighbour.
+        """
+        log_important("Measuring load generator capacity: started")
+        capacities = {}
+        if calibration_command is None:
+            def measure(ip):
+                capacities[ip] = self.__nproc(ip)
+        else:
+            def measure(ip):
+                capacities[ip] = self.__op_rate(ip, self.__without_reporting(calibration_command))
+        run_parallel(measure, [(ip,) for ip in self.load_ips])
+        weights = [capacities[ip] for ip in self.load_ips]
+        for ip, weight in zip(self.load_ips, weights):
+            log_machine(ip, f"Capacity {weight}")
+        if sum(weights) <= 0:
+            raise Exception(f"Calibration failed, capacities {weights}")
+        log_important("Measuring load generator capacity: done")
+        return weights
+
+    # Work stealing: every load generator takes the next chunk as soon as it is done with its previous one.
+    # A chunk is only complete if cassandra-stress wrote all of its rows without errors.
+    def __stress_chunks(self, ip, scheduler, journal, command_part1, command_part2, slo, max_failures=3):
+        failures = 0
+        while not (slo is not None and slo.failed):
+            chunk = scheduler.next()
+            if chunk is None:
+                return
+            # the SLO can have failed while waiting for the chunk.
+            if slo is not None and slo.failed:
+                scheduler.release(chunk)
+                return
+            start, end = chunk
+            expected = end - start + 1
+            log_machine(ip, f"Rows {start}..{end}")
+            try:
+                partitions, errors = self.__stress_totals(
+                    ip, f'{command_part1} n={expected} -pop seq={start}..{end} {command_part2}', slo)
+            except Exception as e:
+                log_machine(ip, f"Rows {start}..{end} failed: {e}")
+                partitions, errors = 0, 1
+            if partitions == expected and errors == 0:
+                # if the chunk can't be journaled, it is retried instead of staying in flight forever.
+                try:
+                    journal.record(start, end)
+                except Exception as e:
+                    log_machine(ip, f"Rows {start}..{end}: failed to record in the journal: {e}")
+                else:
+                    scheduler.done(chunk)
+                    completed, total = scheduler.progress()
+                    log(f"Load phase: {completed}/{total} rows ({100.0 * completed / total:.1f}%)")
+                    continue
+            else:
+                log_machine(ip, f"Rows {start}..{end}: {partitions} of {expected} rows written with {errors} errors")
+            scheduler.retry(chunk)
+            failures += 1
+            if failures >= max_failures:
+                log_machine(ip, f"Giving up after {failures} failed chunks")
+                return
+
+    def __stress_chunked(self, row_count, command_part1, command_part2, chunk_rows, journal_path, slo):
+        command_part2 = self.__without_reporting(command_part2)
+        if journal_path is None:
+            journal_path = default_journal_path(row_count, command_part1, command_part2)
+        journal = LoadPhaseJournal(journal_path)
+        completed = journal.completed()
+        chunks = remaining_chunks(1, row_count, chunk_rows, completed)
+        if completed:
+            log_important(f"Load phase: resuming from [{journal_path}], {len(chunks)} chunks left")
+        if not chunks:
+            # the previous run completed all chunks but didn't get to remove the journal.
+            log_important(f"Load phase: all rows already loaded according to [{journal_path}]")
+            journal.remove()
+            return
+
+        log_important(f"Cassandra-Stress: started, {len(chunks)} chunks of at most {chunk_rows} rows")
+        self.__create_schema(self.load_ips[0], f'{command_part1} {command_part2}')
+        if slo is not None:
+            slo.arm(lambda: self.__abort_all(self.load_ips, slo))
+        scheduler = ChunkScheduler(chunks)
+        run_parallel(self.__stress_chunks,
+                     [(ip, scheduler, journal, command_part1, command_part2, slo) for ip in self.load_ips])
+        remaining = scheduler.remaining()
+        if remaining and not (slo is not None and slo.failed):
+            raise Exception(f"Load phase incomplete, {len(remaining)} chunks left; run it again to resume "
+                            f"from [{journal_path}]")
+        if not remaining:
+            journal.remove()
+        log_important("Cassandra-Stress: done")
+
+    def stress_seq_range(self, row_count, command_part1, command_part2, live_view=None, slo=None, weights=None,
+                         chunk_rows=None, journal_path=None):
+        """
+        Writes the rows 1..row_count, split over the load generators.
 
-    def stress(self, command, load_index=None):
-        if load_index is None:
+        Parameters
+        ----------
+        weights: list
+            The relative capacity of every load generator, e.g. from capacity(). The rows are split
+            proportionally; by default evenly.
+        chunk_rows: int
+            If set, the rows are split in chunks of this size that are handed out to whichever load
+            generator becomes idle, so the load phase doesn't end with a tail where a single load
+            generator is still working. Every chunk is a separate cassandra-stress run; its hdr log
+            and graph are not written. Failed chunks are retried, on any load generator.
+        journal_path: str
+            The journal of completed chunks; with chunk_rows, a load phase that crashed or was aborted
+            resumes where it was when it is run again. Defaults to a file in trials/load_phases named
+            after the row count and the command. It is removed once all chunks are loaded.
+        """
+        if chunk_rows is not None:
+            if live_view is not None:
+                log("The live hdr view isn't supported with chunks")
+            self.__stress_chunked(row_count, command_part1, command_part2, chunk_rows, journal_path, slo)
+            return
+
+        ips = []
+        commands = []
+        for ip, (start, end) in zip(self.load_ips, self.__seq_ranges(row_count, weights)):
+            if end < start:
+                log_machine(ip, "No rows")
+                continue
+            ips.append(ip)
+            commands.append(f'{command_part1} n={end - start + 1} -pop seq={start}..{end} {command_part2}')
+            log_machine(ip, commands[-1])
+
+        tails, live_view = self.__start_live_tails(ips, command_part1 + command_part2, live_view, slo)
+        try:
             log_important("Cassandra-Stress: started")
-            run_parallel(self.__stress, [(ip, 10 if i > 0 else 0, command) for i, ip in enumerate(self.load_ips)])
+            self.__synchronized_stress(ips, commands, slo)
             log_important("Cassandra-Stress: done")
-        else:
-            log("using load_index " + str(load_index))
-            self.__stress(self.load_ips[load_index], 0, command)
-
-    def stress_seq_range(self, row_count, command_part1, command_part2):
-        load_ip_count = len(self.load_ips)
-        row_count_per_ip = row_count // load_ip_count
-        range_points = [1]
-        for i in range(load_ip_count):
-            range_points.append(range_points[-1] + row_count_per_ip)
-        range_points[-1] = row_count
-
-        population_commands = []
-        # FIXME - cleanup
-        for i in range(len(range_points) - 1):
-            population_commands.append(
-                f' n={range_points[i + 1] - range_points[i] + 1} -pop seq={range_points[i]}..{range_points[i + 1]} ')
-
-        print(population_commands)
-
-        log_important("Cassandra-Stress: started")
-        run_parallel(self.__stress,
-                     [(ip, 10 if i > 0 else 0, command_part1 + pop_command + command_part2) for i, (ip, pop_command) in
-                      enumerate(zip(self.load_ips, population_commands))])
-        log_important("Cassandra-Stress: done")
+        finally:
+            self.__stop_live_tails(tails, live_view, slo)
+
+    def __bulk_cassandra_version(self):
+        if self.scylla_tools:
+            # the scylla-tools sstableloader reads sstables up to the 'mc' format of Cassandra 3.x.
+            return self.properties.get('bulk_load_cassandra_version', '3.11.10')
+        return self.properties['cassandra_version']
+
+    def __bulk_home(self):
+        return f'bulk-load/apache-cassandra-{self.__bulk_cassandra_version()}'
+
+    # Starts a throw away single node Cassandra on localhost of the load generator. It only holds
+    # the sstables of the chunk that is being loaded.
+    def __start_bulk_node(self, ip):
+        log_machine(ip, 'Starting bulk load node')
+        version = self.__bulk_cassandra_version()
+        self.__new_ssh(ip).exec(f"""
+            set -e
+            mkdir -p bulk-load
+            cd bulk-load
+            if [ ! -d apache-cassandra-{version} ]; then
+                wget -q -N https://archive.apache.org/dist/cassandra/{version}/apache-cassandra-{version}-bin.tar.gz
+                tar -xzf apache-cassandra-{version}-bin.tar.gz
+            fi
+            cd apache-cassandra-{version}
+            # truncate would otherwise keep the loaded sstables in a snapshot.
+            sed -i "s/auto_snapshot:.*/auto_snapshot: false/g" conf/cassandra.yaml
+            if [ -f cassandra.pid ]; then
+                kill $(cat cassandra.pid) || true
+                rm -f cassandra.pid
+            fi
+            rm -rf data logs
+            bin/cassandra -p cassandra.pid > cassandra.out 2>&1 &
+            for i in $(seq 1 120); do
+                if bin/nodetool status 2>/dev/null | grep -q '^UN'; then
+                    exit 0
+                fi
+                sleep 5
+            done
+            echo "Bulk load node didn't start, see {self.__bulk_home()}/cassandra.out"
+            exit 2
+        """)
+        log_machine(ip, 'Starting bulk load node: done')
+
+    def __stop_bulk_node(self, ip):
+        self.__new_ssh(ip).exec(f"""
+            cd {self.__bulk_home()}
+            if [ -f cassandra.pid ]; then
+                pid=$(cat cassandra.pid)
+                kill $pid || true
+                while kill -0 $pid 2>/dev/null; do
+                    sleep 1
+                done
+                rm -f cassandra.pid
+            fi
+            rm -rf data
+        """, ignore_errors=True)
+
+    # Runs the cassandra-stress command and returns the 'Total partitions' and 'Total errors' of its summary.
+    def __stress_totals(self, ip, cmd, slo=None):
+        totals = {}
+
+        def stdout_handler(line):
+            log_machine(ip, line)
+            if slo is not None:
+                slo.check_output(ip, line)
+            match = TOTALS_PATTERN.match(line.strip())
+            if match is not None:
+                totals[match.group(1)] = int(match.group(2).replace(',', ''))
+
+        full_cmd = self.__full_command(cmd, slo)
+        log(full_cmd)
+        self.__new_ssh(ip).exec(full_cmd, stdout_handler=stdout_handler)
+        return totals.get('partitions', 0), totals.get('errors', 0)
+
+    def __bulk_load(self, ip, start, end, local_command_part1, local_command_part2, nodes, keyspace, table,
+                    chunk_rows):
+        self.__start_bulk_node(ip)
+        sstableloader = 'sstableloader' if self.scylla_tools else f'{self.__bulk_home()}/bin/sstableloader'
+        loaded = 0
+        try:
+            for chunk_start in range(start, end + 1, chunk_rows):
+                chunk_end = min(chunk_start + chunk_rows - 1, end)
+                expected = chunk_end - chunk_start + 1
+                log_machine(ip, f'Bulk load: generating rows {chunk_start}..{chunk_end}')
+                partitions, errors = self.__stress_totals(
+                    ip, f'{local_command_part1} n={expected} -pop seq={chunk_start}..{chunk_end} {local_command_part2}')
+                if errors > 0 or partitions != expected:
+                    raise Exception(f"Bulk load on [{ip}]: generating rows {chunk_start}..{chunk_end} wrote "
+                                    f"{partitions} partitions with {errors} errors, expected {expected}")
+                log_machine(ip, f'Bulk load: streaming rows {chunk_start}..{chunk_end}')
+                self.__new_ssh(ip).exec(f"""
+                    set -e
+                    {self.__bulk_home()}/bin/nodetool flush {keyspace} {table}
+                    {sstableloader} -d {nodes} $(ls -d {self.__bulk_home()}/data/data/{keyspace}/{table}-*)
+                    {self.__bulk_home()}/bin/nodetool truncate {keyspace} {table}
+                """)
+                loaded += expected
+        finally:
+            self.__stop_bulk_node(ip)
+        log_machine(ip, f'Bulk load: loaded {loaded} rows')
+        return loaded
+
+    def bulk_load_seq_range(self, row_count, command_part1, command_part2, keyspace='keyspace1', table='standard1',
+                            chunk_rows=50_000_000, verify_sample=100_000, weights=None):
+        """
+        An alternative to stress_seq_range that bypasses the CQL write path of the cluster: every
+        load generator writes its sequence range with cassandra-stress into a single node Cassandra
+        on localhost, unthrottled and with replication factor 1, and streams the resulting sstables
+        into the cluster with sstableloader. This is done in chunks of chunk_rows, so the load
+        generators only need disk space for a single chunk.
+
+        The schema is created on the cluster by writing the first row with the original command without
+        its reporting options, so it has the replication and compaction settings of the benchmark.
+
+        The rows written locally are verified per chunk against the cassandra-stress summary; afterwards
+        verify_sample random rows of the whole range are read from the cluster with cl=ONE, which
+        fails if any of them is missing.
+
+        Parameters
+        ----------
+        row_count: int
+            The number of rows.
+        command_part1: str
+            The part of the cassandra-stress command before the population, e.g. 'write cl=QUORUM'.
+        command_part2: str
+            The part of the cassandra-stress command after the population; it needs to contain -node.
+        weights: list
+            The relative capacity of every load generator; see stress_seq_range.
+        """
+        match = re.search(r'-node\s+(\S+)', command_part2)
+        if match is None:
+            raise Exception(f"No -node in [{command_part2}]")
+        nodes = match.group(1)
+
+        log_important(f"Bulk load of {row_count} rows: started")
+        start_seconds = time.time()
+
+        self.__create_schema(self.load_ips[0], f'{command_part1} -pop seq=1..1 {command_part2}')
+
+        # Locally there is a single node without any throttling.
+        local_command_part1 = re.sub(r'cl=\w+', 'cl=ONE', command_part1)
+        local_command_part2 = re.sub(r'replication_factor=\d+', 'replication_factor=1', command_part2)
+        local_command_part2 = re.sub(r'-node\s+\S+', '-node 127.0.0.1', local_command_part2)
+        local_command_part2 = re.sub(r'\s*throttle=\d+/s', '', local_command_part2)
+        local_command_part2 = self.__without_reporting(local_command_part2)
+
+        ranges = self.__seq_ranges(row_count, weights)
+        run_parallel(self.__bulk_load, [(ip, start, end, local_command_part1, local_command_part2, nodes, keyspace,
+                                         table, chunk_rows) for ip, (start, end) in zip(self.load_ips, ranges)
+                                        if end >= start])
+
+        duration_seconds = time.time() - start_seconds
+        log(f"Bulk load: {row_count} rows in {duration_seconds:.0f} seconds")
+        if verify_sample > 0:
+            self.verify_seq_range(row_count, command_part2, sample=verify_sample)
+        log_important(f"Bulk load of {row_count} rows: done")
+
+    def verify_seq_range(self, row_count, command_part2, sample=100_000):
+        """
+        Reads sample random rows of the sequence range 1..row_count from the cluster with cl=ONE
+        and raises if any of them is missing.
+        """
+        match = re.search(r'-node\s+(\S+)', command_part2)
+        if match is None:
+            raise Exception(f"No -node in [{command_part2}]")
+        mode = re.search(r'-mode\s+native\s+cql3', command_part2)
+        sample = min(sample, row_count)
+        log(f"Verifying {sample} of {row_count} rows")
+        partitions, errors = self.__stress_totals(
+            self.load_ips[0], f'read n={sample} cl=ONE no-warmup -pop dist=UNIFORM\\(1..{row_count}\\) '
+                              f'{mode.group(0) if mode else ""} -rate threads=100 -node {match.group(1)}')
+        if errors > 0 or partitions < sample:
+            raise Exception(f"Verification of {row_count} rows failed: read {partitions} of {sample} sampled rows "
+                            f"with {errors} errors")
+        log(f"Verifying {sample} of {row_count} rows: done")
 
     def async_stress(self, command, load_index=None):
         thread = WorkerThread(self.stress, (command, load_index))
         thread.start()
         return thread.future
 
+    # The command of a background load generation: it runs for at most max_duration_hours and logs
+    # to its own hdr log and graph.
+    def __generation_command(self, command, generation, max_duration_hours):
+        if re.search(r'(^|\s)duration=\S+', command):
+            command = re.sub(r'(^|\s)duration=\S+', f'\\1duration={max_duration_hours}h', command)
+        else:
+            op, _, options = command.strip().partition(' ')
+            command = f'{op} duration={max_duration_hours}h {options}'
+        command = HDR_FILE_PATTERN.sub(f'hdrfile=\\1.g{generation}.hdr', command)
+        return re.sub(r'(-graph\s+file=)(\S+?)\.html', f'\\1\\2.g{generation}.html', command)
+
+    def __start_generation(self, command, max_duration_hours, generation, total_rate):
+        # the exact split of the total rate over the load generators.
+        rates = [end - start + 1 for start, end in weighted_ranges(0, total_rate, [1] * len(self.load_ips))]
+        commands = [self.__generation_command(command(rate), generation, max_duration_hours) for rate in rates]
+        log_important(f"Background load: starting generation {generation} at {total_rate} ops/s")
+        thread = WorkerThread(self.__synchronized_stress, (self.load_ips, commands, None, generation == 0))
+        thread.start()
+        return thread
+
+    def __generation_hdr_file(self, command, generation):
+        return f'{HDR_FILE_PATTERN.search(command).group(1)}.g{generation}.hdr'
+
+    def __has_intervals(self, ip, hdr_file):
+        output = self.__new_ssh(ip).exec_capture(f"grep -c '^Tag=' {hdr_file} 2>/dev/null; true")
+        return output.strip().isdigit() and int(output.strip()) > 0
+
+    def __wait_for_generation(self, command, generation, timeout_seconds=300):
+        hdr_file = self.__generation_hdr_file(command, generation)
+        deadline = time.time() + timeout_seconds
+        waiting = list(self.load_ips)
+        while waiting:
+            waiting = [ip for ip in waiting if not self.__has_intervals(ip, hdr_file)]
+            if waiting and time.time() > deadline:
+                raise Exception(f"Background load generation {generation} didn't start on {waiting}")
+            if waiting:
+                time.sleep(0.5)
+
+    def __terminate(self, ip, pattern):
+        self.__new_ssh(ip).exec(f"pkill -f '{pattern}'; true", ignore_errors=True)
+
+    def __stop_generation(self, command, generation):
+        # the brackets keep the pattern from matching the shell that runs pkill.
+        pattern = 'hdrfile=' + self.__generation_hdr_file(command, generation).replace('.', '[.]')
+        run_parallel(self.__terminate, [(ip, pattern) for ip in self.load_ips], ignore_errors=True)
+
+    def background_stress(self, command, rate, max_duration_hours=7 * 24):
+        """
+        Starts a continuous background load on all load generators; a replacement of loop_stress
+        without the gap and JVM warmup of a relaunch every few minutes. Returns the BackgroundStress,
+        which can change the rate while running and stops right away.
+
+        Parameters
+        ----------
+        command: function
+            Called with the rate in ops/s of a single load generator and returns the cassandra-stress
+            command, e.g. lambda rate: f'mixed ... -log hdrfile=profile.hdr ... -rate "threads=700 fixed={rate}/s" ...'.
+            The command needs to log a hdr file; a duration in the command is replaced by max_duration_hours.
+        rate: int
+            The total rate in ops/s over all load generators.
+        """
+        template = command(1)
+        if HDR_FILE_PATTERN.search(template) is None:
+            raise Exception(f"The background load needs a '-log hdrfile=<name>.hdr' in [{template}]")
+        if rate < len(self.load_ips):
+            raise Exception(f"Background load rate {rate} is less than 1 op/s per load generator")
+        return BackgroundStress(
+            lambda generation, total_rate: self.__start_generation(command, max_duration_hours, generation, total_rate),
+            lambda generation: self.__wait_for_generation(template, generation),
+            lambda generation: self.__stop_generation(template, generation),
+            rate).start()
+
     def loop_stress(self, command, load_index=None):
         thread = WorkerThreadLoop(self.stress, (command, load_index))
         thread.start()
         return thread
 
-    def insert(self, profile, item_count, nodes, mode="native cql3", rate="threads=100", sequence_start=None):
+    def insert(self, profile, item_count, nodes, mode="native cql3", rate="threads=100", sequence_start=None,
+               weights=None):
         log_important(f"Inserting {item_count} items")
         start_seconds = time.time()
 
-        per_load_generator = item_count // len(self.load_ips)
-        start = sequence_start
-        if sequence_start is None:
-            start = 1
-
-        end = start + per_load_generator - 1
+        first = 1 if sequence_start is None else sequence_start
+        weights = [1] * len(self.load_ips) if weights is None else weights
+        ips = []
         cmd_list = []
-        for i in range(0, len(self.load_ips)):
-            cmd = f'user profile={profile} "ops(insert=1)" n={per_load_generator} no-warmup -pop seq={start}..{end} -mode {mode} -rate {rate}  -node {nodes}'
-            log(self.load_ips[i] + " " + cmd)
+        for ip, (start, end) in zip(self.load_ips, weighted_ranges(first, item_count, weights)):
+            if end < start:
+                continue
+            cmd = f'user profile={profile} "ops(insert=1)" n={end - start + 1} no-warmup -pop seq={start}..{end} -mode {mode} -rate {rate}  -node {nodes}'
+            log(ip + " " + cmd)
+            ips.append(ip)
             cmd_list.append(cmd)
-            start = end + 1
-            end = end + per_load_generator
 
-        futures = []
-        for i in range(0, len(self.load_ips)):
-            f = self.async_stress(cmd_list[i], load_index=i)
-            futures.append(f)
-            if i == 0:
-                time.sleep(10)
-
-        for f in futures:
-            f.join()
+        self.__synchronized_stress(ips, cmd_list)
 
         duration_seconds = time.time() - start_seconds
         log(f"Duration : {duration_seconds} seconds")
@@ -163,20 +744,28 @@ class CassandraStress:
     def ssh(self, command):
         run_parallel(self.__ssh, [(ip, command) for ip in self.load_ips])
 
-    def __upload(self, ip, file):
-        self.__new_ssh(ip).scp_to_remote(file, "")
-
     def upload(self, file):
         log_important(f"Upload: started")
-        run_parallel(self.__upload, [(ip, file) for ip in self.load_ips])
+        pssh = PSSH(self.load_ips, self.ssh_user, self.properties['ssh_options'])
+        pssh.distribute(file, os.path.basename(file))
         log_important(f"Upload: done")
 
+    def __clear_results(self, ip):
+        self.__new_ssh(ip).exec('rm -fr *.html *.hdr *.log')
+
+    def clear_results(self):
+        """
+        Removes the reports of earlier runs from the load generators, e.g. of the load phase, so they
+        don't end up in the next collect_results.
+        """
+        run_parallel(self.__clear_results, [(ip,) for ip in self.load_ips])
+
     def __collect(self, ip, dir):
         dest_dir = os.path.join(dir, ip)
         os.makedirs(dest_dir, exist_ok=True)
         log_machine(ip, f'Collecting to [{dest_dir}]')
         ssh = self.__new_ssh(ip)
-        ssh.scp_from_remote(f'*.{{html,hdr,log}}', dest_dir)
+        ssh.stream_from_remote('.', dest_dir, '*.{html,hdr,log}')
         ssh.exec(f'rm -fr *.html *.hdr *.log')
         log_machine(ip, f'Collecting to [{dest_dir}] done')
 
@@ -196,11 +785,12 @@ class CassandraStress:
 
         log_important(f"Collecting results: started")
         run_parallel(self.__collect, [(ip, dir) for ip in self.load_ips])
+        if self.last_start is not None:
+            start_time, offsets = self.last_start
+            write_clock_offsets(os.path.join(dir, CLOCK_OFFSETS_FILE_NAME), offsets, start_time)
         p = HdrLogProcessor(self.properties, warmup_seconds=warmup_seconds, cooldown_seconds=cooldown_seconds)
-        p.trim_recursivly(dir)
-        p.merge_recursivly(dir)
-        p.process_recursivly(dir)
-        p.summarize_recursivly(dir)
+        p.process_all(dir)
+        catalog_results(dir)
         log_important(f"Collecting results: done")
         log(f"Results can be found in [{dir}]")
 
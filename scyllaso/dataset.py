@@ -0,0 +1,60 @@
+# The scripts to save and restore a named dataset on a node. A dataset is a snapshot of all
+# keyspaces, including the system ones, so it can only be restored onto the same node it was
+# saved on; this is checked against the NODE file in the dataset.
+#
+# Saving hardlinks the snapshot files into <saved_dir>/<name>/<keyspace>/<table> and restoring
+# hardlinks (or reflinks) them back into the data dir; both are O(number of files) instead of
+# O(data size). SSTables are immutable, so sharing the inodes with the running node is safe.
+
+def save_dataset_script(name, nodetool, data_dir, saved_dir, node_id, sudo=''):
+    dataset_dir = f'{saved_dir}/{name}'
+    return f"""
+        set -e
+        {nodetool} flush
+        {nodetool} snapshot -t {name}
+        {sudo}rm -rf {dataset_dir}
+        {sudo}mkdir -p {dataset_dir}
+        cd {data_dir}
+        for snapshot_dir in */*/snapshots/{name}; do
+            [ -d "$snapshot_dir" ] || continue
+            table_dir=$(dirname $(dirname $snapshot_dir))
+            {sudo}mkdir -p {dataset_dir}/$table_dir
+            # manifest.json and schema.cql belong to the snapshot, not to the table.
+            {sudo}find $snapshot_dir -maxdepth 1 -type f ! -name manifest.json ! -name schema.cql \\
+                -exec cp -al {{}} {dataset_dir}/$table_dir/ \\;
+        done
+        {nodetool} clearsnapshot -t {name}
+        echo '{node_id}' | {sudo}tee {dataset_dir}/NODE > /dev/null
+        echo "Saved dataset [{name}]: $({sudo}du -sh {dataset_dir} | cut -f1)"
+    """
+
+
+# The node needs to be stopped.
+def restore_dataset_script(name, data_dir, commitlog_dir, saved_dir, node_id, sudo='', owner=None, reflink=False):
+    dataset_dir = f'{saved_dir}/{name}'
+    copy = 'cp -a --reflink=always' if reflink else 'cp -al'
+    chown = f'{sudo}chown -R {owner} {data_dir}' if owner else ''
+    return f"""
+        set -e
+        if [ ! -f {dataset_dir}/NODE ]; then
+            echo "Dataset [{name}] not found in [{saved_dir}]"
+            exit 2
+        fi
+        if [ "$(cat {dataset_dir}/NODE)" != '{node_id}' ]; then
+            echo "Dataset [{name}] was saved on node [$(cat {dataset_dir}/NODE)], not on [{node_id}]"
+            exit 2
+        fi
+        {sudo}rm -rf {data_dir}/* {commitlog_dir}/*
+        cd {dataset_dir}
+        for table_dir in */*; do
+            [ -d "$table_dir" ] || continue
+            {sudo}mkdir -p {data_dir}/$table_dir
+            {sudo}{copy} $table_dir/. {data_dir}/$table_dir/
+        done
+        {chown}
+        echo "Restored dataset [{name}]"
+    """
+
+
+def has_dataset_command(name, saved_dir, node_id):
+    return f"[ \"$(cat {saved_dir}/{name}/NODE 2>/dev/null)\" = '{node_id}' ] && echo yes || echo no"
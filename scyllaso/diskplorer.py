@@ -34,21 +34,22 @@ class DiskExplorer:
 
     def __run(self, ip, cmd):
         log_machine(ip, 'Run: started')
-        ssh = self.__new_ssh(ip)
-        ssh.exec('rm -fr diskplorer/*.svg')
-        ssh.exec(f'rm -fr diskplorer/fiotest.tmp')
+        batch = self.__new_ssh(ip).batch()
+        batch.add('rm -fr diskplorer/*.svg')
+        batch.add(f'rm -fr diskplorer/fiotest.tmp')
         if self.capture_lsblk:
-            ssh.exec(f'lsblk > lsblk.out')
-        ssh.exec(f"""
+            batch.add(f'lsblk > lsblk.out')
+        batch.add(f"""
             ulimit -n 64000            
             ulimit -n
             ulimit -Sn 64000
             ulimit -Sn
             cd diskplorer                 
             python3 diskplorer.py {cmd}
-            """)
+            """, name="diskplorer")
         # the file is 100 GB; so we want to remove it.
-        ssh.exec(f'rm -fr diskplorer/fiotest.tmp')
+        batch.add(f'rm -fr diskplorer/fiotest.tmp')
+        batch.exec()
         log_machine(ip, 'Run: done')
 
     def run(self, command):
@@ -1,6 +1,6 @@
 import os
 from datetime import datetime
-from scyllaso.ssh import SSH
+from scyllaso.ssh import SSH, PSSH
 from scyllaso.util import run_parallel, log_important, log_machine, log
 
 
@@ -16,14 +16,10 @@ class Fio:
     def __new_ssh(self, ip):
         return SSH(ip, self.ssh_user, self.ssh_options)
 
-    def __upload(self, ip, file):
-        ssh = self.__new_ssh(ip)
-        ssh.exec(f"mkdir -p {self.dir_name}")
-        ssh.scp_to_remote(file, self.dir_name)
-
     def upload(self, file):
         log_important(f"Upload: started")
-        run_parallel(self.__upload, [(ip, file) for ip in self.ips])
+        pssh = PSSH(self.ips, self.ssh_user, self.ssh_options)
+        pssh.distribute(file, f"{self.dir_name}/{os.path.basename(file)}")
         log_important(f"Upload-Stress: done")
 
     def __install(self, ip):
@@ -40,15 +36,16 @@ class Fio:
 
     def __run(self, ip, options):
         log_machine(ip, 'fio: started')
-        ssh = self.__new_ssh(ip)
+        batch = self.__new_ssh(ip).batch()
         if self.capture_lsblk:
-            ssh.exec(f'lsblk > lsblk.txt')
+            batch.add(f'lsblk > lsblk.txt')
 
-        ssh.exec(f"""
+        batch.add(f"""
             mkdir -p {self.dir_name}
             cd {self.dir_name}
             sudo fio {options}            
-            """)
+            """, name="fio")
+        batch.exec()
         log_machine(ip, 'fio: done')
 
     def run(self, options):
@@ -63,9 +60,9 @@ class Fio:
 
         log_machine(ip, f'Downloading to [{dest_dir}]')
         ssh = self.__new_ssh(ip)
-        ssh.scp_from_remote(f'{self.dir_name}/*', dest_dir)
+        ssh.stream_from_remote(self.dir_name, dest_dir, '*')
         if self.capture_lsblk:
-            self.__new_ssh(ip).scp_from_remote(f'lsblk.out', dest_dir)
+            ssh.scp_from_remote(f'lsblk.txt', dest_dir)
 
         log_machine(ip, f'Downloading to [{dest_dir}] done')
 
@@ -1,153 +1,429 @@
 import os
 import glob
-import csv
-import pkg_resources
-from collections import namedtuple
-from scyllaso.util import find_java, log_important, log
+import heapq
+import math
+import re
+from collections import namedtuple, deque
+from threading import Lock
+from scyllaso.hdr_histogram import HistogramLogReader, HistogramLogWriter, write_percentile_distribution, summary, \
+    OUTPUT_VALUE_UNIT_RATIO
+from scyllaso.clock import read_clock_offsets, CLOCK_OFFSETS_FILE_NAME
+from scyllaso.util import log_important, log, log_machine, run_process_parallel, WorkerThread
+
+
+# The logs of consecutive generations of a background load, e.g. profile.g0.hdr and profile.g1.hdr
+# (see CassandraStress.background_stress), are processed as a single profile.hdr.
+GENERATION_PATTERN = re.compile(r'^(.*)\.g\d+\.hdr$')
+
+# The post processing steps are module level functions with explicit paths so they can run in
+# worker processes; see HdrLogProcessor for how they are scheduled.
+
+def write_hgrm_files(file, histograms):
+    dir = os.path.dirname(os.path.realpath(file))
+    filename_no_ext = os.path.splitext(os.path.basename(file))[0]
+
+    for tag, histogram in histograms.items():
+        if tag is None:
+            continue
+        # write the percentile distribution twice; once csv formatted and once as plain text.
+        output = os.path.join(dir, f'{filename_no_ext}_{tag}')
+        with open(f'{output}.hgrm.csv', 'w') as hgrm_csv_file:
+            write_percentile_distribution(hgrm_csv_file, histogram, csv=True)
+        with open(f'{output}.hgrm', 'w') as hgrm_file:
+            write_percentile_distribution(hgrm_file, histogram)
+
+
+def write_summary_files(file, histograms):
+    dir = os.path.dirname(os.path.realpath(file))
+    filename_no_ext = os.path.splitext(os.path.basename(file))[0]
+    summary_text_name = os.path.join(dir, f"{filename_no_ext}-summary.txt")
+    summary_csv_name = os.path.join(dir, f"{filename_no_ext}-summary.csv")
+
+    entries = {}
+    for tag in sorted(histograms, key=lambda t: t or ''):
+        entries.update(summary(histograms[tag]))
+
+    with open(summary_text_name, 'w') as summary_text_file:
+        for key, value in entries.items():
+            summary_text_file.write(f'{key}={value}\n')
+
+    with open(summary_csv_name, 'w') as summary_csv_file:
+        header = ','.join(entries.keys())
+        content = ','.join(entries.values())
+        summary_csv_file.write(f'{header}\n')
+        summary_csv_file.write(f'{content}\n')
+
+
+class HdrLogSink:
+    """
+    The output side of a hdr log: accumulates the merged histogram per tag for the .hgrm and
+    summary files and, if write_log is set, writes the intervals to the log at path.
+    """
+
+    def __init__(self, path, write_log=True):
+        self.path = path
+        self.write_log = write_log
+        self.histograms = {}
+        self.file = None
+        self.writer = None
+
+    def add(self, histogram, start_time):
+        total = self.histograms.get(histogram.tag)
+        if total is None:
+            total = histogram.copy_empty()
+            total.tag = histogram.tag
+            self.histograms[histogram.tag] = total
+        total.add(histogram)
+
+        if self.write_log:
+            if self.writer is None:
+                self.file = open(self.path, 'w')
+                self.writer = HistogramLogWriter(self.file, start_time)
+                self.writer.write_header()
+            self.writer.write(histogram)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        elif self.write_log:
+            # no intervals; still leave an (empty) log behind like the Java tools did.
+            open(self.path, 'w').close()
+        write_hgrm_files(self.path, self.histograms)
+        write_summary_files(self.path, self.histograms)
+
+
+class MergingHdrLogSink(HdrLogSink):
+    """
+    A HdrLogSink for the union of the logs of multiple load generators. The intervals are combined
+    per tag into 1 second slots, just like the union command of HdrLogProcessing. The intervals
+    need to be added roughly in timestamp order; a slot is written once the intervals have moved
+    more than lag_seconds past it, so only a few slots are in memory at any time.
+    """
+
+    def __init__(self, path, lag_seconds=2):
+        super().__init__(path)
+        self.lag_seconds = lag_seconds
+        self.slots = {}
+        self.start_time = None
+
+    def add(self, histogram, start_time):
+        if self.start_time is None or start_time < self.start_time:
+            self.start_time = start_time
+        second = math.floor(histogram.start_timestamp)
+        key = (second, histogram.tag or '')
+        merged = self.slots.get(key)
+        if merged is None:
+            # a copy; the same histogram is also added to other sinks.
+            merged = histogram.copy_empty()
+            merged.tag = histogram.tag
+            self.slots[key] = merged
+        merged.add(histogram)
+        self.__flush(second - self.lag_seconds)
+
+    def __flush(self, before_second=None):
+        for key in sorted(self.slots):
+            if before_second is not None and key[0] >= before_second:
+                break
+            super().add(self.slots.pop(key), self.start_time)
+
+    def close(self):
+        self.__flush()
+        super().close()
+
+
+def analyze_hdr_files(files, dir, warmup_seconds=None, cooldown_seconds=None, clock_offsets=None, filename=None):
+    """
+    Processes the hdr logs with the same name of all load generators in a single pass over the
+    data. Every interval is read once and fed to the sinks it belongs to: the untrimmed and trimmed
+    (warmup/cooldown window) output of its load generator and of the union in dir. Every sink
+    writes its .hgrm, .hgrm.csv and summary files and, except for the untrimmed load generator
+    log that is the input, the hdr log itself.
+
+    clock_offsets is the clock offset in seconds (remote minus local) of the load generator of every
+    file. The timestamps are moved onto the local clock, so the union combines intervals that were
+    recorded at the same moment instead of at the same reading of skewed clocks.
+
+    filename is the name of the union in dir; it defaults to the name of the first file.
+    """
+    offsets = [0.0] * len(files) if clock_offsets is None else clock_offsets
+    trim = warmup_seconds is not None or cooldown_seconds is not None
+    filename = os.path.basename(files[0]) if filename is None else filename
+    merged_sinks = [MergingHdrLogSink(os.path.join(dir, filename))]
+    if trim:
+        merged_sinks.append(MergingHdrLogSink(os.path.join(dir, f'trimmed_{filename}')))
+
+    readers = []
+    file_sinks = []
+    for file in files:
+        readers.append(HistogramLogReader(file))
+        sinks = [HdrLogSink(file, write_log=False)]
+        if trim:
+            sinks.append(HdrLogSink(os.path.join(os.path.dirname(file), f'trimmed_{os.path.basename(file)}')))
+        file_sinks.append(sinks)
+
+    def intervals(index):
+        offset = offsets[index]
+        for histogram, _ in readers[index].intervals():
+            if offset:
+                histogram.start_timestamp -= offset
+                histogram.end_timestamp -= offset
+            yield histogram.start_timestamp, index, histogram
+
+    # The generations of a background load on a load generator share the trim window of its first log.
+    same_host = [[i for i, other in enumerate(files) if os.path.dirname(other) == os.path.dirname(file)]
+                 for file in files]
+
+    for _, index, histogram in heapq.merge(*[intervals(index) for index in range(len(readers))],
+                                           key=lambda interval: interval[:2]):
+        start_time = readers[index].start_time - offsets[index]
+        sinks, merged = file_sinks[index], merged_sinks
+        if trim:
+            # Same window as the union command of HdrLogProcessing: -start and -end are
+            # seconds relative to the start of the log. heapq.merge has read the first interval,
+            # and so the start time, of every log before it yields anything.
+            window_start_time = min(readers[i].start_time - offsets[i] for i in same_host[index]
+                                    if readers[i].start_time is not None)
+            offset = histogram.start_timestamp - window_start_time
+            in_window = (warmup_seconds is None or offset >= float(warmup_seconds)) \
+                        and (cooldown_seconds is None or offset <= float(cooldown_seconds))
+            if not in_window:
+                sinks, merged = sinks[:1], merged[:1]
+        for sink in sinks + merged:
+            sink.add(histogram, start_time)
+
+    for sinks in file_sinks:
+        for sink in sinks:
+            sink.close()
+    for sink in merged_sinks:
+        sink.close()
+
+
+# Reads a hdr log once for both its .hgrm and summary files.
+def report_hdr_file(file):
+    sink = HdrLogSink(file, write_log=False)
+    for histogram, _ in HistogramLogReader(file).intervals():
+        sink.add(histogram, None)
+    sink.close()
 
 
 class HdrLogProcessor:
 
-    def __init__(self, properties, warmup_seconds=None, cooldown_seconds=None):
+    def __init__(self, properties, warmup_seconds=None, cooldown_seconds=None, max_workers=None):
         self.properties = properties
-        self.java_path = find_java(self.properties)
         self.warmup_seconds = warmup_seconds
         self.cooldown_seconds = cooldown_seconds
-        module_dir = os.path.dirname(pkg_resources.resource_filename('scyllaso', '__init__.py'))
-        self.lib_dir = os.path.join(module_dir, "lib")
-        #print("lib_dir:" + str(self.lib_dir))
-
-    def __trim(self, file):
-        filename = os.path.basename(file)
-        filename_no_ext = os.path.splitext(filename)[0]
-
-        old_cwd = os.getcwd()
-        new_cwd = os.path.dirname(os.path.realpath(file))
-        os.chdir(new_cwd)
-
-        args = f'union -if {filename} -of trimmed_{filename_no_ext}.hdr'
-        if self.warmup_seconds is not None:
-            args = f'{args} -start {self.warmup_seconds}'
-        if self.cooldown_seconds is not None:
-            args = f'{args} -end {self.cooldown_seconds}'
-
-        cmd = f'{self.java_path} -cp {self.lib_dir}/processor.jar CommandDispatcherMain {args}'
-        log(cmd)
-        os.system(cmd)
-        os.chdir(old_cwd)
-
-    def trim_recursivly(self, dir):
-        if self.warmup_seconds is None and self.warmup_seconds is None:
-            return
-
-        log_important("HdrLogProcessor.trim_recursively")
+        # The number of worker processes; defaults to the number of cores.
+        self.max_workers = max_workers
 
-        for hdr_file in glob.iglob(dir + '/*/*.hdr', recursive=True):
+    # The hdr logs of the load generators grouped by name.
+    @staticmethod
+    def __load_generator_files(dir):
+        files_map = {}
+        for hdr_file in sorted(glob.iglob(dir + '/*/*.hdr')):
             filename = os.path.basename(hdr_file)
             if filename.startswith("trimmed_"):
                 continue
-
-            log(hdr_file)
-            self.__trim(hdr_file)
-
-        log_important("HdrLogProcessor.trim_recursively")
-
-    def merge_recursivly(self, dir):
-        log_important("HdrLogProcessor.merge_recursively")
-        log(dir)
-        # todo be careful with merging the merge file.
-        files_map = {}
-
-        for hdr_file in glob.iglob(dir + '/*/*.hdr', recursive=True):
-            log(hdr_file)
-            base = os.path.splitext(os.path.basename(hdr_file))[0]
-            files = files_map.get(base)
-            if files is None:
-                files = []
-                files_map[base] = files
-            files.append(hdr_file)
-
-        for name, files in files_map.items():
-            input = ""
-            for file in files:
-                input = input + " -ifp " + file
-            cmd = f'{self.java_path} -cp {self.lib_dir}/processor.jar CommandDispatcherMain union {input} -of {dir}/{name}.hdr'
-            log(cmd)
-            os.system(cmd)
-
-        log_important("HdrLogProcessor.merge_recursively")
-
-    def __summarize(self, file):
-        filename = os.path.basename(file)
-        filename_no_ext = os.path.splitext(filename)[0]
-        old_cwd = os.getcwd()
-        new_cwd = os.path.dirname(os.path.realpath(file))
-        os.chdir(new_cwd)
-
-        summary_text_name = f"{filename_no_ext}-summary.txt"
-        summary_csv_name = f"{filename_no_ext}-summary.csv"
-
-        args = f'-if {filename_no_ext}.hdr'
-        os.system(
-            f'{self.java_path} -cp {self.lib_dir}/processor.jar CommandDispatcherMain summarize {args} >  {summary_text_name}')
-
-        entries = {}
-        with open(summary_text_name, 'r') as summary_text_file:
-            for line in summary_text_file:
-                row = line.split('=')
-                entries[row[0].strip()] = row[1].strip()
-
-        with open(summary_csv_name, 'w') as summary_csv_file:
-            header = ','.join(entries.keys())
-            content = ','.join(entries.values())
-            summary_csv_file.write(f'{header}\n')
-            summary_csv_file.write(f'{content}\n')
-
-        os.chdir(old_cwd)
-
-    def summarize_recursivly(self, dir):
-        log_important("HdrLogProcessor.summarize_recursively")
-        for hdr_file in glob.iglob(dir + '/**/*.hdr', recursive=True):
             log(hdr_file)
-            self.__summarize(hdr_file)
-        log_important("HdrLogProcessor.summarize_recursively")
-
-    def __process(self, file):
-        filename = os.path.basename(file)
-        filename_no_ext = os.path.splitext(filename)[0]
-        old_cwd = os.getcwd()
-        new_cwd = os.path.dirname(os.path.realpath(file))
-        os.chdir(new_cwd)
-
-        tags = set()
-        with open(filename, "r") as hdr_file:
-            reader = csv.reader(hdr_file, delimiter=',')
-            # Skip headers
-            for i in range(5):
-                next(reader, None)
-            for row in reader:
-                first_column = row[0]
-                tag = first_column[4:]
-                tags.add(tag)
-
-        for tag in tags:
-            # process twice; once to get the csv formatted output and again for the non csv output.
-            logprocessor = f'{self.java_path} -cp {self.lib_dir}/HdrHistogram-2.1.12.jar org.HdrHistogram.HistogramLogProcessor'
-            args = f'-i {filename} -o {filename_no_ext + "_" + tag} -tag {tag} -csv'
-            os.system(f'{logprocessor} {args}')
-            os.rename(f'{filename_no_ext + "_" + tag}.hgrm', f'{filename_no_ext + "_" + tag}.hgrm.csv')
-
-            args = f'-i {filename} -o {filename_no_ext + "_" + tag} -tag {tag}'
-            os.system(f'{logprocessor} {args}')
-
-        os.chdir(old_cwd)
+            match = GENERATION_PATTERN.match(filename)
+            if match is not None:
+                filename = f'{match.group(1)}.hdr'
+            files_map.setdefault(filename, []).append(hdr_file)
+        return files_map
+
+    def process_all(self, dir):
+        """
+        Runs the whole post processing in a single pass over every hdr log of the load generators:
+        trim, merge into dir and the per tag .hgrm and summary files. The logs with different names
+        are processed concurrently on a process pool, just like any other hdr log found in dir which
+        only gets its .hgrm and summary files.
+
+        Parameters
+        ----------
+        dir: str
+            The directory containing a subdirectory with the hdr files for every load generator. If
+            it contains a clock_offsets.txt, the logs are aligned on the recorded offsets.
+        """
+        log_important("HdrLogProcessor.process_all")
+        # the load generator directories are named after their ip.
+        clock_offsets, _ = read_clock_offsets(os.path.join(dir, CLOCK_OFFSETS_FILE_NAME))
+        if clock_offsets:
+            log(f"Aligning the hdr logs on the clock offsets in [{CLOCK_OFFSETS_FILE_NAME}]")
+        tasks = {}
+        outputs = set()
+        for filename, files in self.__load_generator_files(dir).items():
+            offsets = [clock_offsets[ip].offset_seconds if ip in clock_offsets else 0.0
+                       for ip in (os.path.basename(os.path.dirname(file)) for file in files)]
+            tasks[filename] = (analyze_hdr_files,
+                               (files, dir, self.warmup_seconds, self.cooldown_seconds, offsets, filename))
+            outputs.update(files)
+            outputs.add(os.path.join(dir, filename))
+            outputs.add(os.path.join(dir, f'trimmed_{filename}'))
+            outputs.update(os.path.join(os.path.dirname(file), f'trimmed_{os.path.basename(file)}') for file in files)
+
+        for hdr_file in sorted(glob.iglob(dir + '/**/*.hdr', recursive=True)):
+            if hdr_file not in outputs:
+                tasks[hdr_file] = (report_hdr_file, (hdr_file,))
+
+        run_process_parallel(tasks, max_workers=self.max_workers)
+        log_important("HdrLogProcessor.process_all")
 
     def process_recursivly(self, dir):
-        log_important("HdrLogProcessor.summarize_recursively")
-        for hdr_file in glob.iglob(dir + '/**/*.hdr', recursive=True):
+        """
+        Writes the .hgrm and summary files for every hdr log in dir without trimming or merging.
+        """
+        log_important("HdrLogProcessor.process_recursively")
+        tasks = {}
+        for hdr_file in sorted(glob.iglob(dir + '/**/*.hdr', recursive=True)):
             log(hdr_file)
-            self.__process(hdr_file)
-        log_important("HdrLogProcessor.summarize_recursively")
+            tasks[hdr_file] = (report_hdr_file, (hdr_file,))
+        run_process_parallel(tasks, max_workers=self.max_workers)
+        log_important("HdrLogProcessor.process_recursively")
+
+    summarize_recursivly = process_recursivly
+
+
+# The merged latency of a single 1 second interval of a tag across all load generators.
+LiveInterval = namedtuple('LiveInterval', ['tag', 'timestamp', 'count', 'percentiles_ms', 'max_ms'])
+
+
+class LiveHdrView:
+    """
+    A rolling per tag view on the hdr interval logs of the load generators while they are still
+    being written. The intervals of the different load generators are merged into 1 second
+    slots; a slot is complete once the intervals have moved more than lag_seconds past it. For every
+    complete slot a LiveInterval is recorded, logged if log_intervals is set, and passed to the
+    listeners. The last history intervals per tag are kept.
+    """
+
+    def __init__(self, percentiles=(50.0, 99.0, 99.9), lag_seconds=5, history=3600, log_intervals=True):
+        self.percentiles = percentiles
+        self.lag_seconds = lag_seconds
+        self.history = history
+        self.log_intervals = log_intervals
+        self.listeners = []
+        self.__intervals = {}
+        self.__slots = {}
+        self.__lock = Lock()
+
+    def add_listener(self, listener):
+        """
+        Adds a function that is called with every LiveInterval. It is called from the threads that
+        tail the logs, so it should return quickly.
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def track_percentiles(self, *percentiles):
+        """
+        Makes sure the given percentiles are part of the recorded intervals from now on.
+        """
+        with self.__lock:
+            self.percentiles = tuple(sorted(set(self.percentiles) | set(percentiles)))
+
+    def add(self, histogram):
+        with self.__lock:
+            second = math.floor(histogram.start_timestamp)
+            key = (second, histogram.tag or '')
+            merged = self.__slots.get(key)
+            if merged is None:
+                merged = histogram.copy_empty()
+                merged.tag = histogram.tag
+                self.__slots[key] = merged
+            merged.add(histogram)
+            completed = self.__complete(second - self.lag_seconds)
+        self.__publish(completed)
+
+    def flush(self):
+        """
+        Completes all pending slots; called when the load generators are done.
+        """
+        with self.__lock:
+            completed = self.__complete()
+        self.__publish(completed)
+
+    def __complete(self, before_second=None):
+        completed = []
+        for key in sorted(self.__slots):
+            if before_second is not None and key[0] >= before_second:
+                break
+            histogram = self.__slots.pop(key)
+            interval = LiveInterval(
+                tag=histogram.tag,
+                timestamp=key[0],
+                count=histogram.total_count(),
+                percentiles_ms={p: histogram.value_at_percentile(p) / OUTPUT_VALUE_UNIT_RATIO for p in self.percentiles},
+                max_ms=histogram.max_value() / OUTPUT_VALUE_UNIT_RATIO)
+            intervals = self.__intervals.get(histogram.tag)
+            if intervals is None:
+                intervals = deque(maxlen=self.history)
+                self.__intervals[histogram.tag] = intervals
+            intervals.append(interval)
+            completed.append(interval)
+        return completed
+
+    def __publish(self, completed):
+        for interval in completed:
+            if self.log_intervals:
+                percentiles = ' '.join(f'p{p:g}={value:.3f}ms' for p, value in interval.percentiles_ms.items())
+                log(f'[{interval.tag}] count={interval.count} {percentiles} max={interval.max_ms:.3f}ms')
+            for listener in self.listeners:
+                listener(interval)
+
+    def tags(self):
+        with self.__lock:
+            return list(self.__intervals.keys())
+
+    def intervals(self, tag):
+        """
+        Returns the recorded LiveIntervals of the tag, oldest first.
+        """
+        with self.__lock:
+            return list(self.__intervals.get(tag, []))
+
+    def latest(self, tag):
+        with self.__lock:
+            intervals = self.__intervals.get(tag)
+            return intervals[-1] if intervals else None
+
+
+class LiveHdrTail:
+    """
+    Tails a hdr log on a remote machine over its SSH connection and feeds the decoded intervals to
+    a LiveHdrView. The log doesn't need to exist yet when the tail is started.
+    """
+
+    def __init__(self, ssh, path, view):
+        self.ssh = ssh
+        self.path = path
+        self.view = view
+        self.reader = HistogramLogReader(path)
+        self.pid_file = f'.live_hdr_tail_{os.path.basename(path)}.pid'
+        self.thread = None
+
+    def __handle_line(self, line):
+        try:
+            interval = self.reader.parse_line(line)
+        except Exception as e:
+            # e.g. a line that got truncated when the log was rewritten.
+            log_machine(self.ssh.ip, f'Skipping hdr line of [{self.path}]: {e}')
+            return
+        if interval is not None:
+            self.view.add(interval[0])
+
+    def start(self):
+        # The pid is recorded so the tail can be killed by stop; tail -F survives the log being
+        # created or truncated by cassandra-stress.
+        cmd = f'tail -n +1 -s 0.2 -F {self.path} 2>/dev/null & echo $! > {self.pid_file}; wait'
+        self.thread = WorkerThread(self.ssh.exec, (cmd, True, self.__handle_line))
+        self.thread.start()
+
+    def stop(self):
+        # the tail could still be starting up when the stress is very short.
+        self.ssh.exec(f'for i in $(seq 50); do [ -f {self.pid_file} ] && break; sleep 0.1; done; '
+                      f'kill $(cat {self.pid_file}) 2>/dev/null; rm -f {self.pid_file}', ignore_errors=True)
+        self.thread.join()
 
 
 ProfileSummaryResult = namedtuple('ProfileSummaryResult',
@@ -156,6 +432,17 @@ ProfileSummaryResult = namedtuple('ProfileSummaryResult',
                                    'p99_99_latency_ms', 'p99_999_latency_ms'])
 
 
+# The operations in a profile-summary.txt, e.g. {'READ', 'WRITE'}.
+def profile_summary_operations(path):
+    operations = set()
+    with open(path) as f:
+        for line in f:
+            key = line.split('=')[0].strip()
+            if key.endswith('-rt.TotalCount'):
+                operations.add(key[:-len('-rt.TotalCount')])
+    return operations
+
+
 def parse_profile_summary_file(path, operation_name='insert'):
     with open(path) as f:
         config = f.readlines()
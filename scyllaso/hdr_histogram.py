@@ -0,0 +1,391 @@
+import base64
+import math
+import struct
+import time
+import zlib
+import numpy as np
+
+# An in process implementation of the parts of HdrHistogram that are needed to post process the
+# histogram logs written by cassandra-stress and friends: decoding/encoding of the compressed V2
+# encoding, adding histograms and the statistics (percentiles, mean, stddev). The statistics
+# mirror the Java implementation (HdrHistogram 2.1.12) so the output matches the Java tools.
+
+V2_ENCODING_COOKIE = 0x1c849303
+V2_COMPRESSED_ENCODING_COOKIE = 0x1c849304
+# The cookie bits 4-7 hold the word size; ignored while decoding.
+COOKIE_WORD_SIZE_MASK = 0xf0
+COOKIE_WORD_SIZE = 0x10
+V2_HEADER = struct.Struct(">iiiiqqd")
+COMPRESSED_HEADER = struct.Struct(">ii")
+
+# The default ratio used by the Java log writer/processor; values are recorded in nanoseconds and
+# reported in milliseconds.
+OUTPUT_VALUE_UNIT_RATIO = 1_000_000.0
+
+
+class Histogram:
+
+    def __init__(self, lowest_trackable_value=1, highest_trackable_value=3_600_000_000_000, significant_digits=3,
+                 conversion_ratio=1.0):
+        self.lowest_trackable_value = lowest_trackable_value
+        self.highest_trackable_value = highest_trackable_value
+        self.significant_digits = significant_digits
+        self.conversion_ratio = conversion_ratio
+        self.tag = None
+        # seconds since epoch
+        self.start_timestamp = None
+        self.end_timestamp = None
+
+        largest_value_with_single_unit_resolution = 2 * 10 ** significant_digits
+        self.unit_magnitude = int(math.floor(math.log2(lowest_trackable_value)))
+        sub_bucket_count_magnitude = int(math.ceil(math.log2(largest_value_with_single_unit_resolution)))
+        self.sub_bucket_half_count_magnitude = max(sub_bucket_count_magnitude, 1) - 1
+        self.sub_bucket_count = 1 << (self.sub_bucket_half_count_magnitude + 1)
+        self.sub_bucket_half_count = self.sub_bucket_count // 2
+        self.sub_bucket_mask = (self.sub_bucket_count - 1) << self.unit_magnitude
+
+        smallest_untrackable_value = self.sub_bucket_count << self.unit_magnitude
+        self.bucket_count = 1
+        while smallest_untrackable_value <= highest_trackable_value:
+            if smallest_untrackable_value > (1 << 62):
+                self.bucket_count += 1
+                break
+            smallest_untrackable_value <<= 1
+            self.bucket_count += 1
+
+        self.counts = np.zeros((self.bucket_count + 1) * self.sub_bucket_half_count, dtype=np.int64)
+        self.__lowest_values = None
+        self.__range_sizes = None
+
+    def layout(self):
+        return self.unit_magnitude, self.sub_bucket_half_count_magnitude
+
+    def copy_empty(self):
+        return Histogram(self.lowest_trackable_value, self.highest_trackable_value, self.significant_digits,
+                         self.conversion_ratio)
+
+    def __index_layout(self):
+        # The lowest equivalent value and the size of the equivalent value range for every index.
+        if self.__lowest_values is None:
+            indices = np.arange(len(self.counts), dtype=np.int64)
+            bucket_indices = (indices >> self.sub_bucket_half_count_magnitude) - 1
+            sub_bucket_indices = (indices & (self.sub_bucket_half_count - 1)) + self.sub_bucket_half_count
+            first_bucket = bucket_indices < 0
+            sub_bucket_indices[first_bucket] -= self.sub_bucket_half_count
+            bucket_indices[first_bucket] = 0
+            self.__lowest_values = sub_bucket_indices << (bucket_indices + self.unit_magnitude)
+            self.__range_sizes = np.left_shift(1, bucket_indices + self.unit_magnitude, dtype=np.int64)
+        return self.__lowest_values, self.__range_sizes
+
+    def lowest_equivalent_values(self):
+        return self.__index_layout()[0]
+
+    def highest_equivalent_values(self):
+        lowest_values, range_sizes = self.__index_layout()
+        return lowest_values + range_sizes - 1
+
+    def median_equivalent_values(self):
+        lowest_values, range_sizes = self.__index_layout()
+        return lowest_values + (range_sizes >> 1)
+
+    def index_of(self, value):
+        bucket_index = (value | self.sub_bucket_mask).bit_length() - self.unit_magnitude \
+                       - self.sub_bucket_half_count_magnitude - 1
+        sub_bucket_index = value >> (bucket_index + self.unit_magnitude)
+        return ((bucket_index + 1) << self.sub_bucket_half_count_magnitude) + sub_bucket_index \
+               - self.sub_bucket_half_count
+
+    def __grow(self, length):
+        if length > len(self.counts):
+            self.counts = np.concatenate((self.counts, np.zeros(length - len(self.counts), dtype=np.int64)))
+            self.__lowest_values = None
+            self.__range_sizes = None
+
+    def add(self, other):
+        if other.layout() == self.layout():
+            self.__grow(len(other.counts))
+            self.counts[:len(other.counts)] += other.counts
+        else:
+            # Different layouts; map every recorded value of the other histogram to our index.
+            lowest_values = other.lowest_equivalent_values()
+            for index in np.flatnonzero(other.counts):
+                our_index = self.index_of(int(lowest_values[index]))
+                self.__grow(our_index + 1)
+                self.counts[our_index] += other.counts[index]
+
+        if other.start_timestamp is not None:
+            if self.start_timestamp is None or other.start_timestamp < self.start_timestamp:
+                self.start_timestamp = other.start_timestamp
+        if other.end_timestamp is not None:
+            if self.end_timestamp is None or other.end_timestamp > self.end_timestamp:
+                self.end_timestamp = other.end_timestamp
+
+    def total_count(self):
+        return int(self.counts.sum())
+
+    def max_value(self):
+        nonzero = np.flatnonzero(self.counts)
+        if len(nonzero) == 0:
+            return 0
+        return int(self.highest_equivalent_values()[nonzero[-1]])
+
+    def min_value(self):
+        nonzero = np.flatnonzero(self.counts)
+        if len(nonzero) == 0 or nonzero[0] == 0:
+            return 0
+        return int(self.lowest_equivalent_values()[nonzero[0]])
+
+    def mean(self):
+        total_count = self.total_count()
+        if total_count == 0:
+            return 0.0
+        return float(np.dot(self.counts.astype(np.float64), self.median_equivalent_values())) / total_count
+
+    def stddev(self):
+        total_count = self.total_count()
+        if total_count == 0:
+            return 0.0
+        deviations = self.median_equivalent_values() - self.mean()
+        return math.sqrt(float(np.dot(self.counts.astype(np.float64), deviations * deviations)) / total_count)
+
+    def value_at_percentile(self, percentile):
+        total_count = self.total_count()
+        if total_count == 0:
+            return 0
+        # Just like the Java version; remove 1 ulp to avoid roundoff overruns into the next bucket.
+        requested_percentile = min(max(float(np.nextafter(percentile, -np.inf)), 0.0), 100.0)
+        count_at_percentile = max(int(math.ceil(requested_percentile / 100.0 * total_count)), 1)
+        index = int(np.searchsorted(np.cumsum(self.counts), count_at_percentile, side='left'))
+        if percentile == 0.0:
+            return int(self.lowest_equivalent_values()[index])
+        return int(self.highest_equivalent_values()[index])
+
+    def percentiles(self, ticks_per_half_distance=5):
+        # Same steps as the Java PercentileIterator; yields (value, percentile, total_count_to_value).
+        total_count = self.total_count()
+        if total_count == 0:
+            return
+        highest_values = self.highest_equivalent_values()
+        nonzero = np.flatnonzero(self.counts)
+        cumulative = np.cumsum(self.counts[nonzero])
+        percentile_to_iterate_to = 0.0
+        for index, total_count_to_index in zip(nonzero, cumulative):
+            value = int(highest_values[index])
+            total_count_to_index = int(total_count_to_index)
+            while 100.0 * total_count_to_index / total_count >= percentile_to_iterate_to:
+                yield value, percentile_to_iterate_to, total_count_to_index
+                if percentile_to_iterate_to == 100.0:
+                    return
+                half_distance = math.pow(2, math.floor(math.log2(100.0 / (100.0 - percentile_to_iterate_to))) + 1)
+                percentile_to_iterate_to += 100.0 / (ticks_per_half_distance * half_distance)
+                if total_count_to_index == total_count:
+                    # Like Java, the last recorded value is reported once more only as the final 100%.
+                    break
+        yield int(highest_values[nonzero[-1]]), 100.0, total_count
+
+    @staticmethod
+    def decode(encoded):
+        data = base64.b64decode(encoded)
+        cookie, length = COMPRESSED_HEADER.unpack_from(data)
+        if cookie & ~COOKIE_WORD_SIZE_MASK != V2_COMPRESSED_ENCODING_COOKIE:
+            raise Exception(f"Unsupported histogram encoding cookie {hex(cookie)}")
+        data = zlib.decompress(data[COMPRESSED_HEADER.size:COMPRESSED_HEADER.size + length])
+
+        cookie, payload_length, normalizing_index_offset, significant_digits, lowest, highest, conversion_ratio \
+            = V2_HEADER.unpack_from(data)
+        if cookie & ~COOKIE_WORD_SIZE_MASK != V2_ENCODING_COOKIE:
+            raise Exception(f"Unsupported histogram encoding cookie {hex(cookie)}")
+        if normalizing_index_offset != 0:
+            raise Exception(f"Unsupported normalizing index offset {normalizing_index_offset}")
+
+        histogram = Histogram(lowest, highest, significant_digits, conversion_ratio)
+        payload = np.frombuffer(data, dtype=np.uint8, count=payload_length, offset=V2_HEADER.size)
+        tokens = decode_zigzag_leb128(payload)
+        # A negative token is a run of zero counts.
+        steps = np.where(tokens < 0, -tokens, 1)
+        indices = np.cumsum(steps) - steps
+        recorded = tokens > 0
+        if len(tokens) > 0:
+            histogram.__grow(int(indices[-1] + steps[-1]))
+        histogram.counts[indices[recorded]] = tokens[recorded]
+        return histogram
+
+    def encode(self):
+        nonzero = np.flatnonzero(self.counts)
+        counts = self.counts[nonzero]
+        # Zero counts in front of a count are written as a single negative run length; a single
+        # zero count is written as is.
+        zeros = np.diff(np.concatenate(([-1], nonzero))) - 1
+        has_zeros = zeros > 0
+        token_indices = np.arange(len(counts)) + np.cumsum(has_zeros)
+        tokens = np.zeros(len(counts) + int(has_zeros.sum()), dtype=np.int64)
+        tokens[token_indices] = counts
+        tokens[token_indices[has_zeros] - 1] = np.where(zeros[has_zeros] > 1, -zeros[has_zeros], 0)
+
+        payload = encode_zigzag_leb128(tokens)
+        data = V2_HEADER.pack(V2_ENCODING_COOKIE | COOKIE_WORD_SIZE, len(payload), 0, self.significant_digits,
+                              self.lowest_trackable_value, self.highest_trackable_value,
+                              self.conversion_ratio) + payload
+        compressed = zlib.compress(data)
+        return base64.b64encode(COMPRESSED_HEADER.pack(V2_COMPRESSED_ENCODING_COOKIE | COOKIE_WORD_SIZE, len(compressed))
+                                + compressed).decode()
+
+
+def decode_zigzag_leb128(payload):
+    # Vectorized decoding of a sequence of ZigZag LEB128 encoded longs. Counts never get near 2^56,
+    # so the special 9th byte of the Java encoding isn't supported.
+    if len(payload) == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero((payload & 0x80) == 0)
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.int64)
+    payload = payload[:ends[-1] + 1]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    if lengths.max() > 8:
+        raise Exception("Unsupported LEB128 value; more than 8 bytes")
+    shifts = (np.arange(len(payload)) - np.repeat(starts, lengths)) * 7
+    parts = np.left_shift((payload & 0x7f).astype(np.uint64), shifts.astype(np.uint64))
+    values = np.bitwise_or.reduceat(parts, starts)
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def encode_zigzag_leb128(values):
+    zigzag = ((values << 1) ^ (values >> 63)).astype(np.uint64)
+    if len(zigzag) > 0 and int(zigzag.max()) >= (1 << 56):
+        raise Exception("Unsupported LEB128 value; more than 8 bytes")
+    lengths = np.ones(len(zigzag), dtype=np.int64)
+    for i in range(1, 8):
+        lengths += zigzag >= np.uint64(1 << (7 * i))
+    groups = np.arange(8)
+    parts = ((zigzag[:, None] >> (7 * groups).astype(np.uint64)) & np.uint64(0x7f)).astype(np.uint8)
+    parts[groups[None, :] < (lengths[:, None] - 1)] |= 0x80
+    return parts[groups[None, :] < lengths[:, None]].tobytes()
+
+
+class HistogramLogReader:
+
+    def __init__(self, path):
+        self.path = path
+        self.start_time = None
+        self.base_time = None
+        # comment and legend lines preceding the first interval.
+        self.header = []
+
+    # Yields (histogram, line) for every interval; the histogram timestamps are absolute seconds
+    # since epoch. With decode=False only the timestamps and tag are parsed, which is a lot cheaper.
+    def intervals(self, decode=True):
+        with open(self.path) as file:
+            for line in file:
+                interval = self.parse_line(line, decode)
+                if interval is not None:
+                    yield interval
+
+    # Parses a single line of the log, e.g. one that is tailed from a log that is still being
+    # written. Returns (histogram, line) like intervals or None for header and empty lines.
+    def parse_line(self, line, decode=True):
+        if line.startswith('#'):
+            if line.startswith('#[StartTime:'):
+                self.start_time = float(line[len('#[StartTime:'):].split()[0])
+            elif line.startswith('#[BaseTime:'):
+                self.base_time = float(line[len('#[BaseTime:'):].split()[0])
+            self.header.append(line)
+            return None
+        if line.startswith('"StartTimestamp"'):
+            self.header.append(line)
+            return None
+        line = line.strip()
+        if not line:
+            return None
+
+        tag = None
+        if line.startswith('Tag='):
+            tag, line = line[len('Tag='):].split(',', 1)
+        timestamp, length, _, encoded = line.split(',', 3)
+        timestamp = float(timestamp)
+        if self.start_time is None:
+            self.start_time = timestamp
+        if self.base_time is None:
+            # Same heuristic as the Java reader; timestamps long before the start time are
+            # relative to the start time.
+            self.base_time = self.start_time if timestamp < self.start_time - 365 * 24 * 3600.0 else 0.0
+
+        histogram = Histogram.decode(encoded) if decode else Histogram(significant_digits=0)
+        histogram.tag = tag
+        histogram.start_timestamp = timestamp + self.base_time
+        histogram.end_timestamp = histogram.start_timestamp + float(length)
+        return histogram, line if tag is None else f"Tag={tag},{line}"
+
+
+class HistogramLogWriter:
+
+    def __init__(self, file, start_time, base_time=None):
+        self.file = file
+        self.start_time = start_time
+        self.base_time = start_time if base_time is None else base_time
+
+    def write_header(self):
+        date = time.strftime('%a %b %d %H:%M:%S %Z %Y', time.localtime(self.start_time))
+        self.file.write('#[Histogram log format version 1.3]\n')
+        self.file.write(f'#[StartTime: {self.start_time:.3f} (seconds since epoch), {date}]\n')
+        self.file.write(f'#[BaseTime: {self.base_time:.3f} (seconds since epoch)]\n')
+        self.file.write('"StartTimestamp","Interval_Length","Interval_Max","Interval_Compressed_Histogram"\n')
+
+    def write(self, histogram):
+        tag = '' if histogram.tag is None else f'Tag={histogram.tag},'
+        self.file.write(f'{tag}{histogram.start_timestamp - self.base_time:.3f},'
+                        f'{histogram.end_timestamp - histogram.start_timestamp:.3f},'
+                        f'{histogram.max_value() / OUTPUT_VALUE_UNIT_RATIO:.3f},{histogram.encode()}\n')
+
+
+# The percentile distribution in the format of Java's Histogram.outputPercentileDistribution.
+def write_percentile_distribution(file, histogram, csv=False, ticks_per_half_distance=5,
+                                  ratio=OUTPUT_VALUE_UNIT_RATIO):
+    digits = histogram.significant_digits
+    if csv:
+        file.write('"Value","Percentile","TotalCount","1/(1-Percentile)"\n')
+    else:
+        file.write(f'{"Value":>12} {"Percentile":>14} {"TotalCount":>10} {"1/(1-Percentile)":>14}\n\n')
+
+    for value, percentile, total_count in histogram.percentiles(ticks_per_half_distance):
+        value = value / ratio
+        percentile = percentile / 100.0
+        if csv:
+            inverse = 'Infinity' if percentile == 1.0 else f'{1 / (1 - percentile):.2f}'
+            file.write(f'{value:.{digits}f},{percentile:.12f},{total_count},{inverse}\n')
+        elif percentile == 1.0:
+            file.write(f'{value:12.{digits}f} {percentile:2.12f} {total_count:10d}\n')
+        else:
+            file.write(f'{value:12.{digits}f} {percentile:2.12f} {total_count:10d} {1 / (1 - percentile):14.2f}\n')
+
+    if not csv:
+        file.write(f'#[Mean    = {histogram.mean() / ratio:12.{digits}f}, '
+                   f'StdDeviation   = {histogram.stddev() / ratio:12.{digits}f}]\n')
+        file.write(f'#[Max     = {histogram.max_value() / ratio:12.{digits}f}, '
+                   f'Total count    = {histogram.total_count():12d}]\n')
+        file.write(f'#[Buckets = {histogram.bucket_count:12d}, SubBuckets     = {histogram.sub_bucket_count:12d}]\n')
+
+
+SUMMARY_PERCENTILES = [50.0, 90.0, 99.0, 99.9, 99.99, 99.999]
+
+
+# The summary entries in the same format as the HdrLogProcessing summarize command.
+def summary(histogram):
+    prefix = '' if histogram.tag is None else f'{histogram.tag}.'
+    total_count = histogram.total_count()
+    period_ms = 0
+    if histogram.start_timestamp is not None:
+        period_ms = int(round((histogram.end_timestamp - histogram.start_timestamp) * 1000))
+    throughput = total_count * 1000.0 / period_ms if period_ms > 0 else 0.0
+
+    entries = {
+        f'{prefix}TotalCount': str(total_count),
+        f'{prefix}Period(ms)': str(period_ms),
+        f'{prefix}Throughput(ops/sec)': f'{throughput:.2f}',
+        f'{prefix}Min': str(histogram.min_value()),
+        f'{prefix}Mean': f'{histogram.mean():.2f}',
+    }
+    for percentile in SUMMARY_PERCENTILES:
+        entries[f'{prefix}{percentile:.3f}ptile'] = str(histogram.value_at_percentile(percentile))
+    entries[f'{prefix}Max'] = str(histogram.max_value())
+    return entries
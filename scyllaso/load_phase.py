@@ -0,0 +1,125 @@
+import os
+import hashlib
+from threading import Condition
+from scyllaso.partition import chunk_ranges
+
+
+def default_journal_path(*definition):
+    """
+    The journal of a load phase in the trials directory; the name is derived from everything that
+    defines the load, e.g. the row count and the command, so a different load never resumes from it.
+    """
+    digest = hashlib.sha1('\n'.join(str(part) for part in definition).encode()).hexdigest()[:16]
+    return os.path.join(os.getcwd(), 'trials', 'load_phases', f'{digest}.journal')
+
+
+class LoadPhaseJournal:
+    """
+    An append only record of the completed chunks of a load phase, one 'start,end' line per chunk,
+    so a crashed or aborted load phase can resume without inserting the completed ranges again.
+    The journal is removed once the load phase is complete; a later run of the same load phase,
+    e.g. on a new cluster, starts from scratch.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def completed(self):
+        ranges = []
+        if not os.path.exists(self.path):
+            return ranges
+        with open(self.path) as f:
+            for line in f:
+                parts = line.strip().split(',')
+                # a line can be incomplete if the orchestrator died while writing it.
+                if len(parts) != 2 or not all(part.isdigit() for part in parts):
+                    continue
+                ranges.append((int(parts[0]), int(parts[1])))
+        return ranges
+
+    def record(self, start, end):
+        with open(self.path, 'a') as f:
+            f.write(f'{start},{end}\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# The chunks of first..first+count-1 that are not covered by the completed ranges.
+def remaining_chunks(first, count, chunk_size, completed):
+    chunks = []
+    position = first
+    last = first + count - 1
+    for start, end in sorted(completed) + [(last + 1, last + 1)]:
+        if end < position:
+            continue
+        if start > position:
+            gap_end = min(start - 1, last)
+            chunks.extend(chunk_ranges(position, gap_end - position + 1, chunk_size))
+        position = max(position, end + 1)
+        if position > last:
+            break
+    return chunks
+
+
+class ChunkScheduler:
+    """
+    Hands out chunks to the load generators, whichever asks first. A failed chunk is handed out again,
+    at most max_attempts times. next blocks while chunks are in flight, since they could still fail and
+    need to be handed out again; it returns None once everything is done.
+    """
+
+    def __init__(self, chunks, max_attempts=3):
+        self.pending = list(chunks)
+        self.in_flight = set()
+        self.failed = []
+        self.attempts = {}
+        self.max_attempts = max_attempts
+        self.completed_items = 0
+        self.total_items = sum(end - start + 1 for start, end in chunks)
+        self.__condition = Condition()
+
+    def next(self):
+        with self.__condition:
+            while not self.pending and self.in_flight:
+                self.__condition.wait()
+            if not self.pending:
+                return None
+            chunk = self.pending.pop(0)
+            self.in_flight.add(chunk)
+            return chunk
+
+    def done(self, chunk):
+        with self.__condition:
+            self.in_flight.discard(chunk)
+            self.completed_items += chunk[1] - chunk[0] + 1
+            self.__condition.notify_all()
+
+    # Hands a chunk back without counting it as an attempt, e.g. when the load phase is aborted.
+    def release(self, chunk):
+        with self.__condition:
+            self.in_flight.discard(chunk)
+            self.pending.insert(0, chunk)
+            self.__condition.notify_all()
+
+    def retry(self, chunk):
+        with self.__condition:
+            self.in_flight.discard(chunk)
+            self.attempts[chunk] = self.attempts.get(chunk, 0) + 1
+            if self.attempts[chunk] < self.max_attempts:
+                self.pending.insert(0, chunk)
+            else:
+                self.failed.append(chunk)
+            self.__condition.notify_all()
+
+    def progress(self):
+        with self.__condition:
+            return self.completed_items, self.total_items
+
+    def remaining(self):
+        with self.__condition:
+            return self.pending + sorted(self.in_flight) + self.failed
@@ -0,0 +1,31 @@
+import math
+
+
+# Splits the sequence first..first+count-1 into a consecutive inclusive (start, end) range per weight,
+# sized proportionally to the weights. The rounding remainder goes to the largest fractions, so the
+# ranges cover every item exactly once. A range without items has end == start - 1.
+def weighted_ranges(first, count, weights):
+    if not weights or any(weight < 0 for weight in weights) or sum(weights) <= 0:
+        raise ValueError(f"Invalid weights {weights}")
+    total_weight = sum(weights)
+    quotas = [count * weight / total_weight for weight in weights]
+    sizes = [math.floor(quota) for quota in quotas]
+    remainder = count - sum(sizes)
+    by_fraction = sorted(range(len(weights)), key=lambda i: (sizes[i] - quotas[i], i))
+    for i in by_fraction[:remainder]:
+        sizes[i] += 1
+
+    ranges = []
+    start = first
+    for size in sizes:
+        ranges.append((start, start + size - 1))
+        start += size
+    return ranges
+
+
+# Splits the sequence first..first+count-1 into consecutive inclusive (start, end) ranges of at most chunk_size items.
+def chunk_ranges(first, count, chunk_size):
+    if chunk_size <= 0:
+        raise ValueError(f"Invalid chunk size {chunk_size}")
+    last = first + count - 1
+    return [(start, min(start + chunk_size - 1, last)) for start in range(first, last + 1, chunk_size)]
@@ -53,9 +53,8 @@ class Perf:
             pssh.update()
             self.updated = True
 
-        pssh.install("git")
-        # needed for addr2line
-        pssh.install("binutils")
+        # binutils is needed for addr2line
+        pssh.install("git", "binutils")
         pssh.exec(f"""
                 cd /tmp
                 if [ ! -d FlameGraph ]; then
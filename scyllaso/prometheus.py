@@ -62,7 +62,7 @@ class Prometheus:
     def data_dir_download(self, dir):
         log_important("Prometheus download data: started")
         ssh = SSH(self.ip, self.user, self.ssh_options)
-        ssh.scp_from_remote(f"data", dir)
+        ssh.stream_from_remote(".", dir, "data")
         log_important("Prometheus download data: done")
 
     def data_dir_rm(self):
@@ -0,0 +1,201 @@
+import os
+import glob
+import re
+import numpy as np
+from collections import namedtuple
+from datetime import datetime
+from scyllaso.hdr import ProfileSummaryResult, parse_profile_summary_file, profile_summary_operations
+from scyllaso.util import log
+
+# A single parsed summary; trial is the trial name (e.g. the profile name), rate the rate of the
+# cassandra-stress-<rate> step and iteration the name of the Iteration directory.
+IndexRecord = namedtuple('IndexRecord', ['trial', 'rate', 'iteration', 'operation'] + list(ProfileSummaryResult._fields))
+
+CACHE_FILE_NAME = '.results_index.npz'
+# Bumped when the cached records change; a cache with another version is rebuilt.
+CACHE_VERSION = 2
+STEP_DIR_PATTERN = re.compile(r'^cassandra-stress-(\d+)$')
+
+
+# The Iteration directory names are day first timestamps, so they don't sort chronologically as text.
+def iteration_time(iteration):
+    try:
+        return datetime.strptime(iteration[:19], "%d-%m-%Y_%H-%M-%S")
+    except ValueError:
+        return datetime.min
+
+
+class ResultsIndex:
+    """
+    An index over the profile-summary.txt files of all rate steps in the trials directory:
+    trials/<trial>/cassandra-stress-<rate>/<iteration>/profile-summary.txt.
+
+    The parsed records are cached column wise in trials/.results_index.npz together with the
+    modification time of the summary they came from, so an update only parses new or changed
+    summaries. Every operation in a summary is indexed; operations are only the default of the
+    reports.
+    """
+
+    def __init__(self, trials_dir='trials', operations=('WRITE', 'READ')):
+        self.trials_dir = trials_dir
+        self.operations = operations
+        self.cache_file = os.path.join(trials_dir, CACHE_FILE_NAME)
+        self.__records = {}
+        self.__mtimes = {}
+
+    def __load(self):
+        self.__records = {}
+        self.__mtimes = {}
+        if not os.path.exists(self.cache_file):
+            return
+        with np.load(self.cache_file, allow_pickle=False) as npz:
+            columns = {name: npz[name].tolist() for name in npz.files}
+        if columns.get('version') != CACHE_VERSION:
+            log(f"Results index: rebuilding [{self.cache_file}], it has an old format")
+            return
+        for i, path in enumerate(columns['path']):
+            self.__mtimes[path] = columns['mtime'][i]
+            record = IndexRecord(*[columns[field][i] for field in IndexRecord._fields])
+            self.__records.setdefault(path, []).append(record)
+        # paths without any record of the operations still have their mtime cached.
+        for path, mtime in zip(columns['empty_path'], columns['empty_mtime']):
+            self.__mtimes[path] = mtime
+
+    def __save(self):
+        paths = []
+        mtimes = []
+        records = []
+        for path, path_records in sorted(self.__records.items()):
+            for record in path_records:
+                paths.append(path)
+                mtimes.append(self.__mtimes[path])
+                records.append(record)
+        empty_paths = sorted(path for path in self.__mtimes if not self.__records.get(path))
+
+        columns = {
+            'version': np.array(CACHE_VERSION, dtype=np.int64),
+            'path': np.array(paths, dtype=str),
+            'mtime': np.array(mtimes, dtype=np.float64),
+            'empty_path': np.array(empty_paths, dtype=str),
+            'empty_mtime': np.array([self.__mtimes[path] for path in empty_paths], dtype=np.float64),
+        }
+        for i, field in enumerate(IndexRecord._fields):
+            values = [record[i] for record in records]
+            if field in ('trial', 'iteration', 'operation'):
+                columns[field] = np.array(values, dtype=str)
+            elif field in ('rate', 'ops_count'):
+                columns[field] = np.array(values, dtype=np.int64)
+            else:
+                columns[field] = np.array(values, dtype=np.float64)
+
+        tmp_file = self.cache_file + '.tmp.npz'
+        np.savez_compressed(tmp_file, **columns)
+        os.replace(tmp_file, self.cache_file)
+
+    def __summary_files(self):
+        for summary_file in glob.iglob(os.path.join(self.trials_dir, '**', 'profile-summary.txt'), recursive=True):
+            iteration_dir = os.path.dirname(summary_file)
+            iteration = os.path.basename(iteration_dir)
+            step_dir = os.path.dirname(iteration_dir)
+            match = STEP_DIR_PATTERN.match(os.path.basename(step_dir))
+            if iteration == 'latest' or match is None:
+                continue
+            trial = os.path.relpath(os.path.dirname(step_dir), self.trials_dir)
+            yield summary_file, trial, int(match.group(1)), iteration
+
+    def __parse(self, summary_file, trial, rate, iteration):
+        return [IndexRecord(trial, rate, iteration, operation, *parse_profile_summary_file(summary_file, operation))
+                for operation in sorted(profile_summary_operations(summary_file))]
+
+    def update(self):
+        """
+        Parses the summaries that are new or changed since the last update and saves the index.
+        """
+        self.__load()
+        seen = set()
+        parsed = 0
+        for summary_file, trial, rate, iteration in self.__summary_files():
+            seen.add(summary_file)
+            mtime = os.path.getmtime(summary_file)
+            if self.__mtimes.get(summary_file) == mtime:
+                continue
+            self.__records[summary_file] = self.__parse(summary_file, trial, rate, iteration)
+            self.__mtimes[summary_file] = mtime
+            parsed += 1
+
+        removed = [path for path in self.__mtimes if path not in seen]
+        for path in removed:
+            self.__mtimes.pop(path)
+            self.__records.pop(path, None)
+
+        if parsed or removed or not os.path.exists(self.cache_file):
+            self.__save()
+        log(f"Results index: parsed {parsed} summaries, {len(self.__mtimes)} in total")
+        return self
+
+    def records(self, trial=None, operation=None):
+        result = []
+        for path_records in self.__records.values():
+            for record in path_records:
+                if trial is not None and record.trial != trial:
+                    continue
+                if operation is not None and record.operation != operation:
+                    continue
+                result.append(record)
+        return sorted(result, key=lambda r: (r.trial, r.rate, r.iteration, r.operation))
+
+    def trials(self):
+        return sorted({record.trial for record in self.records()})
+
+    def curve(self, trial, operation):
+        """
+        The throughput-vs-latency curve of an operation in a trial: a record per rate, ordered by
+        rate. If a rate was run multiple times, the latest iteration is used.
+        """
+        latest = {}
+        for record in sorted(self.records(trial, operation), key=lambda r: iteration_time(r.iteration)):
+            latest[record.rate] = record
+        return [latest[rate] for rate in sorted(latest)]
+
+    def write_curves(self, output_dir=None):
+        """
+        Writes the curve of every trial and operation as <trial>/curve_<operation>.csv.
+        """
+        output_dir = self.trials_dir if output_dir is None else output_dir
+        for trial in self.trials():
+            for operation in self.operations:
+                curve = self.curve(trial, operation)
+                if not curve:
+                    continue
+                path = os.path.join(output_dir, trial, f'curve_{operation}.csv')
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as f:
+                    f.write(','.join(['rate'] + list(ProfileSummaryResult._fields)) + '\n')
+                    for record in curve:
+                        values = [record.rate] + [getattr(record, field) for field in ProfileSummaryResult._fields]
+                        f.write(','.join(str(value) for value in values) + '\n')
+                log(f"Written [{path}]")
+
+    def compare(self, trials, operation, field='p90_latency_ms'):
+        """
+        Returns a text table with the curves of the trials side by side, e.g. a Scylla and a
+        Cassandra profile: a row per rate with the achieved throughput and the field per trial.
+        """
+        curves = {trial: {record.rate: record for record in self.curve(trial, operation)} for trial in trials}
+        rates = sorted({rate for curve in curves.values() for rate in curve})
+
+        header = [f'{"rate":>10}']
+        for trial in trials:
+            header.append(f'{trial + " ops/s":>{max(len(trial) + 6, 12)}}')
+            header.append(f'{trial + " " + field:>{max(len(trial) + len(field) + 1, 12)}}')
+        lines = ['  '.join(header)]
+        for rate in rates:
+            row = [f'{rate:>10}']
+            for trial in trials:
+                record = curves[trial].get(rate)
+                throughput = '-' if record is None else f'{record.throughput_per_second:.0f}'
+                value = '-' if record is None else f'{getattr(record, field):.3f}'
+                row.append(f'{throughput:>{max(len(trial) + 6, 12)}}')
+                row.append(f'{value:>{max(len(trial) + len(field) + 1, 12)}}')
+            lines.append('  '.join(row))
+        return '\n'.join(lines)
@@ -0,0 +1,43 @@
+import re
+import time
+from scyllaso.util import log, log_important
+
+SCHEMA_VERSION_PATTERN = re.compile(r'^\s*([0-9a-fA-F-]{36}|UNREACHABLE):\s*\[(.*)\]\s*$')
+
+
+def parse_schema_versions(output):
+    """
+    Parses the 'Schema versions' of 'nodetool describecluster'; returns a dict from schema version
+    (or 'UNREACHABLE') to the list of node ips.
+    """
+    versions = {}
+    in_versions = False
+    for line in output.splitlines():
+        if line.strip().startswith('Schema versions:'):
+            in_versions = True
+            continue
+        if not in_versions:
+            continue
+        match = SCHEMA_VERSION_PATTERN.match(line)
+        if match is not None:
+            versions[match.group(1)] = [ip.strip() for ip in match.group(2).split(',') if ip.strip()]
+    return versions
+
+
+def wait_for_schema_agreement(describe_cluster, timeout_seconds=300, poll_interval_seconds=2):
+    """
+    Polls describe_cluster, a function returning the output of 'nodetool describecluster', until
+    all nodes are reachable and have the same schema version. Returns False on timeout.
+    """
+    log_important("Waiting for schema agreement: started")
+    deadline = time.time() + timeout_seconds
+    while True:
+        versions = parse_schema_versions(describe_cluster())
+        if len(versions) == 1 and 'UNREACHABLE' not in versions:
+            log_important("Waiting for schema agreement: done")
+            return True
+        if time.time() > deadline:
+            log_important(f"Waiting for schema agreement: timed out after {timeout_seconds}s, versions {versions}")
+            return False
+        log(f"No schema agreement yet: {versions}")
+        time.sleep(poll_interval_seconds)
@@ -1,7 +1,15 @@
 from time import sleep
 from scyllaso.ssh import PSSH, SSH
 from scyllaso.util import log, run_parallel, log_important, log_machine
-from scyllaso.cql import wait_for_cql_start
+from scyllaso.cql import wait_for_cql_start, wait_for_cql_start_all
+from scyllaso.compaction import wait_for_compactions
+from scyllaso.schema import wait_for_schema_agreement
+from scyllaso.dataset import save_dataset_script, restore_dataset_script, has_dataset_command
+
+SCYLLA_DATA_DIR = '/var/lib/scylla/data'
+SCYLLA_COMMITLOG_DIR = '/var/lib/scylla/commitlog'
+# Outside of the data dir, so it survives wiping the data, but on the same filesystem for the hardlinks.
+SCYLLA_SAVED_DATASETS_DIR = '/var/lib/scylla/saved-datasets'
 
 
 def clear_cluster(cluster_public_ips, cluster_user, ssh_options, duration_seconds=90):
@@ -35,6 +43,15 @@ def restart_cluster(cluster_public_ips, cluster_user, ssh_options, duration_seco
     log("Cluster restarted")
 
 
+def cluster_schema_agreement(cluster_public_ips, cluster_user, ssh_options, timeout_seconds=300):
+    """
+    Waits till all nodes agree on the schema according to 'nodetool describecluster'; for scripts
+    without a Scylla object, e.g. as the schema_check of CassandraStress.
+    """
+    ssh = SSH(cluster_public_ips[0], cluster_user, ssh_options)
+    return wait_for_schema_agreement(lambda: ssh.exec_capture("nodetool describecluster"), timeout_seconds)
+
+
 def nodes_remove_data(cluster_user, ssh_options, *public_ips):
     log(f"Removing data from nodes {public_ips}")
     pssh = PSSH(public_ips, cluster_user, ssh_options)
@@ -74,27 +91,30 @@ class Scylla:
     def __install(self, ip):
         ssh = self.__new_ssh(ip)
 
-        # Scylla AMI automatically performs setup
-        # and then starts up. Each node is a separate 1-node cluster.
-        # Here, we wait for this startup.
-        wait_for_cql_start(ip)
-
-        # Scylla started. Now we stop it and wipe
+        # Scylla started (see install). Now we stop it and wipe
         # the data it generated.
 
+        # All steps are shipped in a single batch to avoid an ssh round trip per step.
+        batch = ssh.batch()
+
         # FIXME - stop scylla-server more forcefully?
-        ssh.exec("sudo systemctl stop scylla-server")
-        ssh.exec("sudo rm -rf /var/lib/scylla/data/*")
-        ssh.exec("sudo rm -rf /var/lib/scylla/commitlog/*")
+        batch.add("sudo systemctl stop scylla-server")
+        batch.add("sudo rm -rf /var/lib/scylla/data/*")
+        batch.add("sudo rm -rf /var/lib/scylla/commitlog/*")
 
         # Patch configuration files
-        ssh.exec("sudo sed -i \"s/cluster_name:.*/cluster_name: cluster1/g\" /etc/scylla/scylla.yaml")
-        ssh.exec(f'sudo sed -i \"s/seeds:.*/seeds: {self.seed_private_ip} /g\" /etc/scylla/scylla.yaml')
-        ssh.exec("sudo sh -c \"echo 'compaction_static_shares: 100' >> /etc/scylla/scylla.yaml\"")
-        ssh.exec("sudo sh -c \"echo 'compaction_enforce_min_threshold: true' >> /etc/scylla/scylla.yaml\"")
+        batch.add("sudo sed -i \"s/cluster_name:.*/cluster_name: cluster1/g\" /etc/scylla/scylla.yaml")
+        batch.add(f'sudo sed -i \"s/seeds:.*/seeds: {self.seed_private_ip} /g\" /etc/scylla/scylla.yaml')
+        batch.add("sudo sh -c \"echo 'compaction_static_shares: 100' >> /etc/scylla/scylla.yaml\"")
+        batch.add("sudo sh -c \"echo 'compaction_enforce_min_threshold: true' >> /etc/scylla/scylla.yaml\"")
+        batch.exec()
 
     def install(self):
         log_important("Installing Scylla: started")
+        # Scylla AMI automatically performs setup
+        # and then starts up. Each node is a separate 1-node cluster.
+        # Here, we wait for this startup on all nodes at once.
+        wait_for_cql_start_all(self.cluster_public_ips)
         run_parallel(self.__install, [(ip,) for ip in self.cluster_public_ips])
         log_important("Installing Scylla: done")
 
@@ -105,6 +125,7 @@ class Scylla:
 
     def start(self):
         log(f"Starting Scylla nodes {self.cluster_public_ips}")
+        # Nodes are started one by one since joining nodes must bootstrap one at a time.
         for public_ip in self.cluster_public_ips:
             ssh = self.__new_ssh(public_ip)
             ssh.exec("sudo systemctl start scylla-server")
@@ -119,6 +140,73 @@ class Scylla:
             ssh = self.__new_ssh(self.cluster_public_ips[load_index])
             ssh.exec(f"nodetool {command}")
 
+    def __compaction_stats(self, ip):
+        return self.__new_ssh(ip).exec_capture("nodetool compactionstats")
+
+    def wait_for_compactions(self, stable_seconds=300, timeout_seconds=12 * 3600, poll_interval_seconds=30):
+        """
+        Polls 'nodetool compactionstats' on all nodes in parallel and returns once there are no
+        pending or active compactions for stable_seconds. Raises on timeout.
+        """
+        return wait_for_compactions(self.cluster_public_ips, self.__compaction_stats, stable_seconds,
+                                    timeout_seconds, poll_interval_seconds)
+
+    def wait_for_schema_agreement(self, timeout_seconds=300):
+        """
+        Waits till all nodes agree on the schema according to 'nodetool describecluster'.
+        """
+        ssh = self.__new_ssh(self.cluster_public_ips[0])
+        return wait_for_schema_agreement(lambda: ssh.exec_capture("nodetool describecluster"), timeout_seconds)
+
+    def __save_dataset(self, ip, name):
+        log_machine(ip, f"Saving dataset [{name}]")
+        self.__new_ssh(ip).exec(save_dataset_script(name, "nodetool", SCYLLA_DATA_DIR, SCYLLA_SAVED_DATASETS_DIR,
+                                                    self.cluster_private_ips[self.cluster_public_ips.index(ip)],
+                                                    sudo='sudo '))
+
+    def save_dataset(self, name):
+        """
+        Saves the current data of all nodes as a named dataset, e.g. after the load and compaction
+        finished. The dataset is a hardlinked snapshot, so it takes seconds and no extra space until
+        the sstables get compacted away.
+        """
+        log_important(f"Saving dataset [{name}]: started")
+        run_parallel(self.__save_dataset, [(ip, name) for ip in self.cluster_public_ips])
+        log_important(f"Saving dataset [{name}]: done")
+
+    def __has_dataset(self, ip, name):
+        output = self.__new_ssh(ip).exec_capture(has_dataset_command(
+            name, SCYLLA_SAVED_DATASETS_DIR, self.cluster_private_ips[self.cluster_public_ips.index(ip)]))
+        return output.strip() == 'yes'
+
+    def has_dataset(self, name):
+        return all(self.__has_dataset(ip, name) for ip in self.cluster_public_ips)
+
+    def __restore_dataset(self, ip, name, reflink):
+        log_machine(ip, f"Restoring dataset [{name}]")
+        ssh = self.__new_ssh(ip)
+        ssh.exec("nodetool drain", ignore_errors=True)
+        ssh.exec("sudo systemctl stop scylla-server")
+        ssh.exec(restore_dataset_script(name, SCYLLA_DATA_DIR, SCYLLA_COMMITLOG_DIR, SCYLLA_SAVED_DATASETS_DIR,
+                                        self.cluster_private_ips[self.cluster_public_ips.index(ip)],
+                                        sudo='sudo ', owner='scylla:scylla', reflink=reflink))
+
+    def restore_dataset(self, name, reflink=False):
+        """
+        Replaces the data of all nodes by a dataset saved with save_dataset and restarts the cluster.
+        The dataset can only be restored on the cluster it was saved on.
+
+        Parameters
+        ----------
+        reflink: bool
+            Restore using reflinks (cp --reflink=always, e.g. XFS) instead of hardlinks. With hardlinks
+            the restored sstables share the inodes with the dataset.
+        """
+        log_important(f"Restoring dataset [{name}]: started")
+        run_parallel(self.__restore_dataset, [(ip, name, reflink) for ip in self.cluster_public_ips])
+        self.start()
+        log_important(f"Restoring dataset [{name}]: done")
+
     def stop(self, load_index=None, erase_data=False):
         if load_index is None:
             log("Not implemented!")
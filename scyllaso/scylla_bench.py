@@ -1,17 +1,25 @@
 import os
+import re
 import time
 
 from datetime import datetime
-from scyllaso.ssh import SSH
+from scyllaso.clock import measure_clock_offsets, synchronized_start_command, write_clock_offsets, \
+    CLOCK_OFFSETS_FILE_NAME
+from scyllaso.partition import weighted_ranges
+from scyllaso.ssh import SSH, PSSH
 from scyllaso.util import run_parallel, WorkerThread, log_important, log_machine, log
 
 
 class ScyllaBench:
 
-    def __init__(self, load_ips, properties, performance_governor=True):
+    def __init__(self, load_ips, properties, performance_governor=True, schema_check=None):
         self.properties = properties
         self.load_ips = load_ips
         self.performance_governor = performance_governor
+        # called after the schema has been created, e.g. cluster.wait_for_schema_agreement; False fails the run.
+        self.schema_check = schema_check
+        # (start_time, clock offsets per load generator) of the last synchronized start.
+        self.last_start = None
         self.ssh_user = properties.get('loadgenerator_user')
 
         # needed for compatibility reasons.
@@ -45,14 +53,30 @@ class ScyllaBench:
         run_parallel(self.__install, [(ip,) for ip in self.load_ips])
         log_important("Installing scylla_bench: done")
 
-    def __stress(self, ip, cmd):
+    def __stress(self, ip, cmd, start_time=None, offset_seconds=0.0):
         full_cmd = f'go/bin/scylla-bench {cmd}'
 
         dt = datetime.now().strftime("%d-%m-%Y_%H-%M-%S")
         full_cmd = full_cmd + f" 2>&1 | tee -a scylla-bench-{dt}.log"
         log(full_cmd)
+        if start_time is not None:
+            full_cmd = synchronized_start_command(full_cmd, start_time, offset_seconds)
         self.__new_ssh(ip).exec(full_cmd)
 
+    # Like CassandraStress: the first command creates the schema by writing a single partition,
+    # then all load generators are armed to start at the same moment.
+    def __synchronized_stress(self, ips, commands, start_delay_seconds=5):
+        log_machine(ips[0], 'Creating schema')
+        self.__stress(ips[0], re.sub(r'-partition-count \d+', '-partition-count 1', commands[0]))
+        if self.schema_check is not None and not self.schema_check():
+            raise Exception("The cluster didn't reach schema agreement")
+        offsets = measure_clock_offsets(ips, self.__new_ssh)
+        start_time = time.time() + start_delay_seconds
+        self.last_start = (start_time, offsets)
+        log(f"Synchronized start at {datetime.fromtimestamp(start_time).strftime('%H:%M:%S.%f')}")
+        run_parallel(self.__stress, [(ip, command, start_time, offsets[ip].offset_seconds)
+                                     for ip, command in zip(ips, commands)])
+
     def stress(self, command, load_index=None):
         if load_index is None:
             log_important("scylla-bench: started")
@@ -73,38 +97,38 @@ class ScyllaBench:
                partition_offset=0,
                concurrency=64,
                clustering_row_count=1,
-               extra_args=""):
+               extra_args="",
+               weights=None):
+        """
+        Parameters
+        ----------
+        weights: list
+            The relative capacity of every load generator, e.g. the number of cores. The partitions
+            are split proportionally; by default evenly. Every partition is written exactly once.
+        """
         log_important(f"Inserting {partition_count} partitions")
         start_seconds = time.time()
 
-        # todo: there could be some loss if there is a reaminer.
-        pc_per_lg = partition_count // len(self.load_ips)
-
+        weights = [1] * len(self.load_ips) if weights is None else weights
+        ips = []
         cmd_list = []
-        for i in range(0, len(self.load_ips)):
+        for ip, (start, end) in zip(self.load_ips, weighted_ranges(partition_offset, partition_count, weights)):
+            if end < start:
+                continue
             cmd = f"""-workload sequential \
                       -clustering-row-count {clustering_row_count} \
                       -mode write \
-                      -partition-count {pc_per_lg} \
-                      -partition-offset {partition_offset} \
+                      -partition-count {end - start + 1} \
+                      -partition-offset {start} \
                       -nodes {nodes} \
-                      -concurrency {concurrency} \ 
+                      -concurrency {concurrency} \
                       {extra_args}"""
             # clean the string up.
             cmd = " ".join(cmd.split())
+            ips.append(ip)
             cmd_list.append(cmd)
-            partition_offset = partition_offset + pc_per_lg
 
-        futures = []
-        for i in range(0, len(self.load_ips)):
-            f = self.async_stress(cmd_list[i], load_index=i)
-            futures.append(f)
-            if i == 0:
-                # first one is given some extra time to set up the tables and all that.
-                time.sleep(10)
-
-        for f in futures:
-            f.join()
+        self.__synchronized_stress(ips, cmd_list)
 
         duration_seconds = time.time() - start_seconds
         log(f"Duration : {duration_seconds} seconds")
@@ -117,12 +141,10 @@ class ScyllaBench:
     def ssh(self, command):
         run_parallel(self.__ssh, [(ip, command) for ip in self.load_ips])
 
-    def __upload(self, ip, file):
-        self.__new_ssh(ip).scp_to_remote(file, "")
-
     def upload(self, file):
         log_important(f"Upload: started")
-        run_parallel(self.__upload, [(ip, file) for ip in self.load_ips])
+        pssh = PSSH(self.load_ips, self.ssh_user, self.properties['ssh_options'])
+        pssh.distribute(file, os.path.basename(file))
         log_important(f"Upload: done")
 
     def __collect(self, ip, dir):
@@ -130,7 +152,7 @@ class ScyllaBench:
         os.makedirs(dest_dir, exist_ok=True)
         log_machine(ip, f'Collecting to [{dest_dir}]')
         ssh = self.__new_ssh(ip)
-        ssh.scp_from_remote(f'*.log', dest_dir)
+        ssh.stream_from_remote('.', dest_dir, '*.log')
         ssh.exec(f'rm -fr *.log')
         log_machine(ip, f'Collecting to [{dest_dir}] done')
 
@@ -144,6 +166,9 @@ class ScyllaBench:
 
         log_important(f"Collecting results: started")
         run_parallel(self.__collect, [(ip, dir) for ip in self.load_ips])
+        if self.last_start is not None:
+            start_time, offsets = self.last_start
+            write_clock_offsets(os.path.join(dir, CLOCK_OFFSETS_FILE_NAME), offsets, start_time)
         log_important(f"Collecting results: done")
         log(f"Results can be found in [{dir}]")
 
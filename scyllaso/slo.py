@@ -0,0 +1,129 @@
+from threading import Lock
+from scyllaso.util import log_important
+
+
+class LatencySlo:
+    """
+    Violated when the given percentile of a tag is above max_latency_ms for consecutive_intervals
+    consecutive (1 second) intervals. If tag is None, the SLO applies to every tag separately.
+    """
+
+    def __init__(self, percentile, max_latency_ms, consecutive_intervals=3, tag=None):
+        self.percentile = percentile
+        self.max_latency_ms = max_latency_ms
+        self.consecutive_intervals = consecutive_intervals
+        self.tag = tag
+        self.__exceeded = {}
+
+    def check_interval(self, interval):
+        if self.tag is not None and interval.tag != self.tag:
+            return None
+        latency_ms = interval.percentiles_ms.get(self.percentile)
+        if latency_ms is None or latency_ms <= self.max_latency_ms:
+            self.__exceeded[interval.tag] = 0
+            return None
+        exceeded = self.__exceeded.get(interval.tag, 0) + 1
+        self.__exceeded[interval.tag] = exceeded
+        if exceeded < self.consecutive_intervals:
+            return None
+        return f"[{interval.tag}] p{self.percentile:g} {latency_ms:.3f}ms above {self.max_latency_ms}ms " \
+               f"for {exceeded} consecutive intervals"
+
+    def check_progress(self, ip, total_ops, errors):
+        return None
+
+
+class ErrorRateSlo:
+    """
+    Violated when the fraction of failed operations on a load generator is above max_error_rate
+    for consecutive_intervals consecutive cassandra-stress progress reports.
+    """
+
+    def __init__(self, max_error_rate, consecutive_intervals=1):
+        self.max_error_rate = max_error_rate
+        self.consecutive_intervals = consecutive_intervals
+        self.__last = {}
+        self.__exceeded = {}
+
+    def check_interval(self, interval):
+        return None
+
+    def check_progress(self, ip, total_ops, errors):
+        last_total_ops, last_errors = self.__last.get(ip, (0, 0))
+        self.__last[ip] = (total_ops, errors)
+        new_errors = errors - last_errors
+        attempts = (total_ops - last_total_ops) + new_errors
+        if attempts <= 0 or new_errors / attempts <= self.max_error_rate:
+            self.__exceeded[ip] = 0
+            return None
+        exceeded = self.__exceeded.get(ip, 0) + 1
+        self.__exceeded[ip] = exceeded
+        if exceeded < self.consecutive_intervals:
+            return None
+        return f"[{ip}] error rate {new_errors / attempts:.4f} above {self.max_error_rate}"
+
+
+class SloGuard:
+    """
+    Evaluates a list of SLO policies against the live data of a stress run: the LatencySlo against
+    the merged hdr intervals and the ErrorRateSlo against the progress reports cassandra-stress
+    prints. The first violation marks the run as failed and calls the abort function, so the
+    load generators can be stopped instead of running for the full duration.
+    """
+
+    def __init__(self, *policies):
+        self.policies = policies
+        self.violation = None
+        self.abort = None
+        self.__lock = Lock()
+        # column indices of cassandra-stress output per load generator.
+        self.__columns = {}
+
+    @property
+    def failed(self):
+        return self.violation is not None
+
+    def percentiles(self):
+        return [policy.percentile for policy in self.policies if isinstance(policy, LatencySlo)]
+
+    def arm(self, abort):
+        self.violation = None
+        self.abort = abort
+
+    def check_interval(self, interval):
+        self.__check(lambda policy: policy.check_interval(interval))
+
+    def check_output(self, ip, line):
+        # cassandra-stress prints a header like 'type, total ops, op/s, ..., errors, ...' followed
+        # by a 'total, ...' line per report interval. The errors column is cumulative.
+        columns = [column.strip() for column in line.split(',')]
+        if columns[0].startswith('type') and 'errors' in columns:
+            # the header has no comma between 'type' and 'total ops'.
+            columns = columns[0].split(None, 1) + columns[1:]
+        if columns[0] == 'type' and 'total ops' in columns and 'errors' in columns:
+            self.__columns[ip] = (columns.index('total ops'), columns.index('errors'))
+            return
+        indices = self.__columns.get(ip)
+        if indices is None or columns[0] != 'total' or len(columns) <= max(indices):
+            return
+        try:
+            total_ops = int(columns[indices[0]])
+            errors = int(columns[indices[1]])
+        except ValueError:
+            return
+        self.__check(lambda policy: policy.check_progress(ip, total_ops, errors))
+
+    def __check(self, check):
+        with self.__lock:
+            if self.violation is not None:
+                return
+            for policy in self.policies:
+                violation = check(policy)
+                if violation is not None:
+                    self.violation = violation
+                    break
+            else:
+                return
+        log_important(f"SLO violated: {self.violation}")
+        if self.abort is not None:
+            self.abort()
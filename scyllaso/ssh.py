@@ -1,8 +1,132 @@
+import asyncio
+import atexit
+import hashlib
 import os
+import secrets
 import selectors
+import shlex
+import shutil
 import subprocess
+import tempfile
 import time
-from scyllaso.util import run_parallel, log_machine, LogLevel, WorkerThread
+from collections import namedtuple
+from threading import Lock, Thread
+from scyllaso.clock import measure_clock_offsets
+from scyllaso.network_wait import tcp_probe, tcp_probe_async
+from scyllaso.util import run_parallel, run_async_parallel, log, log_machine, LogLevel, WorkerThread, sha256_file, \
+    Backoff
+
+# The one-off key and the known hosts of PSSH.relay, in the home dir of the hosts.
+RELAY_KEY_FILE = ".scyllaso_relay_key"
+RELAY_KNOWN_HOSTS_FILE = ".scyllaso_relay_known_hosts"
+
+
+# A control master connection to a single host. The master is reused by every SSH instance
+# (exec and scp) that targets the same user, ip and ssh options.
+class Session:
+
+    def __init__(self, user, ip, ssh_options, socket_file, check_interval_seconds):
+        self.user = user
+        self.ip = ip
+        self.ssh_options = ssh_options
+        self.socket_file = socket_file
+        self.check_interval_seconds = check_interval_seconds
+        # serializes the opening of the master between threads.
+        self.lock = Lock()
+        # true if the master was opened by this process; only those are torn down at exit.
+        self.owned = False
+        self.last_checked = None
+
+    def __check_cmd(self):
+        # 'check' only talks to the local master process; it doesn't touch the network.
+        return ["ssh", "-S", self.socket_file, "-O", "check", f"{self.user}@{self.ip}"]
+
+    # None if the outcome is known without running the check command.
+    def __cached_alive(self):
+        if not os.path.exists(self.socket_file):
+            return False
+
+        if self.last_checked is not None and time.time() - self.last_checked < self.check_interval_seconds:
+            return True
+
+        return None
+
+    def is_alive(self):
+        alive = self.__cached_alive()
+        if alive is not None:
+            return alive
+
+        exitcode = subprocess.call(self.__check_cmd(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return self.__checked(exitcode)
+
+    # The same as is_alive, without blocking the event loop on the check command.
+    async def is_alive_async(self):
+        alive = self.__cached_alive()
+        if alive is not None:
+            return alive
+
+        process = await asyncio.create_subprocess_exec(*self.__check_cmd(),
+                                                       stdout=asyncio.subprocess.DEVNULL,
+                                                       stderr=asyncio.subprocess.DEVNULL)
+        return self.__checked(await process.wait())
+
+    def __checked(self, exitcode):
+        if exitcode != 0:
+            # the master is gone, but it left its socket file behind.
+            log_machine(self.ip, f'Removing stale control socket [{self.socket_file}]', log_level=LogLevel.warning)
+            try:
+                os.remove(self.socket_file)
+            except FileNotFoundError:
+                pass
+            self.last_checked = None
+            return False
+
+        self.last_checked = time.time()
+        return True
+
+    def opened(self):
+        if os.path.exists(self.socket_file):
+            self.owned = True
+            self.last_checked = time.time()
+
+    def close(self):
+        if not self.owned or not os.path.exists(self.socket_file):
+            return
+        subprocess.call(["ssh", "-S", self.socket_file, "-O", "exit", f"{self.user}@{self.ip}"],
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL)
+        self.owned = False
+        self.last_checked = None
+
+
+# Process wide pool of control master sessions keyed on (user, ip, ssh_options).
+class SessionPool:
+
+    def __init__(self, check_interval_seconds=60):
+        self.check_interval_seconds = check_interval_seconds
+        self.__lock = Lock()
+        self.__sessions = {}
+
+    def get(self, user, ip, ssh_options):
+        key = (user, ip, ssh_options)
+        with self.__lock:
+            session = self.__sessions.get(key)
+            if session is None:
+                digest = hashlib.sha1(ssh_options.encode()).hexdigest()[:8]
+                socket_file = f"/tmp/{user}@{ip}-{digest}.socket"
+                session = Session(user, ip, ssh_options, socket_file, self.check_interval_seconds)
+                self.__sessions[key] = session
+            return session
+
+    def close_all(self):
+        with self.__lock:
+            sessions = list(self.__sessions.values())
+        for session in sessions:
+            session.close()
+
+
+session_pool = SessionPool()
+atexit.register(session_pool.close_all)
 
 
 # Parallel SSH
@@ -14,13 +138,18 @@ class PSSH:
                  ssh_options,
                  use_control_socket=True,
                  silent_seconds=30,
-                 log_ssh=False):
+                 log_ssh=False,
+                 max_concurrency=64,
+                 connect_timeout_seconds=600):
         self.ip_list = ip_list
         self.user = user
         self.ssh_options = ssh_options
         self.use_control_socket = use_control_socket
         self.silent_seconds = silent_seconds
         self.log_ssh = log_ssh
+        self.connect_timeout_seconds = connect_timeout_seconds
+        # the maximum number of ssh processes that run at the same time.
+        self.max_concurrency = max_concurrency
 
     def __new_ssh(self, ip):
         return SSH(ip,
@@ -28,48 +157,73 @@ class PSSH:
                    self.ssh_options,
                    use_control_socket=self.use_control_socket,
                    silent_seconds=self.silent_seconds,
-                   log_ssh=self.log_ssh)
+                   log_ssh=self.log_ssh,
+                   connect_timeout_seconds=self.connect_timeout_seconds)
+
+    def measure_clock_offsets(self, samples=5):
+        """
+        A preflight check: measures the clock offset and round trip of every host relative to
+        this machine in parallel. Returns a dict from ip to ClockOffset; see Iteration.record_clock_offsets.
+        """
+        return measure_clock_offsets(self.ip_list, self.__new_ssh, samples)
 
-    def __exec(self, ip, cmd):
-        self.__new_ssh(ip).exec(cmd)
+    async def __exec(self, ip, cmd):
+        await self.__new_ssh(ip).exec_async(cmd)
 
     def exec(self, cmd):
-        run_parallel(self.__exec, [(ip, cmd) for ip in self.ip_list])
+        run_async_parallel(self.__exec, [(ip, cmd) for ip in self.ip_list], max_concurrency=self.max_concurrency)
 
     def async_exec(self, command):
-        thread = WorkerThread(self.exec, (command))
+        thread = WorkerThread(self.exec, (command,))
         thread.start()
         return thread.future
 
-    def __update(self, ip):
-        self.__new_ssh(ip).update()
+    async def __exec_capture(self, ip, command, ignore_errors):
+        return ip, await self.__new_ssh(ip).exec_capture_async(command, ignore_errors=ignore_errors)
 
-    def update(self):
-        # todo: needs to be fixed; should be parallel, now sequential
-        for ip in self.ip_list:
-            ssh = SSH(ip, self.user, self.ssh_options)
-            ssh.update()
+    # Returns a dict with the stdout of the command per ip.
+    def exec_capture(self, command, ignore_errors=False):
+        results = run_async_parallel(self.__exec_capture,
+                                     [(ip, command, ignore_errors) for ip in self.ip_list],
+                                     max_concurrency=self.max_concurrency)
+        return dict(results)
 
-        # can't get this to run correctly.
-        # run_parallel(self.__update, [ip for ip in self.ip_list])
+    def batch(self):
+        return CommandBatch(self)
 
-    def __install_one(self, ip, *packages):
-        self.__new_ssh(ip).install_one(*packages)
+    async def __exec_batch(self, ip, batch):
+        return ip, await self.__new_ssh(ip).exec_batch_async(batch)
 
-    def install_one(self, *packages):
-        run_parallel(self.__install_one, [(ip, *packages) for ip in self.ip_list])
+    # Returns a dict with the list of StepResults per ip.
+    def exec_batch(self, batch):
+        results = run_async_parallel(self.__exec_batch,
+                                     [(ip, batch) for ip in self.ip_list],
+                                     max_concurrency=self.max_concurrency)
+        return dict(results)
 
-    def __try_install(self, ip, *packages):
-        self.__new_ssh(ip).try_install(*packages)
+    # Package management runs on all hosts concurrently, bounded by max_concurrency.
+    async def __exec_script(self, ip, script, ignore_errors=False):
+        await self.__new_ssh(ip).exec_async(script, ignore_errors=ignore_errors)
 
-    def try_install(self, *packages):
-        run_parallel(self.__try_install, [(ip, *packages) for ip in self.ip_list])
+    def __exec_script_all(self, script, ignore_errors=False):
+        run_async_parallel(self.__exec_script,
+                           [(ip, script, ignore_errors) for ip in self.ip_list],
+                           max_concurrency=self.max_concurrency)
+
+    def update(self):
+        log(f'Update: started {self.ip_list}')
+        self.__exec_script_all(update_script())
+        log(f'Update: done {self.ip_list}')
+
+    def install_one(self, *packages):
+        self.__exec_script_all(install_one_script(packages))
 
-    def __install(self, ip, *packages):
-        self.__new_ssh(ip).install(*packages)
+    def try_install(self, *packages):
+        self.install(*packages, ignore_errors=True)
 
-    def install(self, *packages):
-        run_parallel(self.__install, [(ip, *packages) for ip in self.ip_list])
+    def install(self, *packages, ignore_errors=False):
+        log(f'Install: {" ".join(packages)}')
+        self.__exec_script_all(install_script(packages, ignore_errors=ignore_errors), ignore_errors=ignore_errors)
 
     def __scp_from_remote(self, src, dst_dir, ip):
         self.__new_ssh(ip).scp_from_remote(src, os.path.join(dst_dir, ip))
@@ -83,6 +237,180 @@ class PSSH:
     def scp_to_remote(self, src, dst):
         run_parallel(self.__scp_to_remote, [(src, dst, ip) for ip in self.ip_list])
 
+    def __upload(self, src, dst, ip):
+        self.__new_ssh(ip).upload(src, dst)
+
+    # Incremental flavor of scp_to_remote; see SSH.upload.
+    def upload(self, src, dst=""):
+        run_parallel(self.__upload, [(src, dst, ip) for ip in self.ip_list])
+
+    # Distributes a local file to dst on all hosts. Hosts that already have an identical copy are
+    # skipped. If none of them has it, the orchestrator uploads the file only once, to the first
+    # host; see relay for how it spreads from there. The relay only handles files; a directory is
+    # uploaded incrementally to every host, see SSH.upload.
+    def distribute(self, src, dst, private_ips=None, fanout=2):
+        log(f'Distribute [{src}] to {self.ip_list}: started')
+        if os.path.isdir(src):
+            if os.path.basename(os.path.normpath(src)) != os.path.basename(os.path.normpath(dst)):
+                raise ValueError(f"Can't distribute directory [{src}] as [{dst}], the names need to match")
+            self.__mkdir_parent(dst)
+            self.upload(src, os.path.dirname(os.path.normpath(dst)))
+            log(f'Distribute [{src}] to {self.ip_list}: done')
+            return
+
+        digest = sha256_file(src)
+        digests = self.__remote_digests(dst)
+        if all(remote_digest == digest for remote_digest in digests.values()):
+            log(f'Distribute [{src}] to {self.ip_list}: unchanged, skipping')
+            return
+
+        if digest not in digests.values():
+            self.__mkdir_parent(dst)
+            self.__new_ssh(self.ip_list[0]).scp_to_remote(src, dst)
+        self.relay(dst, private_ips=private_ips, fanout=fanout, digest=digest, fallback_src=src)
+        log(f'Distribute [{src}] to {self.ip_list}: done')
+
+    # Returns a dict with the sha256 of the file per ip; None if the file doesn't exist.
+    def __remote_digests(self, path):
+        digests = {}
+        for ip, output in self.exec_capture(f"sha256sum {path} 2>/dev/null", ignore_errors=True).items():
+            digests[ip] = output.split()[0] if output.strip() else None
+        return digests
+
+    # Spreads a file that is present on the first host to the same path on all other hosts. Hosts
+    # relay the file to each other in a fan-out tree: in every round, each host that has the file
+    # (with the right digest) sends it to up to 'fanout' hosts that don't. So the number of rounds grows logarithmically with
+    # the number of hosts and the orchestrator's uplink isn't used at all.
+    #
+    # The hosts authenticate to each other with a one-off keypair that is only authorized for the
+    # duration of the relay, and verify each other's host keys as collected by the orchestrator.
+    # If private_ips (in the same order as the ip_list) are passed, the transfers go over the private
+    # network.
+    #
+    # Every transfer is verified with the sha256 on the target; only verified targets relay further and
+    # a failed target is retried from another holder. Hosts that still don't have a good copy at the end
+    # get the fallback_src directly from the orchestrator or run the fallback_command to fetch it
+    # themselves, if provided.
+    def relay(self, path, private_ips=None, fanout=2, digest=None, fallback_src=None, fallback_command=None,
+              max_attempts=2):
+        addresses = dict(zip(self.ip_list, private_ips if private_ips else self.ip_list))
+
+        digests = self.__remote_digests(path)
+        if digest is None:
+            digest = digests[self.ip_list[0]]
+            if digest is None:
+                raise Exception(f"Can't relay [{path}], it doesn't exist on [{self.ip_list[0]}]")
+
+        holders = [ip for ip in self.ip_list if digests[ip] == digest]
+        pending = [ip for ip in self.ip_list if digests[ip] != digest]
+        if not pending:
+            return
+        if not holders:
+            raise Exception(f"Can't relay [{path}], none of the hosts has a copy with sha256 {digest}")
+
+        self.__mkdir_parent(path)
+        failed = []
+        attempts = {}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            marker = self.__authorize_relay_key(tmp_dir, addresses, bool(private_ips))
+            try:
+                round_nr = 1
+                while pending:
+                    transfers = []
+                    for holder in holders:
+                        for _ in range(fanout):
+                            if pending:
+                                transfers.append((holder, pending.pop(0)))
+                    log(f'Relay [{path}] round {round_nr}: {len(transfers)} transfers')
+                    results = run_async_parallel(self.__relay_one,
+                                                 [(source, target, addresses[target], path, digest)
+                                                  for source, target in transfers],
+                                                 max_concurrency=self.max_concurrency,
+                                                 ignore_errors=True)
+                    for (source, target), result in zip(transfers, results):
+                        if result is True:
+                            holders.append(target)
+                            continue
+                        attempts[target] = attempts.get(target, 0) + 1
+                        log_machine(target, f'Relay of [{path}] from [{source}] failed: {result}',
+                                    log_level=LogLevel.warning)
+                        if attempts[target] < max_attempts:
+                            pending.append(target)
+                        else:
+                            failed.append(target)
+                    round_nr += 1
+            finally:
+                self.exec(f"sed -i '/ {marker}$/d' ~/.ssh/authorized_keys; rm -f {RELAY_KEY_FILE} {RELAY_KNOWN_HOSTS_FILE}")
+
+        for ip in failed:
+            ssh = self.__new_ssh(ip)
+            if fallback_src is not None:
+                log_machine(ip, f'Relay of [{path}] failed, uploading directly', log_level=LogLevel.warning)
+                ssh.scp_to_remote(fallback_src, path)
+            elif fallback_command is not None:
+                log_machine(ip, f'Relay of [{path}] failed, fetching it directly', log_level=LogLevel.warning)
+                ssh.exec(fallback_command)
+            else:
+                raise Exception(f"Relay of [{path}] to [{ip}] failed")
+            remote_digest = ssh.exec_capture(f"sha256sum {path}").split()[0]
+            if remote_digest != digest:
+                raise Exception(f"Fallback of [{path}] on [{ip}] failed, expected sha256 {digest}, found {remote_digest}")
+
+    # Generates a one-off keypair, authorizes it on all hosts and hands out the private key and the
+    # known hosts of the relay. Returns the marker of the authorized_keys entries.
+    def __authorize_relay_key(self, tmp_dir, addresses, private):
+        marker = f"scyllaso-relay-{secrets.token_hex(8)}"
+        key_file = os.path.join(tmp_dir, "relay_key")
+        subprocess.run(["ssh-keygen", "-q", "-t", "ed25519", "-N", "", "-C", marker, "-f", key_file], check=True)
+        with open(f"{key_file}.pub") as f:
+            public_key = f.read().strip()
+        # restrict disables forwarding and the pty, but the key can still run any command; so it is only
+        # authorized for the duration of the relay and, over the private network, only from the relay hosts.
+        options = "restrict"
+        if private:
+            options += f',from="{",".join(addresses.values())}"'
+
+        known_hosts_file = os.path.join(tmp_dir, "known_hosts")
+        with open(known_hosts_file, "w") as f:
+            for ip, host_keys in self.exec_capture("cat /etc/ssh/ssh_host_*_key.pub").items():
+                for host_key in host_keys.splitlines():
+                    fields = host_key.split()
+                    if len(fields) >= 2:
+                        f.write(f"{addresses[ip]} {fields[0]} {fields[1]}\n")
+
+        self.scp_to_remote(key_file, RELAY_KEY_FILE)
+        self.scp_to_remote(known_hosts_file, RELAY_KNOWN_HOSTS_FILE)
+        # entries left behind by an aborted relay are removed as well.
+        self.exec(f"""
+            set -e
+            chmod 600 {RELAY_KEY_FILE}
+            mkdir -p ~/.ssh
+            touch ~/.ssh/authorized_keys
+            sed -i '/ scyllaso-relay-[0-9a-f]*$/d' ~/.ssh/authorized_keys
+            echo '{options} {public_key}' >> ~/.ssh/authorized_keys
+            """)
+        return marker
+
+    # Returns True if the target has a verified copy, otherwise the reason it doesn't.
+    async def __relay_one(self, source, target, target_address, path, digest):
+        log_machine(target, f'Receiving [{path}] from [{source}]')
+        output = await self.__new_ssh(source).exec_capture_async(
+            f"scp -p -q -i {RELAY_KEY_FILE} -o IdentitiesOnly=yes -o BatchMode=yes -o StrictHostKeyChecking=yes "
+            f"-o UserKnownHostsFile={RELAY_KNOWN_HOSTS_FILE} {path} {self.user}@{target_address}:{path} "
+            f"&& echo relayed || echo \"scp exitcode $?\"", ignore_errors=True)
+        if output.strip().splitlines()[-1:] != ["relayed"]:
+            return output.strip() or "no output"
+        output = await self.__new_ssh(target).exec_capture_async(f"sha256sum {path} 2>/dev/null", ignore_errors=True)
+        remote_digest = output.split()[0] if output.strip() else None
+        if remote_digest != digest:
+            return f"expected sha256 {digest}, found {remote_digest}"
+        return True
+
+    def __mkdir_parent(self, path):
+        parent = os.path.dirname(path)
+        if parent:
+            self.exec(f"mkdir -p {parent}")
+
     def __set_governor(self, ip, governor):
         self.__new_ssh(ip).set_governor(governor)
 
@@ -98,70 +426,307 @@ class SSH:
                  ssh_options,
                  silent_seconds=30,
                  use_control_socket=True,
-                 log_ssh=False):
+                 log_ssh=False,
+                 connect_timeout_seconds=600):
         self.ip = ip
         self.user = user
         self.ssh_options = ssh_options
         self.silent_seconds = silent_seconds
         self.log_ssh = log_ssh
+        self.connect_timeout_seconds = connect_timeout_seconds
         if use_control_socket:
-            self.control_socket_file = f"/tmp/{self.user}@{self.ip}.socket"
+            self.session = session_pool.get(self.user, self.ip, self.ssh_options)
+            self.control_socket_file = self.session.socket_file
         else:
+            self.session = None
             self.control_socket_file = None
 
-    def __wait_for_connect(self):
-        args = f"-o ConnectTimeout=1 -o ConnectionAttempts=1 {self.ssh_options}"
+    def __connect_cmd(self):
+        # Returns the command that probes (and if enabled, opens the control master for) the connection.
+        args = ["-o", "ConnectTimeout=1", "-o", "ConnectionAttempts=1"] + self.ssh_options.split()
         if self.control_socket_file:
-            if os.path.exists(self.control_socket_file):
+            args = args + ["-M", "-S", self.control_socket_file, "-o", "ControlPersist=5m"]
+        return ["ssh"] + args + [f"{self.user}@{self.ip}", "exit"]
+
+    def __log_connect_output(self, stdout, stderr):
+        if stdout:
+            for line in stdout.splitlines():
+                log_machine(self.ip, line, log_level=LogLevel.info)
+        if stderr:
+            for line in stderr.splitlines():
+                log_machine(self.ip, line, log_level=LogLevel.warning)
+
+    def __wait_for_connect(self):
+        if self.session is None:
+            self.__connect()
+            return
+
+        with self.session.lock:
+            if self.session.is_alive():
                 return
-            args = f"{args} -M -S {self.control_socket_file} -o ControlPersist=5m"
-        cmd = f'ssh {args} {self.user}@{self.ip} exit'
+            self.__connect()
+            self.session.opened()
 
+    def __port(self):
+        options = self.ssh_options.split()
+        for i, option in enumerate(options[:-1]):
+            if option == "-p":
+                return int(options[i + 1])
+        return 22
+
+    # Before an ssh process is spawned, a cheap TCP probe checks if the ssh port accepts connections.
+    # Failed attempts are retried with exponential backoff with jitter.
+    def __connect(self):
+        cmd = self.__connect_cmd()
         exitcode = None
-        max_attempts = 300
-        for attempt in range(1, max_attempts):
-            if attempt > self.silent_seconds:
-                log_machine(self.ip, f'Trying to connect, attempt [{attempt}/{max_attempts}], command [{cmd}]')
-                result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-                if result.stdout:
-                    lines = result.stdout.splitlines()
-                    for line in lines:
-                        log_machine(self.ip, line, log_level=LogLevel.info)
-                if result.stderr:
-                    lines = result.stderr.splitlines()
-                    for line in lines:
-                        log_machine(self.ip, line, log_level=LogLevel.warning)
+        backoff = Backoff()
+        start_seconds = time.time()
+        attempt = 0
+        while time.time() - start_seconds < self.connect_timeout_seconds:
+            attempt += 1
+            verbose = time.time() - start_seconds > self.silent_seconds
+            if not tcp_probe(self.ip, self.__port()):
+                if verbose:
+                    log_machine(self.ip, f'Trying to connect, attempt [{attempt}], port {self.__port()} not reachable')
+                time.sleep(backoff.next())
+                continue
+
+            if verbose:
+                log_machine(self.ip, f'Trying to connect, attempt [{attempt}], command [{" ".join(cmd)}]')
+                result = subprocess.run(cmd, capture_output=True, text=True)
+                self.__log_connect_output(result.stdout, result.stderr)
                 exitcode = result.returncode
             else:
-                exitcode = subprocess.call(cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                exitcode = subprocess.call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
             if exitcode == 0 or exitcode == 1:  # todo: we need to deal better with exit code
                 self.wait_for_connect = False
                 return
-            time.sleep(1)
+            time.sleep(backoff.next())
+
+        raise Exception(f"Failed to connect to {self.ip}, exitcode={exitcode}")
+
+    async def __wait_for_connect_async(self):
+        # No session lock here; blocking on it would stall the event loop. In the rare case that
+        # two masters are opened concurrently, the second one fails to bind the socket and just
+        # falls back to a plain connection.
+        if self.session is not None and await self.session.is_alive_async():
+            return
+        await self.__connect_async()
+        if self.session is not None:
+            self.session.opened()
+
+    async def __connect_async(self):
+        cmd = self.__connect_cmd()
+        exitcode = None
+        backoff = Backoff()
+        start_seconds = time.time()
+        attempt = 0
+        while time.time() - start_seconds < self.connect_timeout_seconds:
+            attempt += 1
+            verbose = time.time() - start_seconds > self.silent_seconds
+            if not await tcp_probe_async(self.ip, self.__port()):
+                if verbose:
+                    log_machine(self.ip, f'Trying to connect, attempt [{attempt}], port {self.__port()} not reachable')
+                await asyncio.sleep(backoff.next())
+                continue
+
+            if verbose:
+                log_machine(self.ip, f'Trying to connect, attempt [{attempt}], command [{" ".join(cmd)}]')
+                process = await asyncio.create_subprocess_exec(*cmd,
+                                                               stdout=asyncio.subprocess.PIPE,
+                                                               stderr=asyncio.subprocess.PIPE)
+                stdout, stderr = await process.communicate()
+                self.__log_connect_output(stdout.decode(), stderr.decode())
+                exitcode = process.returncode
+            else:
+                process = await asyncio.create_subprocess_exec(*cmd,
+                                                               stdout=asyncio.subprocess.DEVNULL,
+                                                               stderr=asyncio.subprocess.DEVNULL)
+                exitcode = await process.wait()
+
+            if exitcode == 0 or exitcode == 1:  # todo: we need to deal better with exit code
+                self.wait_for_connect = False
+                return
+            await asyncio.sleep(backoff.next())
 
         raise Exception(f"Failed to connect to {self.ip}, exitcode={exitcode}")
 
     def __is_connected(self):
         return self.control_socket_file and os.path.exists(self.control_socket_file)
 
+    def __scp_options(self):
+        # scp's -S selects the ssh program, so the control socket is passed as ControlPath.
+        if self.__is_connected():
+            return f'-o ControlPath={self.control_socket_file} {self.ssh_options}'
+        return self.ssh_options
+
     def scp_from_remote(self, src, dst_dir):
         os.makedirs(dst_dir, exist_ok=True)
-        cmd = f'scp {self.ssh_options} -r -q {self.user}@{self.ip}:{src} {dst_dir}'
-        self.__scp(cmd)
+        self.__wait_for_connect()
+        self.__scp(f'scp {self.__scp_options()} -r -q {self.user}@{self.ip}:{src} {dst_dir}')
 
     def scp_to_remote(self, src, dst):
-        cmd = f'scp {self.ssh_options} -r -q {src} {self.user}@{self.ip}:{dst}'
-        self.__scp(cmd)
+        self.__wait_for_connect()
+        self.__scp(f'scp {self.__scp_options()} -r -q {src} {self.user}@{self.ip}:{dst}')
 
     def __scp(self, cmd):
-        self.__wait_for_connect()
         exitcode = subprocess.call(cmd, shell=True)
-        # raise Exception(f"Failed to execute {cmd} after {self.max_attempts} attempts")
+        if exitcode != 0:
+            raise Exception(f"Failed to execute [{cmd}], exitcode={exitcode}")
+
+    # Uploads src (a file or a directory) to dst with the same semantics as scp_to_remote, but only
+    # transfers the files whose content changed. The local sha256 digests are compared with the
+    # remote ones, which are all collected in a single round trip.
+    def upload(self, src, dst=""):
+        name = os.path.basename(os.path.normpath(src))
+        if os.path.isdir(src):
+            local_digests = {}
+            for root, dirs, files in os.walk(src):
+                for file in files:
+                    path = os.path.join(root, file)
+                    local_digests[os.path.relpath(path, src)] = sha256_file(path)
+            digest_cmd = f'cd "$target" && sha256sum -- {" ".join(shlex.quote(f) for f in local_digests)}'
+        else:
+            local_digests = {name: sha256_file(src)}
+            digest_cmd = 'sha256sum -- "$target"'
+
+        # resolve the target path the way scp does: when dst is a directory, src is copied into it.
+        output = self.exec_capture(f"""
+            target={shlex.quote(dst) if dst else "."}
+            if [ -d "$target" ]; then
+                target="$target/{name}"
+            fi
+            echo "$target"
+            if [ -e "$target" ]; then
+                {digest_cmd} 2>/dev/null
+            fi
+            true
+            """)
+        lines = output.splitlines()
+        target = lines[0]
+        remote_digests = {}
+        for line in lines[1:]:
+            fields = line.split(maxsplit=1)
+            if len(fields) == 2:
+                remote_digests[fields[1]] = fields[0]
+
+        if not os.path.isdir(src):
+            if remote_digests.get(target) == local_digests[name]:
+                log_machine(self.ip, f'Upload [{src}]: unchanged')
+                return
+            self.scp_to_remote(src, target)
+            log_machine(self.ip, f'Upload [{src}]: done')
+            return
+
+        changed = [f for f, digest in local_digests.items() if remote_digests.get(f) != digest]
+        log_machine(self.ip, f'Upload [{src}]: {len(changed)} of {len(local_digests)} files changed')
+        if not changed:
+            return
+
+        # the changed files are sent as a single tar stream over the existing connection.
+        tar = subprocess.Popen(["tar", "-cf", "-", "-C", src, "--"] + changed, stdout=subprocess.PIPE)
+        cmd_list = self.__exec_cmd_list(f"mkdir -p {shlex.quote(target)} && tar -xf - -C {shlex.quote(target)}")
+        exitcode = subprocess.call(cmd_list, stdin=tar.stdout)
+        tar.stdout.close()
+        tar_exitcode = tar.wait()
+        if exitcode != 0 or tar_exitcode != 0:
+            raise Exception(f"Failed to upload [{src}] to [{self.ip}:{target}], exitcode={exitcode}")
+
+    # Downloads the files in src_dir matching the patterns (bash globs, brace expansion is supported)
+    # into dst_dir. Instead of scp, the files are streamed as a compressed tar over the existing
+    # connection and unpacked on the fly. zstd is used when both sides have it; gzip otherwise.
+    def stream_from_remote(self, src_dir, dst_dir, *patterns, progress_interval_seconds=10):
+        os.makedirs(dst_dir, exist_ok=True)
+        if not patterns:
+            patterns = ("*",)
 
-    def exec(self, command, ignore_errors=False):
         self.__wait_for_connect()
 
+        script = f"""
+            set -e
+            shopt -s nullglob
+            cd {src_dir}
+            files=( {" ".join(patterns)} )
+            if [ ${{#files[@]}} -eq 0 ]; then
+                exit 0
+            fi
+            if {"hash zstd 2>/dev/null" if shutil.which("zstd") else "false"}; then
+                tar -cf - "${{files[@]}}" | zstd -q -c -T0
+            else
+                tar -cf - "${{files[@]}}" | gzip -c -1
+            fi
+            """
+        cmd_list = self.__exec_cmd_list(f"bash -c {shlex.quote(script)}")
+        if self.log_ssh:
+            log_machine(self.ip, cmd_list)
+
+        process = subprocess.Popen(cmd_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stderr_thread = Thread(target=self.__log_lines, args=(process.stderr, LogLevel.warning))
+        stderr_thread.start()
+
+        unpack = None
+        bytes_received = 0
+        start_seconds = time.time()
+        next_progress_seconds = start_seconds + progress_interval_seconds
+        streaming = True
+        try:
+            while True:
+                data = process.stdout.read1(1024 * 1024)
+                if not data:
+                    streaming = False
+                    break
+
+                if unpack is None:
+                    # the magic number tells which compressor the remote side picked.
+                    if data.startswith(b"\x28\xb5\x2f\xfd"):
+                        unpack_cmd = ["tar", "-x", "-C", dst_dir, "-I", "zstd"]
+                    else:
+                        unpack_cmd = ["tar", "-xz", "-C", dst_dir]
+                    unpack = subprocess.Popen(unpack_cmd, stdin=subprocess.PIPE)
+
+                try:
+                    unpack.stdin.write(data)
+                except BrokenPipeError:
+                    # the unpacking tar died; its exitcode is reported below.
+                    break
+                bytes_received += len(data)
+
+                now = time.time()
+                if now >= next_progress_seconds:
+                    next_progress_seconds = now + progress_interval_seconds
+                    self.__log_transfer(src_dir, bytes_received, now - start_seconds)
+        finally:
+            if streaming:
+                # nobody drains stdout anymore, so ssh could block on it forever.
+                process.kill()
+            unpack_exitcode = 0
+            if unpack is not None:
+                try:
+                    unpack.stdin.close()
+                except BrokenPipeError:
+                    pass
+                unpack_exitcode = unpack.wait()
+            exitcode = process.wait()
+            process.stdout.close()
+            stderr_thread.join()
+
+        if unpack_exitcode != 0:
+            raise Exception(f"Failed to unpack [{src_dir}] from [{self.ip}], exitcode={unpack_exitcode}")
+        if exitcode != 0:
+            raise Exception(f"Failed to stream [{src_dir}] from [{self.ip}], exitcode={exitcode}")
+        self.__log_transfer(src_dir, bytes_received, time.time() - start_seconds)
+
+    def __log_transfer(self, src_dir, bytes_received, duration_seconds):
+        rate = bytes_received / duration_seconds if duration_seconds > 0 else 0
+        log_machine(self.ip, f'Streamed [{src_dir}]: {bytes_received / (1024 * 1024):.1f} MB compressed, '
+                             f'{rate / (1024 * 1024):.1f} MB/s')
+
+    def __log_lines(self, stream, log_level):
+        for line in stream:
+            log_machine(self.ip, line.decode(errors="replace").rstrip("\n"), log_level)
+
+    def __exec_cmd_list(self, command):
         cmd_list = ["ssh"]
         if self.__is_connected():
             cmd_list.append("-S")
@@ -169,6 +734,24 @@ class SSH:
         cmd_list.extend(self.ssh_options.split())
         cmd_list.append(f"{self.user}@{self.ip}")
         cmd_list.append(command)
+        return cmd_list
+
+    def __check_exitcode(self, cmd_list, exitcode, ignore_errors):
+        if ignore_errors or exitcode == 0 or exitcode == 1:  # todo: we need to deal better with exit code
+            return
+        raise Exception(f"Failed to execute [{cmd_list}], exitcode={exitcode}")
+
+    def __line_handler(self, stdout_handler, log_level):
+        if log_level == LogLevel.info and stdout_handler is not None:
+            return stdout_handler
+        return lambda line: log_machine(self.ip, line, log_level)
+
+    # If a stdout_handler is provided, it is called with every line the command writes to stdout
+    # instead of that line being logged.
+    def exec(self, command, ignore_errors=False, stdout_handler=None):
+        self.__wait_for_connect()
+
+        cmd_list = self.__exec_cmd_list(command)
 
         if self.log_ssh:
             log_machine(self.ip, cmd_list)
@@ -176,99 +759,95 @@ class SSH:
         process = subprocess.Popen(cmd_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
         sel = selectors.DefaultSelector()
-        sel.register(process.stdout, selectors.EVENT_READ)
-        sel.register(process.stderr, selectors.EVENT_READ)
+        sel.register(process.stdout, selectors.EVENT_READ, self.__line_handler(stdout_handler, LogLevel.info))
+        sel.register(process.stderr, selectors.EVENT_READ, self.__line_handler(stdout_handler, LogLevel.warning))
 
-        while True:
+        # partial lines are buffered until their newline arrives.
+        pending = {process.stdout: b"", process.stderr: b""}
+        while sel.get_map():
             for key, _ in sel.select():
-                data = key.fileobj.read1().decode()
+                data = key.fileobj.read1()
                 if not data:
-                    exitcode = process.poll()
-                    if ignore_errors or exitcode == 0 or exitcode == 1:  # todo: we need to deal better with exit code
-                        return
-                    else:
-                        raise Exception(f"Failed to execute [{cmd_list}], exitcode={exitcode}")
-                lines = data.splitlines()
-                log_level = LogLevel.info if key.fileobj is process.stdout else LogLevel.warning
+                    sel.unregister(key.fileobj)
+                    if pending[key.fileobj]:
+                        key.data(pending[key.fileobj].decode(errors="replace"))
+                    continue
+                lines = (pending[key.fileobj] + data).split(b"\n")
+                pending[key.fileobj] = lines.pop()
                 for line in lines:
-                    log_machine(self.ip, line, log_level)
+                    key.data(line.decode(errors="replace"))
+
+        self.__check_exitcode(cmd_list, process.wait(), ignore_errors)
+
+    async def __handle_stream(self, stream, handler):
+        while True:
+            line = await stream.readline()
+            if not line:
+                return
+            handler(line.decode(errors="replace").rstrip("\n"))
+
+    # The coroutine flavor of exec; it doesn't need a thread per host so PSSH uses it to
+    # drive many hosts from a single event loop.
+    async def exec_async(self, command, ignore_errors=False, stdout_handler=None):
+        await self.__wait_for_connect_async()
+
+        cmd_list = self.__exec_cmd_list(command)
+
+        if self.log_ssh:
+            log_machine(self.ip, cmd_list)
+
+        process = await asyncio.create_subprocess_exec(*cmd_list,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.PIPE,
+                                                       limit=1024 * 1024)
+        await asyncio.gather(self.__handle_stream(process.stdout, self.__line_handler(stdout_handler, LogLevel.info)),
+                             self.__handle_stream(process.stderr, self.__line_handler(stdout_handler, LogLevel.warning)))
+        self.__check_exitcode(cmd_list, await process.wait(), ignore_errors)
 
     def async_exec(self, command):
-        thread = WorkerThread(self.exec, (command))
+        thread = WorkerThread(self.exec, (command,))
         thread.start()
         return thread.future
 
-    def update(self):
-        log_machine(self.ip, f'Update: started')
-        self.exec(
-            f"""
-            set -e
-            if [ -f /tmp/update.called ] ; then
-                # echo "Skipping update"
-                exit 0
-            fi
+    # Returns the stdout of the command instead of logging it.
+    def exec_capture(self, command, ignore_errors=False):
+        lines = []
+        self.exec(command, ignore_errors=ignore_errors, stdout_handler=lines.append)
+        return "\n".join(lines)
 
-            if hash apt-get 2>/dev/null; then
-                sudo apt-get -y -qq update
-            elif hash yum 2>/dev/null; then
-                sudo yum -y -q update
-            else
-                echo "Cannot update: yum/apt not found"
-                exit 1
-            fi
+    async def exec_capture_async(self, command, ignore_errors=False):
+        lines = []
+        await self.exec_async(command, ignore_errors=ignore_errors, stdout_handler=lines.append)
+        return "\n".join(lines)
 
-            touch /tmp/update.called
-            """)
+    def batch(self):
+        return CommandBatch(self)
+
+    # Returns the list of StepResults.
+    def exec_batch(self, batch):
+        output = BatchOutput(self.ip, batch)
+        self.exec(batch.script(), ignore_errors=True, stdout_handler=output.handle_line)
+        return output.results()
+
+    async def exec_batch_async(self, batch):
+        output = BatchOutput(self.ip, batch)
+        await self.exec_async(batch.script(), ignore_errors=True, stdout_handler=output.handle_line)
+        return output.results()
+
+    def update(self):
+        log_machine(self.ip, f'Update: started')
+        self.exec(update_script())
         log_machine(self.ip, f'Update: done')
 
     def install_one(self, *packages):
-        self.exec(
-            f"""
-            set -e
-            for package in {" ".join(packages)} 
-            do                
-                echo Trying package [$package]
-                if hash apt-get 2>/dev/null ; then
-                    if sudo apt show $package >/dev/null 2>&1; then
-                        echo      [{self.ip}] Installing $package
-                        sudo apt-get install -y -qq $package
-                        exit 0
-                    fi    
-                elif hash yum 2>/dev/null; then
-                    if sudo yum info $package >/dev/null 2>&1; then
-                        echo      [{self.ip}] Installing $package
-                        sudo yum -y -q install $package
-                        exit 0
-                    fi                        
-                else
-                    echo "     [{self.ip}] Cannot install $package: yum/apt not found"
-                    exit 1
-                fi
-                    
-                echo Not found $package                       
-            done
-            echo "Could not find any of the packages from {packages}"
-            exit 1
-            """)
+        self.exec(install_one_script(packages))
 
     def try_install(self, *packages):
         self.install(*packages, ignore_errors=True)
 
     def install(self, *packages, ignore_errors=False):
-        for package in packages:
-            log_machine(self.ip, f'Install: {package}')
-            self.exec(
-                f"""
-                set -e
-                if hash apt-get 2>/dev/null; then
-                    sudo apt-get install -y -qq {package}
-                elif hash yum 2>/dev/null; then
-                    sudo yum -y -q install {package}
-                else
-                    echo "Cannot install {package}: yum/apt not found"
-                    exit 1
-                fi
-                """, ignore_errors=ignore_errors)
+        log_machine(self.ip, f'Install: {" ".join(packages)}')
+        self.exec(install_script(packages, ignore_errors=ignore_errors), ignore_errors=ignore_errors)
 
     def set_file_property(self, file_path, property, seperator, value):
         self.exec(f"""
@@ -313,3 +892,207 @@ class SSH:
                 echo "Skipping set governor, [{governor}] is not supported"
             fi             
         """)
+
+
+# The package scripts leave a marker file in /tmp behind that fingerprints the requested
+# package set; a re-run with the exact same set is skipped.
+def packages_marker(kind, packages):
+    digest = hashlib.sha1(" ".join(sorted(packages)).encode()).hexdigest()[:12]
+    return f"/tmp/scyllaso-{kind}-{digest}.done"
+
+
+def update_script():
+    return f"""
+            set -e
+            if [ -f /tmp/update.called ] ; then
+                # echo "Skipping update"
+                exit 0
+            fi
+
+            if hash apt-get 2>/dev/null; then
+                sudo apt-get -y -qq update
+            elif hash yum 2>/dev/null; then
+                sudo yum -y -q update
+            else
+                echo "Cannot update: yum/apt not found"
+                exit 1
+            fi
+
+            touch /tmp/update.called
+            """
+
+
+# Installs all packages in a single package manager transaction. With ignore_errors, the packages
+# that can't be found are skipped instead of failing the whole transaction.
+def install_script(packages, ignore_errors=False):
+    marker = packages_marker("try-install" if ignore_errors else "install", packages)
+    resolve = ""
+    if ignore_errors:
+        resolve = f"""
+            packages=""
+            for package in {" ".join(packages)}
+            do
+                if [ "$manager" = "apt-get" ] && sudo apt show $package >/dev/null 2>&1; then
+                    packages="$packages $package"
+                elif [ "$manager" = "yum" ] && sudo yum info $package >/dev/null 2>&1; then
+                    packages="$packages $package"
+                else
+                    echo "Skipping $package: not found"
+                fi
+            done
+            if [ -z "$packages" ]; then
+                exit 0
+            fi
+            """
+    return f"""
+            set -e
+            if [ -f {marker} ]; then
+                echo "Already installed: {" ".join(packages)}"
+                exit 0
+            fi
+
+            if hash apt-get 2>/dev/null; then
+                manager="apt-get"
+            elif hash yum 2>/dev/null; then
+                manager="yum"
+            else
+                echo "Cannot install {" ".join(packages)}: yum/apt not found"
+                exit 1
+            fi
+
+            packages="{" ".join(packages)}"
+            {resolve}
+            if [ "$manager" = "apt-get" ]; then
+                sudo apt-get install -y -qq $packages
+            else
+                sudo yum -y -q install $packages
+            fi
+
+            touch {marker}
+            """
+
+
+# Installs the first package that is available.
+def install_one_script(packages):
+    marker = packages_marker("install-one", packages)
+    return f"""
+            set -e
+            if [ -f {marker} ]; then
+                echo "Already installed one of: {" ".join(packages)}"
+                exit 0
+            fi
+
+            for package in {" ".join(packages)} 
+            do                
+                echo Trying package [$package]
+                if hash apt-get 2>/dev/null ; then
+                    if sudo apt show $package >/dev/null 2>&1; then
+                        echo Installing $package
+                        sudo apt-get install -y -qq $package
+                        touch {marker}
+                        exit 0
+                    fi    
+                elif hash yum 2>/dev/null; then
+                    if sudo yum info $package >/dev/null 2>&1; then
+                        echo Installing $package
+                        sudo yum -y -q install $package
+                        touch {marker}
+                        exit 0
+                    fi                        
+                else
+                    echo "Cannot install $package: yum/apt not found"
+                    exit 1
+                fi
+                    
+                echo Not found $package                       
+            done
+            echo "Could not find any of the packages from {packages}"
+            exit 1
+            """
+
+
+StepResult = namedtuple('StepResult', ['name', 'exitcode', 'duration_seconds', 'output'])
+
+
+# Queues up commands and ships them as a single remote script, so a sequence of steps costs a
+# single ssh round trip instead of one per step. Every step runs in its own subshell with stderr
+# merged into stdout; the exit code, duration and output of each step are reported back as a
+# StepResult. Just like exec, exit codes 0 and 1 are considered a success; on any other exit code
+# the remaining steps are skipped, unless the step was added with ignore_errors.
+#
+# Usage:
+#   batch = ssh.batch()
+#   batch.add("sudo systemctl stop scylla-server")
+#   batch.add("sudo rm -rf /var/lib/scylla/data/*")
+#   results = batch.exec()
+class CommandBatch:
+    MARKER = "##scyllaso-step##"
+
+    def __init__(self, target):
+        self.target = target
+        self.steps = []
+
+    def add(self, command, name=None, ignore_errors=False):
+        if name is None:
+            lines = command.strip().splitlines()
+            name = lines[0].strip() if lines else command
+        self.steps.append((name, command, ignore_errors))
+        return self
+
+    def script(self):
+        lines = []
+        for index, (name, command, ignore_errors) in enumerate(self.steps):
+            lines.append(f"echo '{self.MARKER} begin {index}'")
+            lines.append("__sso_start=$(date +%s%N)")
+            lines.append("(")
+            lines.append(command)
+            lines.append(") 2>&1")
+            lines.append("__sso_exitcode=$?")
+            # the extra echo makes sure the marker starts on its own line.
+            lines.append(f'echo; echo "{self.MARKER} end {index} $__sso_exitcode $__sso_start $(date +%s%N)"')
+            if not ignore_errors:
+                lines.append("if [ $__sso_exitcode -ne 0 ] && [ $__sso_exitcode -ne 1 ]; then exit $__sso_exitcode; fi")
+        return "\n".join(lines)
+
+    def exec(self):
+        return self.target.exec_batch(self)
+
+
+# Demultiplexes the output of a CommandBatch script into StepResults.
+class BatchOutput:
+
+    def __init__(self, ip, batch):
+        self.ip = ip
+        self.batch = batch
+        self.step_results = []
+        self.output = None
+
+    def handle_line(self, line):
+        if not line.startswith(CommandBatch.MARKER):
+            if self.output is not None:
+                self.output.append(line)
+            log_machine(self.ip, line)
+            return
+
+        fields = line.split()
+        if fields[1] == "begin":
+            self.output = []
+            return
+
+        index, exitcode, start_ns, end_ns = [int(field) for field in fields[2:6]]
+        output = self.output or []
+        # strip the newline that was added in front of the end marker.
+        while output and not output[-1]:
+            output.pop()
+        name = self.batch.steps[index][0]
+        self.step_results.append(StepResult(name, exitcode, (end_ns - start_ns) / 1_000_000_000, "\n".join(output)))
+        self.output = None
+
+    def results(self):
+        for index, (name, command, ignore_errors) in enumerate(self.batch.steps):
+            if index >= len(self.step_results):
+                raise Exception(f"Failed to execute step [{name}] on [{self.ip}], no result was reported")
+            exitcode = self.step_results[index].exitcode
+            if not ignore_errors and exitcode != 0 and exitcode != 1:
+                raise Exception(f"Failed to execute step [{name}] on [{self.ip}], exitcode={exitcode}")
+        return self.step_results
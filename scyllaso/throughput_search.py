@@ -0,0 +1,186 @@
+import os
+import csv
+from collections import namedtuple
+from scyllaso.common import Iteration
+from scyllaso.hdr import parse_profile_summary_file
+from scyllaso.slo import SloGuard, LatencySlo
+from scyllaso.util import log_important, log
+
+# A single measured rate; summaries maps the operation name (e.g. 'WRITE') to its ProfileSummaryResult.
+CurvePoint = namedtuple('CurvePoint', ['phase', 'rate', 'duration_minutes', 'passed', 'summaries', 'iteration_dir'])
+
+SearchResult = namedtuple('SearchResult', ['knee_rate', 'points'])
+
+
+class MaxThroughputSearch:
+    """
+    Finds the highest rate at which the latency stays within the limit, without a full duration
+    run for every rate step:
+
+    1. ramp: short probes starting at start_rate, multiplying the rate by ramp_factor until a probe fails.
+    2. bisect: short probes between the last passing and the first failing rate until they are
+       at most resolution apart.
+    3. confirm: a full duration run at the found rate. If it fails, the rate is lowered by
+       resolution and confirmed again, at most confirm_attempts times.
+
+    Every probe and confirmation is a regular Iteration in trials/<trial_name>/cassandra-stress-<rate>
+    with the usual parsed_profile_summary_file.txt, and all measured points are written to
+    trials/<trial_name>/curve.csv. Probes are aborted early once the latency limit is exceeded for
+    slo_consecutive_intervals consecutive seconds.
+
+    Parameters
+    ----------
+    cs: CassandraStress
+        The load generators.
+    command: function
+        Called with (rate, duration_minutes) and returns the cassandra-stress command for that
+        total rate in ops/s over all load generators. The command needs to log the hdr file as
+        profile.hdr.
+    operations: list
+        The operation names in the summary, e.g. ['WRITE', 'READ'].
+    max_latency_ms: float
+        The latency limit for every operation.
+    latency_field: str
+        The ProfileSummaryResult field that is compared against max_latency_ms.
+    min_throughput_ratio: float
+        A rate also fails when less than this fraction of it was actually achieved; the load
+        generators couldn't keep up, so the system is saturated.
+    properties: dict
+        The profile properties, recorded with every iteration in the results catalog.
+    environment: dict
+        The environment, recorded with every iteration in the results catalog.
+    """
+
+    def __init__(self, cs, trial_name, command, operations, max_latency_ms,
+                 start_rate=10000, max_rate=10_000_000, ramp_factor=2.0, resolution=5000,
+                 probe_duration_minutes=5, full_duration_minutes=30, confirm_attempts=3,
+                 latency_field='p90_latency_ms', min_throughput_ratio=0.9, slo_consecutive_intervals=30,
+                 properties=None, environment=None):
+        self.cs = cs
+        self.trial_name = trial_name
+        self.command = command
+        self.operations = operations
+        self.max_latency_ms = max_latency_ms
+        self.start_rate = start_rate
+        self.max_rate = max_rate
+        self.ramp_factor = ramp_factor
+        self.resolution = resolution
+        self.probe_duration_minutes = probe_duration_minutes
+        self.full_duration_minutes = full_duration_minutes
+        self.confirm_attempts = confirm_attempts
+        self.latency_field = latency_field
+        self.min_throughput_ratio = min_throughput_ratio
+        self.slo_consecutive_intervals = slo_consecutive_intervals
+        self.properties = properties
+        self.environment = environment
+        self.points = []
+
+    def __slo(self):
+        percentile = {'median_latency_ms': 50.0, 'p90_latency_ms': 90.0, 'p99_latency_ms': 99.0,
+                      'p99_9_latency_ms': 99.9, 'p99_99_latency_ms': 99.99,
+                      'p99_999_latency_ms': 99.999}.get(self.latency_field)
+        if percentile is None:
+            return None
+        return SloGuard(LatencySlo(percentile, self.max_latency_ms,
+                                   consecutive_intervals=self.slo_consecutive_intervals))
+
+    def __passed(self, rate, summaries, slo):
+        if slo is not None and slo.failed:
+            return False
+        total_throughput = 0.0
+        for operation, summary in summaries.items():
+            latency_ms = getattr(summary, self.latency_field)
+            if latency_ms > self.max_latency_ms:
+                log(f"{operation} {self.latency_field} {latency_ms}ms above {self.max_latency_ms}ms")
+                return False
+            total_throughput += summary.throughput_per_second
+        if total_throughput < rate * self.min_throughput_ratio:
+            log(f"Throughput {total_throughput:.0f} ops/s is less than {self.min_throughput_ratio} of rate {rate}")
+            return False
+        return True
+
+    def measure(self, phase, rate, duration_minutes):
+        log_important(f"MaxThroughputSearch {phase} rate={rate} duration={duration_minutes}m: started")
+        iteration = Iteration(f'{self.trial_name}/cassandra-stress-{rate}', ignore_git=True,
+                              properties=self.properties, environment=self.environment)
+        slo = self.__slo()
+        self.cs.stress(self.command(rate, duration_minutes), slo=slo)
+        self.cs.collect_results(iteration.dir)
+
+        summaries = {}
+        for operation in self.operations:
+            try:
+                summaries[operation] = parse_profile_summary_file(f'{iteration.dir}/profile-summary.txt', operation)
+            except KeyError:
+                # a probe that got aborted right away may not have recorded the operation at all.
+                if slo is None or not slo.failed:
+                    raise
+        with open(f'{iteration.dir}/parsed_profile_summary_file.txt', 'a') as writer:
+            for operation, summary in summaries.items():
+                writer.write(f'{operation}_PROFILE: {summary}\n')
+            if slo is not None and slo.failed:
+                writer.write(f'SLO_VIOLATION: {slo.violation}\n')
+
+        passed = self.__passed(rate, summaries, slo)
+        point = CurvePoint(phase, rate, duration_minutes, passed, summaries, iteration.dir)
+        self.points.append(point)
+        self.__write_curve(os.path.join(iteration.trials_dir, self.trial_name))
+        log_important(f"MaxThroughputSearch {phase} rate={rate}: {'passed' if passed else 'failed'}")
+        return passed
+
+    def __write_curve(self, trial_dir):
+        with open(os.path.join(trial_dir, 'curve.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['phase', 'rate', 'duration_minutes', 'passed', 'operation', 'throughput_per_second',
+                             'mean_latency_ms', 'median_latency_ms', 'p90_latency_ms', 'p99_latency_ms',
+                             'p99_9_latency_ms', 'p99_99_latency_ms', 'iteration_dir'])
+            for point in self.points:
+                for operation, summary in point.summaries.items():
+                    writer.writerow([point.phase, point.rate, point.duration_minutes, point.passed, operation,
+                                     summary.throughput_per_second, summary.mean_latency_ms,
+                                     summary.median_latency_ms, summary.p90_latency_ms, summary.p99_latency_ms,
+                                     summary.p99_9_latency_ms, summary.p99_99_latency_ms, point.iteration_dir])
+
+    def __round(self, rate):
+        return max(self.resolution, int(rate // self.resolution) * self.resolution)
+
+    def run(self):
+        """
+        Runs the search and returns a SearchResult with the confirmed knee rate (0 if no rate
+        passed) and all measured CurvePoints.
+        """
+        lo, hi = 0, None
+
+        rate = self.start_rate
+        while rate <= self.max_rate:
+            if not self.measure('ramp', rate, self.probe_duration_minutes):
+                hi = rate
+                break
+            lo = rate
+            rate = self.__round(rate * self.ramp_factor)
+
+        if hi is None:
+            log(f"No failing rate up to max_rate {self.max_rate}")
+            hi = lo
+
+        while hi - lo > self.resolution:
+            rate = self.__round((lo + hi) // 2)
+            if rate <= lo or rate >= hi:
+                break
+            if self.measure('bisect', rate, self.probe_duration_minutes):
+                lo = rate
+            else:
+                hi = rate
+
+        knee_rate = 0
+        rate = lo
+        for _ in range(self.confirm_attempts):
+            if rate <= 0:
+                break
+            if self.measure('confirm', rate, self.full_duration_minutes):
+                knee_rate = rate
+                break
+            rate -= self.resolution
+
+        log_important(f"MaxThroughputSearch: knee at rate {knee_rate}")
+        return SearchResult(knee_rate, list(self.points))
@@ -1,7 +1,12 @@
+import asyncio
 import enum
+import os
+import hashlib
+import random
 import shlex
 import subprocess
 import selectors
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from threading import Thread
 from threading import Lock, Condition
@@ -69,6 +74,46 @@ def run_parallel(target, args_list, ignore_errors=False):
             raise Exception() from thread.exception
 
 
+def run_async_parallel(target, args_list, max_concurrency=None, ignore_errors=False):
+    # Counterpart of run_parallel for coroutine functions: all calls are multiplexed on a single
+    # event loop instead of a thread each. max_concurrency caps the number of calls in flight.
+    async def run_all():
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+        async def run_one(args):
+            if semaphore is None:
+                return await target(*args)
+            async with semaphore:
+                return await target(*args)
+
+        return await asyncio.gather(*[run_one(args) for args in args_list], return_exceptions=True)
+
+    results = asyncio.run(run_all())
+    if not ignore_errors:
+        for result in results:
+            if isinstance(result, Exception):
+                raise Exception() from result
+    return results
+
+
+def run_process_parallel(tasks, max_workers=None):
+    # Runs independent tasks on a process pool, by default on as many processes as there are cores;
+    # tasks maps a key to (target, args). The target needs to be picklable, so a module level
+    # function. Returns the results by key.
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        futures = {executor.submit(target, *args): key for key, (target, args) in tasks.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                for f in futures:
+                    f.cancel()
+                raise Exception(f"Task [{key}] failed") from e
+    return results
+
+
 class WorkerThreadLoop(Thread):
 
     def __init__(self, target, args):
@@ -89,6 +134,24 @@ class WorkerThreadLoop(Thread):
         self.stopped = True
 
 
+# Exponential backoff with jitter. Every call to next returns the next delay in seconds. The jitter
+# randomly shortens the delay so that many waiters that started at the same moment, e.g. the
+# nodes of a freshly provisioned fleet, don't all retry in lockstep.
+class Backoff:
+
+    def __init__(self, initial_seconds=0.1, max_seconds=5.0, factor=2.0, jitter=0.5):
+        self.initial_seconds = initial_seconds
+        self.max_seconds = max_seconds
+        self.factor = factor
+        self.jitter = jitter
+        self.attempt = 0
+
+    def next(self):
+        delay = min(self.max_seconds, self.initial_seconds * (self.factor ** self.attempt))
+        self.attempt += 1
+        return delay * (1 - self.jitter * random.random())
+
+
 def find_java(properties):
     path = properties.get("jvm_path")
     if path:
@@ -101,6 +164,14 @@ def find_java(properties):
         raise RuntimeError("Could not locate java")
 
 
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 def join_all(*futures):
     for f in futures:
         f.join()
@@ -12,7 +12,8 @@ setup(
     long_description_content_type='text/markdown',
     url='https://github.com/scylladb/scylla-stress-orchestrator',
     packages=find_packages(),
-    python_requires='>=3.7',
+    python_requires='>=3.8',
+    install_requires=['numpy'],
     project_urls={
         'Bug Tracker': 'https://github.com/scylladb/scylla-stress-orchestrator/issues',
     },
@@ -33,6 +34,8 @@ setup(
             'flamegraph_cpu = scyllaso.bin.flamegraph_cpu:cli',
             'provision_terraform = scyllaso.bin.provision_terraform:provision',
             'unprovision_terraform = scyllaso.bin.provision_terraform:unprovision',
+            'latency_throughput_report = scyllaso.bin.latency_throughput_report:cli',
+            'results_catalog = scyllaso.bin.results_catalog:cli',
         ],
     }
 )